@@ -0,0 +1,103 @@
+"""
+Time the DOM of a large generated page with each bs4 backend, e.g.,
+
+    python benchmarks/html_parser.py --sections 2000
+
+The page is parsed and serialized as the callbacks of a document do, through
+`original_posting.dom`, with an id set on every heading in between, as
+'@toc' does. The outputs of the backends are then checked to be the same
+page: the same tags, attributes and text, in the same order, if not the same
+bytes.
+"""
+from __future__ import annotations
+from original_posting.dom import DocumentDom, make_soup
+from original_posting.types import OPDocument, Runtime
+import pathlib
+import random
+import time
+import wisepy2
+
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor".split()
+
+
+def generate(sections: int, seed: int = 0) -> str:
+    rand = random.Random(seed)
+
+    def text(n: int):
+        return " ".join(rand.choices(WORDS, k=n))
+
+    parts = ["<style>pre { line-height: 125%; }</style>\n"]
+    for i in range(sections):
+        parts.append(f"<h2>Section {i}: {text(3)}</h2>\n")
+        parts.append(
+            f"<p>{text(20)} <a href=\"#s{i}\">{text(2)}</a> <em>{text(3)}</em>"
+            f"<sup><a href=\"#fn{i}\">[{i}]</a></sup> {text(10)} &amp; &lt;x&gt;</p>\n"
+        )
+        parts.append(
+            '<div class="highlight"><pre><span></span>'
+            f'<span class="k">def</span> <span class="nf">f{i}</span>'
+            '<span class="p">():</span> <span class="k">return</span> '
+            f'<span class="mi">{i}</span>\n</pre></div>\n'
+        )
+        parts.append("<ul>" + "".join(f"<li>{text(4)}</li>" for _ in range(3)) + "</ul>\n")
+    return "".join(parts)
+
+
+def render(code: str) -> tuple[str, float, float]:
+    here = pathlib.Path.cwd()
+    doc = OPDocument("bench.op", here, here / "bench.op", here, here / "bench.html", {})
+    doc.code = code
+    dom = DocumentDom(doc)
+    t0 = time.perf_counter()
+    soup = dom.get()
+    t1 = time.perf_counter()
+    for n, h2 in enumerate(soup.find_all("h2")):
+        h2["id"] = f"h{n}"
+    t2 = time.perf_counter()
+    dom.flush()
+    return doc.code, t1 - t0, time.perf_counter() - t2
+
+
+def shape(code: str) -> list[tuple[str, list[tuple[str, str]], str]]:
+    """The tags of `code`, with their attributes and own text, in document order."""
+    soup = make_soup(code)
+    return [
+        (
+            tag.name,
+            sorted((k, str(v)) for k, v in tag.attrs.items()),
+            "".join(tag.find_all(string=True, recursive=False)),
+        )
+        for tag in soup.find_all(True)
+        if tag.name not in ("html", "head", "body")
+    ]
+
+
+def main(*, sections: int = 2000, repeat: int = 3, parsers: str = "html.parser;lxml"):
+    """
+    sections : sections of the generated page, each with a heading, a paragraph, code and a list.
+    repeat   : times to render the page with each backend; the best times are printed.
+    parsers  : the backends to compare, separated by ';'.
+    """
+    code = generate(sections)
+    print(f"{len(code) / 1e6:.1f} MB page")
+    outputs: dict[str, str] = {}
+    for parser in filter(None, parsers.split(";")):
+        Runtime.html_parser = parser
+        best_parse = best_serialize = float("inf")
+        for _ in range(repeat):
+            outputs[parser], parse, serialize = render(code)
+            best_parse = min(best_parse, parse)
+            best_serialize = min(best_serialize, serialize)
+        print(
+            f"{parser:>12}: parse {best_parse * 1000:.1f} ms,"
+            f" serialize {best_serialize * 1000:.1f} ms, best of {repeat}"
+        )
+    Runtime.html_parser = "html.parser"
+    shapes = {parser: shape(output) for parser, output in outputs.items()}
+    same = all(each == next(iter(shapes.values())) for each in shapes.values())
+    identical = len(set(outputs.values())) == 1
+    print("identical pages" if identical else "same pages" if same else "the pages differ")
+
+
+if __name__ == "__main__":
+    wisepy2.wise(main)()
@@ -0,0 +1,68 @@
+"""
+Time `parsing.process` on a large generated source, e.g.,
+
+    python benchmarks/parsing.py --size 3000000
+
+The source is mostly plain text, with '@py' commands, operators, escaped and
+stray '@'s, and '@comment'/'@plain' blocks. The digest of the output is
+printed too, to check that another version renders the same page.
+"""
+from __future__ import annotations
+from original_posting.parsing import process
+from original_posting.types import OPDocument
+import hashlib
+import pathlib
+import random
+import time
+import wisepy2
+
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor".split()
+
+
+def generate(size: int, blocks: float, seed: int = 0) -> str:
+    rand = random.Random(seed)
+
+    def line():
+        return " ".join(rand.choices(WORDS, k=12))
+
+    parts = []
+    n = 0
+    while n < size:
+        r = rand.random()
+        if r < blocks:
+            s = "@begin comment\n" + "\n".join(line() for _ in range(200)) + "\n@end comment\n"
+        elif r < 2 * blocks:
+            s = "@begin plain\n" + "\n".join(line() for _ in range(50)) + " @x|y| \n@end plain\n"
+        elif r < 0.10:
+            s = "value @py|%d + 1| and @(op) \\@escaped mail a@b.c\n" % rand.randint(0, 99)
+        else:
+            s = line() + "\n"
+        parts.append(s)
+        n += len(s)
+    return "".join(parts)
+
+
+def main(*, size: int = 3_000_000, blocks: float = 0.02, repeat: int = 3):
+    """
+    size   : characters of the generated source.
+    blocks : the share of '@comment' blocks, and of '@plain' blocks, among the chunks.
+    repeat : times to render the source; the best time is printed.
+    """
+    source = generate(size, blocks)
+    here = pathlib.Path.cwd()
+    doc = OPDocument("bench.op", here, here / "bench.op", here, here / "bench.html", {})
+    best = float("inf")
+    output = ""
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        output = process("bench.op", source, {}, doc)
+        best = min(best, time.perf_counter() - t0)
+    digest = hashlib.sha1(output.encode("utf-8")).hexdigest()[:12]
+    print(
+        f"{len(source) / 1e6:.1f} MB source -> {len(output) / 1e6:.2f} MB output,"
+        f" best of {repeat}: {best * 1000:.1f} ms, sha1 {digest}"
+    )
+
+
+if __name__ == "__main__":
+    wisepy2.wise(main)()
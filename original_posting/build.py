@@ -1,14 +1,33 @@
 from __future__ import annotations
 from collections import deque
 from dataclasses import dataclass
-from original_posting.parsing import process
-from original_posting.utils import get_relative_path
+from original_posting.parsing import process, SourceTree
+from original_posting.codegen import RenderCache
+from original_posting.dom import h1_text, run_callbacks
+from original_posting.incremental import (
+    BUILD_NAMES,
+    DocTrace,
+    IncrementalState,
+    TrackedDocs,
+    TrackedStorage,
+    runtime_state,
+)
+from original_posting.parallel import RenderPool
+from original_posting.metadata import METADATA_FILENAME, MetadataStore, code_digest
+from original_posting.registry import commands
+from original_posting.utils import get_relative_path, gensym_count
 from original_posting.types import OPDocument
 import original_posting.builtin_names as names
+import contextlib
 import pathlib
 import typing
 import warnings
+import hashlib
 import os
+import sqlite3
+import sys
+
+CACHE_DIRNAME = ".op-cache"
 
 
 @dataclass
@@ -16,6 +35,12 @@ class BuildOptions:
     force: bool
     suffix: str
     outdir: str
+    cache: bool = False
+    compile: bool = False
+    incremental: bool = False
+    jobs: int = 1
+    dom_report: bool = False
+    search_index: bool = False
 
 
 class Build:
@@ -24,25 +49,103 @@ class Build:
         project_path: str | pathlib.Path,
         files_to_build: typing.Sequence[str],
         opts: BuildOptions,
+        trees: typing.MutableMapping[str, SourceTree] | None = None,
+        render_cache: RenderCache | None = None,
     ):
+        """
+        trees        : parsed documents kept in memory between builds, by source path.
+        render_cache : compiled render functions kept in memory between builds, for `opts.compile`.
+        """
         self.files_to_build: deque[OPDocument] = deque()
         self.processed_files: set[str] = set()
-        self.built_docs: dict[str, OPDocument] = {}
+        self.built_docs: TrackedDocs = TrackedDocs()
         if not isinstance(project_path, pathlib.Path):
             project_path = pathlib.Path(project_path).absolute()
         self.project_path = project_path
         self.storage: dict[str, typing.Any] = {names.NAME_Rootdir: str(project_path)}
         self.options = opts
+        self.cache_dir = None
+        if opts.cache or opts.compile or opts.incremental:
+            self.cache_dir = project_path / CACHE_DIRNAME
+            self.storage[names.NAME_CacheDir] = str(self.cache_dir)
+        self.cache_trees = opts.cache or opts.compile
+        self.trees = trees
+        if opts.compile:
+            self.storage[names.NAME_RenderCache] = render_cache or RenderCache(self.cache_dir)
+        commands.refresh()
+
+        self.incremental: IncrementalState | None = None
+        # for the rendered documents: what they did, their title and tags before the callbacks
+        self.traces: dict[str, tuple[DocTrace, str, list[object]]] = {}
+        if opts.incremental:
+            assert self.cache_dir
+            self.incremental = IncrementalState(self.cache_dir)
+        self.tracking = opts.incremental or opts.jobs > 1
+        if self.tracking:
+            self.storage = TrackedStorage(self.storage)
+        self.pool: RenderPool | None = None
+        # for the documents: how many times the callbacks parsed and serialized their HTML
+        self.dom_counts: dict[str, tuple[int, int]] = {}
+        # tags, titles and outputs of the documents built, opened by `build_all`
+        # when the build uses .op-cache anyway, or writes the search index
+        self.metadata: MetadataStore | None = None
 
         for file in files_to_build:
             self._include(pathlib.Path(file).absolute())
 
     def build_all(self):
-        while self._handle_one():
-            pass
+        if self.cache_dir or self.options.search_index:
+            self.metadata = self._open_metadata()
+        try:
+            self._build_all()
+        finally:
+            if self.metadata:
+                self.metadata.close()
+                self.metadata = None
+
+    def _build_all(self):
+        if self.options.jobs > 1:
+            self.pool = RenderPool(self.options.jobs, self.project_path, self.options)
+            for doc in self.files_to_build:
+                self._submit(doc)
+        try:
+            while self._handle_one():
+                pass
+        finally:
+            if self.pool:
+                self.pool.close()
+                self.pool = None
 
         self._performance_global_callbacks()
+        if self.incremental:
+            self._save_records()
+            self.incremental.close()
         self._dump_to_disk()
+        if self.options.search_index:
+            self._dump_search_index()
+        if self.metadata:
+            self.metadata.forget_removed(set(self.built_docs))
+        if self.options.dom_report:
+            self._print_dom_report()
+
+    def _open_metadata(self):
+        try:
+            return MetadataStore(self.project_path / CACHE_DIRNAME / METADATA_FILENAME)
+        except (OSError, sqlite3.Error) as e:
+            warnings.warn(f"the metadata of the documents are not kept: {e}")
+            return None
+
+    def render_one(self, file: str | pathlib.Path) -> OPDocument:
+        """
+        Render `file` and run its callbacks, without the documents it includes
+        and without writing the output, e.g., to preview it.
+        """
+        self._include(pathlib.Path(file).absolute())
+        doc = self.files_to_build.pop()
+        self._render(doc)
+        self.built_docs[doc.project_based_path] = doc
+        run_callbacks(doc)
+        return doc
 
     def _include(self, file_to_include: pathlib.Path):
         """
@@ -72,51 +175,201 @@ class Build:
             project_docs=self.built_docs,
         )
         self.files_to_build.append(op_doc)
+        if self.pool:
+            self._submit(op_doc)
+
+    def _submit(self, doc: OPDocument):
+        assert self.pool
+        if self.incremental and self.incremental.restore(doc):
+            return
+        self.pool.submit(doc)
 
     def _handle_one(self):
         if not self.files_to_build:
             return False
 
         immature_doc = self.files_to_build.popleft()
+        if self.incremental:
+            record = self.incremental.restore(immature_doc)
+            if record:
+                for file_to_include in record.includes:
+                    self._include(pathlib.Path(file_to_include))
+                immature_doc.tags = record.tags
+                immature_doc.title = record.title
+                immature_doc.code = record.code
+                self.built_docs[immature_doc.project_based_path] = immature_doc
+                if self.metadata:
+                    self.metadata.put(immature_doc)
+                return True
+
+        # documents sharing state with others are rendered here, in order
+        trace = self.pool and self.pool.take(immature_doc)
+        if not trace:
+            trace = self._render(immature_doc)
+            if trace.writes_runtime and self.pool:
+                # the documents rendered ahead did not see the change
+                self.pool.close()
+                self.pool = None
+        for file_to_include in trace.includes:
+            self._include(pathlib.Path(file_to_include))
+        if self.incremental:
+            self.incremental.rendered(immature_doc, trace)
+            self.traces[immature_doc.project_based_path] = (
+                trace,
+                immature_doc.title,
+                list(immature_doc.tags),
+            )
+        self.built_docs[immature_doc.project_based_path] = immature_doc
+        if self.metadata:
+            self.metadata.put(immature_doc)
+        return True
+
+    def _render(self, doc: OPDocument) -> DocTrace:
+        """Render `doc` into `doc.code`; the documents it includes are left to the caller."""
+        trace = DocTrace()
 
         # directory =
 
         def include_impl(file_to_build: str):
-            self._include(immature_doc.working_dir_absolute / file_to_build)
+            trace.includes.append(str(doc.working_dir_absolute / file_to_build))
+
+        def dependency_impl(file: str | pathlib.Path):
+            trace.deps.add(str(pathlib.Path(file).absolute()))
 
         self.storage[names.NAME_IncludeImpl] = include_impl
+        self.storage[names.NAME_DependencyImpl] = dependency_impl
 
-        with immature_doc.source_path_absolute.open("r", encoding="utf-8") as f:
+        if self.tracking:
+            assert isinstance(self.storage, TrackedStorage)
+            self.storage[names.NAME_UsedCommands] = trace.commands
+            self.storage.reads.clear()
+            bindings = self.storage.bindings()
+            runtime = runtime_state()
+            self.built_docs.read = False
+            n_gensym = gensym_count()
+
+        with doc.source_path_absolute.open("r", encoding="utf-8") as f:
             src_code = f.read()
 
+        tree = self._load_tree(doc, src_code)
         result = process(
-            filename=str(immature_doc.source_path_absolute),
+            filename=str(doc.source_path_absolute),
             source=src_code,
             storage=self.storage,
-            target_doc=immature_doc,
+            target_doc=doc,
+            tree=tree,
         )
-        immature_doc.code = result
-        self.built_docs[immature_doc.project_based_path] = immature_doc
-        return True
+        self._save_tree(doc, src_code, tree)
+        doc.code = result
+        if not doc.title:
+            # the title is known before the callbacks, e.g., for the indices of other documents
+            doc.title = h1_text(result) or ""
+        if self.tracking:
+            assert isinstance(self.storage, TrackedStorage)
+            trace.reads_docs = self.built_docs.read
+            trace.reads_storage = bool(self.storage.reads - BUILD_NAMES)
+            trace.writes_storage = self.storage.bindings() != bindings
+            trace.writes_runtime = runtime_state() != runtime
+            trace.uses_gensym = gensym_count() != n_gensym
+        return trace
+
+    def _save_records(self):
+        assert self.incremental
+        with self.incremental.records.transact():
+            for path, (trace, title, tags) in self.traces.items():
+                self.incremental.save(self.built_docs[path], trace, title, tags)
+            self.incremental.save_defining_docs()
+
+    def _tree_path(self, doc: OPDocument):
+        assert self.cache_dir
+        key = hashlib.sha1(doc.project_based_path.encode("utf-8")).hexdigest()
+        return self.cache_dir / "trees" / f"{key}.pickle"
+
+    def _load_tree(self, doc: OPDocument, source: str):
+        if self.trees is None and not self.cache_trees:
+            return SourceTree()
+        digest = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        if self.trees is not None:
+            tree = self.trees.get(str(doc.source_path_absolute))
+            if tree is not None and tree.digest == digest:
+                return tree
+            if not self.cache_trees:
+                return SourceTree(digest=digest)
+        path = self._tree_path(doc)
+        if not path.exists():
+            return SourceTree(digest=digest)
+        return SourceTree.loads(path.read_bytes(), digest)
+
+    def _save_tree(self, doc: OPDocument, source: str, tree: SourceTree):
+        if self.trees is not None:
+            self.trees[str(doc.source_path_absolute)] = tree
+        if not self.cache_trees or not tree.dirty:
+            return
+        path = self._tree_path(doc)
+        path.parent.mkdir(0o777, parents=True, exist_ok=True)
+        path.write_bytes(tree.dumps(tree.source_digest(source)))
+        tree.dirty = False
 
     def _performance_global_callbacks(self):
         for each in reversed(self.built_docs.values()):
-            for my_callback in each.callbacks:
-                my_callback(each)
+            self.built_docs.read = False
+            dom = run_callbacks(each)
+            self.dom_counts[each.project_based_path] = (dom.parses, dom.serializations)
+            if self.built_docs.read and each.project_based_path in self.traces:
+                self.traces[each.project_based_path][0].reads_docs = True
+
+    def _print_dom_report(self):
+        print("parses  serializations  document", file=sys.stderr)
+        for path, (parses, serializations) in self.dom_counts.items():
+            print(f"{parses:>6}  {serializations:>14}  {path}", file=sys.stderr)
 
     def _dump_to_disk(self):
-        for doc in self.built_docs.values():
-            outfile = doc.output_path_absolute
-            outfile.parent.mkdir(0o777, parents=True, exist_ok=True)
-            if outfile.exists() and not self.options.force:
-                warnings.warn(
-                    "{} already exists. Skipped. Add --force to perform the inplace operation.".format(
-                        str(outfile)
-                    )
+        dumped: list[tuple[pathlib.Path, str]] = []
+        try:
+            for doc in self.built_docs.values():
+                for outfile, code in [(doc.output_path_absolute, doc.code), *doc.outputs.items()]:
+                    digest = code_digest(code)
+                    if not self._dump(outfile, code, digest):
+                        return
+                    dumped.append((outfile, digest))
+        finally:
+            if self.metadata:
+                self.metadata.written(dumped)
+                self.metadata.put_titles(self.built_docs.values())
+
+    def _dump_search_index(self):
+        from original_posting.search import SearchIndex
+
+        if not self.metadata:
+            warnings.warn("the search index is only written with the metadata of the documents")
+            return
+        index = SearchIndex(self.metadata.conn, self.project_path / self.options.outdir)
+        dumped: list[tuple[pathlib.Path, str]] = []
+        # stopping early drops the changes to the index, written again next time
+        with contextlib.closing(index.files(self.built_docs.values())) as files:
+            for outfile, code in files:
+                digest = code_digest(code)
+                if not self._dump(outfile, code, digest):
+                    break
+                dumped.append((outfile, digest))
+        self.metadata.written(dumped)
+
+    def _dump(self, outfile: pathlib.Path, code: str, digest: str) -> bool:
+        """Write an output, unless it is unchanged; False if it may not be overwritten."""
+        if self.metadata and self.metadata.output_unchanged(outfile, digest):
+            # left alone, e.g., an index page whose matching documents are the same
+            return True
+        outfile.parent.mkdir(0o777, parents=True, exist_ok=True)
+        if outfile.exists() and not self.options.force:
+            warnings.warn(
+                "{} already exists. Skipped. Add --force to perform the inplace operation.".format(
+                    str(outfile)
                 )
-                return
+            )
+            return False
 
-            with outfile.open("w", encoding="utf-8") as f:
-                f.write(doc.code)
+        with outfile.open("w", encoding="utf-8") as f:
+            f.write(code)
 
-            print(f"Dumped {outfile}.")
+        print(f"Dumped {outfile}.")
+        return True
@@ -2,6 +2,12 @@ NAME_PythonScope = "__builtin.python-scope"
 NAME_IncludeImpl = "__builtin.include-impl"
 NAME_IndexFormatter = "__builtin.index-formatter"
 NAME_Rootdir = '__builtin.rootdir'
+NAME_RenderCache = "__builtin.render-cache"
+NAME_DependencyImpl = "__builtin.dependency-impl"
+NAME_UsedCommands = "__builtin.used-commands"
+NAME_FilterQueries = "__builtin.filter-queries"
+NAME_CacheDir = "__builtin.cache-dir"
 
 VARNAME_ptag_exprs = "PTAG_EXPRS"
 VARNAME_ptag_pats = "PTAG_PATS"
+VARNAME_ptag_term = "__ptag_term"
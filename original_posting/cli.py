@@ -1,8 +1,10 @@
 from __future__ import annotations
-from original_posting.build import Build, BuildOptions
 from original_posting.types import Runtime
 import wisepy2
 import os
+import pathlib
+import sys
+import time
 
 
 def command(
@@ -13,6 +15,15 @@ def command(
     extra_search_path: str = "",
     force: bool = False,
     suffix: str = ".html",
+    cache: bool = False,
+    compile: bool = False,
+    startup_report: bool = False,
+    incremental: bool = False,
+    jobs: int = 1,
+    watch: bool = False,
+    dom_report: bool = False,
+    html_parser: str = "html.parser",
+    search_index: bool = False,
 ):
     """
     entry        : input file name.
@@ -20,17 +31,107 @@ def command(
     force        : if set, overwrite the output file if it exists.
     suffix       : if --batch is given, the suffix of the output file. default is ".html".
     extra_search_path : extra search directories providing the commands, separated by ';'.
+    cache        : if set, keep parsed documents in <project_path>/.op-cache to skip re-parsing unchanged files.
+    compile      : if set, render documents through Python functions compiled from them and cached in .op-cache.
+    startup_report : if set, print to stderr how long importing the modules and commands took.
+    incremental  : if set, restore the documents whose inputs did not change since the last build from .op-cache instead of rendering them.
+    jobs         : number of processes rendering documents ahead; documents sharing the Python scope are still rendered one by one.
+    watch        : if set, keep running and rebuild incrementally whenever the project or the commands change.
+    dom_report   : if set, print to stderr how many times the callbacks parsed and serialized each document.
+    html_parser  : the bs4 backend parsing HTML in the commands, e.g., "lxml", which is faster but may normalize the pages. A project may set `Runtime.html_parser` in its entry document instead.
+    search_index : if set, write a full-text search index of the documents to <out>/search, see `original_posting.search`.
     e.g.,
     op a.op --out a.html --force
     op src/ --out dst/ --force --batch --suffix .html
     """
     Runtime.search_path.extend(filter(None, extra_search_path.split(";")))
-    opts = BuildOptions(force, suffix, out)
+    Runtime.html_parser = html_parser
     if not project_path:
         project_path = os.path.dirname(os.path.abspath(entry))
-    build = Build(project_path, [entry], opts)
-    build.build_all()
+
+    def build():
+        # the build stack is only imported here, and the commands when first used
+        from original_posting.build import Build, BuildOptions
+
+        opts = BuildOptions(
+            force, suffix, out, cache, compile, incremental, jobs, dom_report, search_index
+        )
+        if watch:
+            from original_posting.watch import watch as watch_project
+
+            watch_project(project_path, [entry], opts)
+            return
+        Build(project_path, [entry], opts).build_all()
+
+    if not startup_report:
+        build()
+        return
+
+    from original_posting.startup import ImportTimer, print_report
+    from original_posting.parsing import command_import_times
+
+    t0 = time.perf_counter()
+    with ImportTimer() as timer:
+        build()
+    print_report(timer.modules, command_import_times, time.perf_counter() - t0)
     return
 
+
+def serve_command(
+    *,
+    port: int = 8391,
+    socket: str = "",
+    extra_search_path: str = "",
+    compile: bool = False,
+    max_docs: int = 256,
+    html_parser: str = "html.parser",
+):
+    """
+    port         : the localhost port to listen on.
+    socket       : if given, listen on this Unix socket instead.
+    extra_search_path : extra search directories providing the commands, separated by ';'.
+    compile      : if set, render documents through compiled Python functions kept in memory.
+    max_docs     : how many parsed documents (and compiled functions) to keep in memory.
+    html_parser  : the bs4 backend parsing HTML in the commands, e.g., "lxml".
+    e.g.,
+    op serve --port 8391
+    curl -H 'Content-Type: application/json' -d '{"file": "/path/to/a.op"}' http://127.0.0.1:8391/render
+    """
+    from original_posting.serve import Daemon, serve
+
+    Runtime.search_path.extend(filter(None, extra_search_path.split(";")))
+    Runtime.html_parser = html_parser
+    serve(Daemon(compile, max_docs), port, socket)
+
+
+def query_command(pattern: str, *, project_path: str = "."):
+    """
+    pattern      : a ptag pattern, as in '@ptag-filter-index'.
+    project_path : the project whose documents are queried, as of its last build with --cache, --compile, --incremental or --search_index.
+    prints the path, the title and the output of each document having a matching tag.
+    e.g.,
+    op query 'post("rust")'
+    op query 'post(~x) and P[x != "draft"]' --project_path blog/
+    """
+    from original_posting.build import CACHE_DIRNAME
+    from original_posting.metadata import METADATA_FILENAME, query
+
+    store_path = pathlib.Path(project_path).absolute() / CACHE_DIRNAME / METADATA_FILENAME
+    if not store_path.exists():
+        print(
+            f"{store_path} does not exist: build the project with --cache, --compile, --incremental or --search_index first.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    for doc in query(store_path, pattern):
+        print(f"{doc.path}\t{doc.title}\t{doc.output}")
+
+
 def main():
+    if sys.argv[1:2] == ["serve"]:
+        wisepy2.wise(serve_command)(sys.argv[2:])  # type: ignore
+        return
+    if sys.argv[1:2] == ["query"]:
+        wisepy2.wise(query_command)(sys.argv[2:])  # type: ignore
+        return
     wisepy2.wise(command)()  # type: ignore
@@ -0,0 +1,165 @@
+"""
+Compiles parsed spans of OP sources into Python generator functions.
+
+A compiled span yields its literal text runs as constants and calls the
+commands it contains directly, with the spans computed at parse time.
+The bytecode is cached under the project's cache directory and reused
+while the source and the scripts of the commands it calls are unchanged.
+"""
+from __future__ import annotations
+from original_posting.types import Context, Runtime, Scope
+from original_posting.registry import commands
+from original_posting.parsing import (
+    BlockNode,
+    InlineNode,
+    OperatorNode,
+    TextNode,
+    TREE_FORMAT,
+    command_failed,
+    resolve_command,
+)
+import importlib.util
+import hashlib
+import marshal
+import pathlib
+import typing
+
+if typing.TYPE_CHECKING:
+    from original_posting.parsing import Node
+
+    RenderFunction = typing.Callable[[Context], typing.Iterator[str]]
+
+# bump when the generated code changes
+CODEGEN_FORMAT = 3
+
+
+def generate(source: str, nodes: typing.Sequence[Node]) -> str:
+    """Python source of a generator function `render(ctx)` for `nodes`."""
+    lines = ["def render(ctx):"]
+    emit = lines.append
+    text: list[str] = []
+
+    def flush_text():
+        if text:
+            emit(f"    yield {''.join(text)!r}")
+            text.clear()
+
+    for k, node in enumerate(nodes):
+        if isinstance(node, TextNode):
+            text.append(source[node.start : node.end])
+            continue
+        flush_text()
+        if isinstance(node, OperatorNode):
+            emit(f"    ctx.pos = {node.stop}")
+            emit(f"    yield Runtime.operators[{node.op!r}](ctx, {node.start}, {node.end})")
+            continue
+
+        emit(f"    cmd_entry = resolve_command(ctx, nodes[{k}])")
+        if isinstance(node, InlineNode):
+            emit(f"    ctx.pos = {node.stop}")
+            emit(f"    scope = ctx.cur_scope = Scope({node.name!r}, cmd_entry(ctx), {node.stop}, [], lines=ctx.lines)")
+            emit(f"    try:")
+            emit(f"        text = scope.cmd_entry.inline_proc({node.start}, {node.end})")
+            emit(f"    except Exception as e:")
+            emit(f"        raise command_failed(ctx, nodes[{k}]) from e")
+            emit(f"    finally:")
+            emit(f"        ctx.cur_scope = None")
+            emit(f"    yield text")
+            continue
+
+        assert isinstance(node, BlockNode)
+        emit(f"    ctx.pos = {node.start}")
+        emit(f"    scope = ctx.cur_scope = Scope({node.name!r}, cmd_entry(ctx), {node.start}, {list(node.args)!r}, lines=ctx.lines)")
+        if node.end < 0:
+            # never closed: the rest of the source is swallowed
+            emit(f"    ctx.cur_scope = None")
+            continue
+        emit(f"    try:")
+        emit(f"        text = scope.cmd_entry.proc(scope.args, {node.start}, {node.end})")
+        emit(f"        if not isinstance(text, str):")
+        emit(f"            raise TypeError(f\"command {{scope.name}}'s `proc` method didn't return a string, but a (an) {{type(text)}}.\")")
+        emit(f"    except Exception as e:")
+        emit(f"        raise command_failed(ctx, nodes[{k}]) from e")
+        emit(f"    finally:")
+        emit(f"        ctx.cur_scope = None")
+        emit(f"    yield text")
+    flush_text()
+    # keep `render` a generator even if it yields nothing
+    emit("    return")
+    emit("    yield")
+    return "\n".join(lines) + "\n"
+
+
+def _fingerprint(cmd_name: str):
+    script = commands.find_command(cmd_name)
+    if not script:
+        return None
+    return (script.path, script.mtime_ns)
+
+
+def _fingerprints(nodes: typing.Sequence[Node]):
+    names = {node.name for node in nodes if isinstance(node, (InlineNode, BlockNode))}
+    return {name: _fingerprint(name) for name in sorted(names)}
+
+
+class RenderCache:
+    """
+    Compiled render functions, keyed by the digest of the source and the span.
+    If `cache_dir` is given, the bytecode is also kept on disk.
+    """
+
+    def __init__(self, cache_dir: pathlib.Path | None = None):
+        self.cache_dir = cache_dir
+        self.functions: dict[tuple[str, int, int], RenderFunction] = {}
+
+    def get(
+        self, ctx: Context, start: int, end: int, nodes: typing.Sequence[Node]
+    ) -> RenderFunction:
+        key = (ctx.tree.source_digest(ctx.source), start, end)
+        fn = self.functions.get(key)
+        if fn is None:
+            code = self._load(key, nodes)
+            if code is None:
+                code = compile(
+                    generate(ctx.source, nodes), f"<op {ctx.file}:{start}-{end}>", "exec"
+                )
+                self._save(key, nodes, code)
+            namespace = {
+                "nodes": nodes,
+                "Runtime": Runtime,
+                "Scope": Scope,
+                "resolve_command": resolve_command,
+                "command_failed": command_failed,
+            }
+            exec(code, namespace)
+            fn = self.functions[key] = namespace["render"]
+        return fn
+
+    def _path(self, key: tuple[str, int, int]):
+        assert self.cache_dir
+        name = hashlib.sha1("{}:{}:{}".format(*key).encode("utf-8")).hexdigest()
+        return self.cache_dir / "compiled" / f"{name}.bin"
+
+    def _header(self):
+        return (CODEGEN_FORMAT, TREE_FORMAT, importlib.util.MAGIC_NUMBER)
+
+    def _load(self, key: tuple[str, int, int], nodes: typing.Sequence[Node]):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        if not path.exists():
+            return None
+        try:
+            header, fingerprints, code = marshal.loads(path.read_bytes())
+        except Exception:
+            return None
+        if header != self._header() or fingerprints != _fingerprints(nodes):
+            return None
+        return code
+
+    def _save(self, key: tuple[str, int, int], nodes: typing.Sequence[Node], code):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        path.parent.mkdir(0o777, parents=True, exist_ok=True)
+        path.write_bytes(marshal.dumps((self._header(), _fingerprints(nodes), code)))
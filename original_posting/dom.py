@@ -0,0 +1,136 @@
+"""
+The HTML of a document shared by its callbacks, and the soups of the commands.
+
+Every soup is parsed with `Runtime.html_parser`, "html.parser" by default.
+A project selects another with `--html_parser`, or by setting it in a
+'@begin py' block of its entry document, as `test.op` extends
+`Runtime.search_path`.
+Other backends of bs4, e.g., "lxml", are faster on large pages, but may
+normalize the markup, e.g., close tags or move attributes. They also wrap a
+page in `<html><head><body>`, which `DocumentDom` drops again when the page
+had no `<html>`, so that the callbacks appending to `doc.code` still append
+to the page rather than after it.
+
+Callbacks decorated with `uses_dom` get the parsed page with `get_dom(doc)`
+and change it in place instead of setting `doc.code`. The page is parsed on
+the first such callback, and serialized back to `doc.code` once, when the
+callbacks are done or before a callback working on `doc.code` as a string,
+e.g., one appending a script with `doc.code += ...`.
+"""
+from __future__ import annotations
+from original_posting.types import OPDocument, Runtime
+import html
+import re
+import typing
+
+if typing.TYPE_CHECKING:
+    import bs4
+
+_Callback = typing.TypeVar("_Callback")
+
+_h1_pattern = re.compile(r"<h1(?:\s[^>]*)?>(.*?)</h1\s*>", re.IGNORECASE | re.DOTALL)
+_tag_pattern = re.compile(r"<[^>]*>")
+_html_tag_pattern = re.compile(r"<html[\s>]", re.IGNORECASE)
+
+_html_factories: dict[str, bs4.BeautifulSoup] = {}
+
+
+def html_factory() -> bs4.BeautifulSoup:
+    """An empty soup shared by the commands to create tags with `new_tag`."""
+    factory = _html_factories.get(Runtime.html_parser)
+    if factory is None:
+        factory = _html_factories[Runtime.html_parser] = make_soup("")
+    return factory
+
+
+def make_soup(markup: str) -> bs4.BeautifulSoup:
+    import bs4
+
+    return bs4.BeautifulSoup(markup, Runtime.html_parser)
+
+
+def parse_fragment(markup: str) -> bs4.Tag:
+    """A `<div>` holding the nodes parsed from `markup`, whatever the backend."""
+    import bs4
+
+    div = make_soup("<div>" + markup + "</div>").find("div")
+    assert isinstance(div, bs4.Tag)
+    return div
+
+
+def h1_text(code: str) -> str | None:
+    """The text of the first `<h1>` of `code`, found without parsing it."""
+    m = _h1_pattern.search(code)
+    if not m:
+        return None
+    return html.unescape(_tag_pattern.sub("", m.group(1)))
+
+
+def uses_dom(callback: _Callback) -> _Callback:
+    """Mark a callback, or a class of callbacks, as working on `get_dom(doc)`."""
+    callback.uses_dom = True  # type: ignore
+    return callback
+
+
+class DocumentDom:
+    def __init__(self, doc: OPDocument):
+        self.doc = doc
+        self.soup: bs4.BeautifulSoup | None = None
+        # whether the backend wrapped a page without `<html>` in one
+        self.wrapped = False
+        self.parses = 0
+        self.serializations = 0
+
+    def get(self) -> bs4.BeautifulSoup:
+        if self.soup is None:
+            self.soup = make_soup(self.doc.code)
+            self.wrapped = self.soup.html is not None and not _html_tag_pattern.search(
+                self.doc.code
+            )
+            self.parses += 1
+        return self.soup
+
+    def flush(self):
+        if self.soup is not None:
+            if self.wrapped:
+                self.doc.code = "".join(_decode_unwrapped(self.soup))
+            else:
+                self.doc.code = str(self.soup)
+            self.soup = None
+            self.serializations += 1
+
+
+def _decode_unwrapped(node: bs4.PageElement) -> typing.Iterator[str]:
+    """The markup of `node`, without the tags `<html>`, `<head>` and `<body>`."""
+    import bs4
+
+    if not isinstance(node, bs4.Tag):
+        yield typing.cast(bs4.NavigableString, node).output_ready()
+    elif isinstance(node, bs4.BeautifulSoup) or node.name in ("html", "head", "body"):
+        for child in node.contents:
+            yield from _decode_unwrapped(child)
+    else:
+        yield node.decode()
+
+
+def get_dom(doc: OPDocument) -> bs4.BeautifulSoup:
+    """The parsed HTML of `doc`, for the callbacks marked with `uses_dom`."""
+    dom = doc.dom
+    if dom is None:
+        raise RuntimeError(
+            "the DOM of {} is only available to its callbacks".format(doc.project_based_path)
+        )
+    return dom.get()
+
+
+def run_callbacks(doc: OPDocument) -> DocumentDom:
+    dom = doc.dom = DocumentDom(doc)
+    try:
+        for my_callback in doc.callbacks:
+            if not getattr(my_callback, "uses_dom", False):
+                dom.flush()
+            my_callback(doc)
+        dom.flush()
+    finally:
+        doc.dom = None
+    return dom
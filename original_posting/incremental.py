@@ -0,0 +1,385 @@
+"""
+State kept between builds by `--incremental`.
+
+A document is restored from the previous build, instead of rendered, while
+its source, the files it read and the scripts of the commands it invoked are
+unchanged. Documents whose output depends on other documents are always
+rendered:
+- documents reading `project_docs`, e.g., through '@ptag-filter-index';
+- documents changing the shared storage, e.g., binding a name or updating
+  a dict in place through '@begin py', so that the storage is the same as
+  in a full build;
+- documents changing the process-wide settings of `Runtime`, e.g.,
+  `Runtime.operators`, for the same reason;
+- documents looking up the shared storage, if one of the above defining
+  documents changed, was removed, or is newly rendered before them;
+- all documents, if one of the defining documents changing `Runtime` changed;
+- documents generating symbols with `global_gensym`, whose numbering
+  depends on all the documents rendered before.
+"""
+from __future__ import annotations
+from dataclasses import dataclass, field
+from original_posting.types import OPDocument, Runtime
+from original_posting.registry import commands
+import original_posting.builtin_names as names
+import hashlib
+import os
+import pathlib
+import pickle
+import typing
+
+if typing.TYPE_CHECKING:
+    import diskcache
+
+# bump when the layout of `DocRecord`, or what it records, changes
+RECORD_FORMAT = 5
+
+# storage entries owned by the build rather than by the documents
+BUILD_NAMES = frozenset(
+    [
+        names.NAME_Rootdir,
+        names.NAME_IncludeImpl,
+        names.NAME_DependencyImpl,
+        names.NAME_UsedCommands,
+        names.NAME_RenderCache,
+        names.NAME_FilterQueries,
+        names.NAME_CacheDir,
+    ]
+)
+
+
+def runtime_state() -> dict[str, object]:
+    """
+    The process-wide settings of `Runtime`, copied, so that the states
+    before and after rendering a document are equal if it changed none.
+    """
+    return {
+        k: v.copy() if isinstance(v, (dict, list)) else v
+        for k, v in vars(Runtime).items()
+        if not k.startswith("__")
+    }
+
+
+def restore_runtime_state(state: dict[str, object]):
+    """Undo the changes to `Runtime` since `state = runtime_state()`."""
+    for k in [k for k in vars(Runtime) if not k.startswith("__") and k not in state]:
+        delattr(Runtime, k)
+    for k, v in state.items():
+        current = getattr(Runtime, k, None)
+        if isinstance(v, dict) and isinstance(current, dict):
+            current.clear()
+            current.update(v)
+        elif isinstance(v, list) and isinstance(current, list):
+            current[:] = v
+        else:
+            setattr(Runtime, k, v)
+
+
+def fingerprint(value: object, _seen: set[int] | None = None) -> object:
+    """
+    The content of a value, to tell whether a document changed it, even in
+    place: its pickle, or else the fingerprints of the items of a container,
+    or else its identity, e.g., for functions defined by '@begin py'.
+    """
+    try:
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        pass
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return id(value)
+    _seen.add(id(value))
+    if isinstance(value, dict):
+        return (id(value), [(fingerprint(k, _seen), fingerprint(v, _seen)) for k, v in value.items()])
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return (id(value), [fingerprint(each, _seen) for each in value])
+    return id(value)
+
+
+def file_hash(path: str) -> str:
+    """Hash of a file's content or a directory's listing, empty if it's missing."""
+    try:
+        if os.path.isdir(path):
+            data = "\n".join(sorted(os.listdir(path))).encode("utf-8")
+        else:
+            with open(path, "rb") as f:
+                data = f.read()
+    except OSError:
+        return ""
+    return hashlib.sha1(data).hexdigest()
+
+
+def script_hash(cmd_name: str) -> str:
+    script = commands.find_command(cmd_name)
+    if not script:
+        return ""
+    if script.entry_point:
+        return script.path
+    return file_hash(script.path)
+
+
+@dataclass
+class DocRecord:
+    output: str
+    source_hash: str
+    deps: dict[str, str]  # file read -> its hash
+    commands: dict[str, str]  # command invoked -> hash of its script
+    includes: list[str]  # documents included, in order
+    tags: list[object]
+    title: str
+    code: str  # the output, after the callbacks
+    reads_docs: bool
+    reads_storage: bool
+    writes_storage: bool
+    writes_runtime: bool
+    uses_gensym: bool
+
+
+class DefiningDoc(typing.NamedTuple):
+    """
+    The inputs of a document binding names in the shared storage or changing
+    `Runtime`, kept apart from the records to be checked without loading them.
+    """
+
+    source_hash: str
+    deps: dict[str, str]
+    commands: dict[str, str]
+    writes_runtime: bool
+
+
+@dataclass
+class DocTrace:
+    """What a document did while rendered."""
+
+    deps: set[str] = field(default_factory=set)
+    commands: set[str] = field(default_factory=set)
+    includes: list[str] = field(default_factory=list)
+    reads_docs: bool = False
+    reads_storage: bool = False
+    writes_storage: bool = False
+    writes_runtime: bool = False
+    uses_gensym: bool = False
+
+    @property
+    def shares_state(self):
+        """Whether the output depends on, or affects, the documents rendered before or after."""
+        return (
+            self.reads_docs
+            or self.reads_storage
+            or self.writes_storage
+            or self.writes_runtime
+            or self.uses_gensym
+        )
+
+
+class TrackedStorage(dict):
+    """Shared storage recording which entries are looked up."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reads: set[str] = set()
+
+    def __getitem__(self, key):
+        self.reads.add(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.reads.add(key)
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.reads.add(key)
+        return super().setdefault(key, default)
+
+    def __contains__(self, key):
+        self.reads.add(key)
+        return super().__contains__(key)
+
+    def bindings(self):
+        """
+        Fingerprints of the values bound in the storage and in the shared
+        Python scope, without the names starting with '__' used as scratch
+        variables.
+        """
+        scope = dict.get(self, names.NAME_PythonScope)
+        result = {
+            k: fingerprint(v)
+            for k, v in dict.items(self)
+            if k not in BUILD_NAMES and not (k == names.NAME_PythonScope and isinstance(v, dict))
+        }
+        if isinstance(scope, dict):
+            for k, v in scope.items():
+                if not k.startswith("__"):
+                    result[names.NAME_PythonScope, k] = fingerprint(v)
+        return result
+
+
+class TrackedDocs(dict):
+    """`project_docs` recording whether it was read."""
+
+    read = False
+
+    def __getitem__(self, key):
+        self.read = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.read = True
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        self.read = True
+        return super().__contains__(key)
+
+    def __iter__(self):
+        self.read = True
+        return super().__iter__()
+
+    def __len__(self):
+        self.read = True
+        return super().__len__()
+
+    def keys(self):
+        self.read = True
+        return super().keys()
+
+    def values(self):
+        self.read = True
+        return super().values()
+
+    def items(self):
+        self.read = True
+        return super().items()
+
+
+class IncrementalState:
+    def __init__(self, cache_dir: pathlib.Path):
+        import diskcache
+
+        self.records: diskcache.Cache = diskcache.Cache(str(cache_dir / "incremental"))
+        self._hashes: dict[str, str] = {}
+        self._script_hashes: dict[str, str] = {}
+        self.defining_docs: dict[str, DefiningDoc] = self.records.get(self._defining_key, {})
+        # as of the previous build
+        self.defined_before = dict(self.defining_docs)
+        self.storage_changed, self.runtime_changed = self._defining_docs_changed()
+        # the sources of the documents of this build
+        self.visited: set[str] = set()
+
+    def close(self):
+        self.records.close()
+
+    def _key(self, doc: OPDocument):
+        return (RECORD_FORMAT, str(doc.source_path_absolute))
+
+    _defining_key = ("defining", RECORD_FORMAT)
+
+    def file_hash(self, path: str):
+        digest = self._hashes.get(path)
+        if digest is None:
+            digest = self._hashes[path] = file_hash(path)
+        return digest
+
+    def script_hash(self, cmd_name: str):
+        digest = self._script_hashes.get(cmd_name)
+        if digest is None:
+            digest = self._script_hashes[cmd_name] = script_hash(cmd_name)
+        return digest
+
+    def _inputs_unchanged(self, source_path: str, record: DocRecord | DefiningDoc):
+        return (
+            self.file_hash(source_path) == record.source_hash
+            and all(self.file_hash(p) == h for p, h in record.deps.items())
+            and all(self.script_hash(c) == h for c, h in record.commands.items())
+        )
+
+    def _defining_docs_changed(self) -> tuple[bool, bool]:
+        """Whether a defining document changed, and whether one of those changes `Runtime`."""
+        storage_changed = False
+        for source_path, defining in self.defining_docs.items():
+            if not self._inputs_unchanged(source_path, defining):
+                if defining.writes_runtime:
+                    return True, True
+                storage_changed = True
+        return storage_changed, False
+
+    def restore(self, doc: OPDocument) -> DocRecord | None:
+        """The record of `doc` if it needn't be rendered again."""
+        self.visited.add(str(doc.source_path_absolute))
+        record: DocRecord | None = self.records.get(self._key(doc))
+        if (
+            record is None
+            or record.output != str(doc.output_path_absolute)
+            or record.reads_docs
+            or record.writes_storage
+            or record.writes_runtime
+            or record.uses_gensym
+            or (record.reads_storage and self.storage_changed)
+            or self.runtime_changed
+            or not doc.output_path_absolute.exists()
+            or not self._inputs_unchanged(str(doc.source_path_absolute), record)
+        ):
+            return None
+        return record
+
+    def rendered(self, doc: OPDocument, trace: DocTrace):
+        """
+        Note that `doc` was rendered: the documents after it are rendered
+        again if it defines what it did not, or no longer includes a
+        defining document, as the storage they see changed.
+        """
+        source_path = str(doc.source_path_absolute)
+        if (trace.writes_storage or trace.writes_runtime) and source_path not in self.defined_before:
+            self._defining_doc_changed(trace.writes_runtime)
+        previous: DocRecord | None = self.records.get(self._key(doc))
+        if previous:
+            for path in set(previous.includes).difference(trace.includes):
+                defining = self.defined_before.get(path)
+                if defining:
+                    self._defining_doc_changed(defining.writes_runtime)
+
+    def _defining_doc_changed(self, writes_runtime: bool):
+        self.storage_changed = True
+        self.runtime_changed = self.runtime_changed or writes_runtime
+
+    def save(self, doc: OPDocument, trace: DocTrace, title: str, tags: list[object]):
+        record = DocRecord(
+            output=str(doc.output_path_absolute),
+            source_hash=self.file_hash(str(doc.source_path_absolute)),
+            deps={p: self.file_hash(p) for p in sorted(trace.deps)},
+            commands={c: self.script_hash(c) for c in sorted(trace.commands)},
+            includes=trace.includes,
+            tags=tags,
+            title=title,
+            code=doc.code,
+            reads_docs=trace.reads_docs,
+            reads_storage=trace.reads_storage,
+            writes_storage=trace.writes_storage,
+            writes_runtime=trace.writes_runtime,
+            uses_gensym=trace.uses_gensym,
+        )
+        source_path = str(doc.source_path_absolute)
+        if record.writes_storage or record.writes_runtime:
+            self.defining_docs[source_path] = DefiningDoc(
+                record.source_hash, record.deps, record.commands, record.writes_runtime
+            )
+        else:
+            self.defining_docs.pop(source_path, None)
+        try:
+            self.records[self._key(doc)] = record
+        except Exception:
+            # e.g., tags that cannot be pickled: render it every time
+            self.records.pop(self._key(doc), None)
+
+    def save_defining_docs(self):
+        """
+        Keep the inputs of the defining documents, after `save` was called for
+        those rendered, without the documents no longer built.
+        """
+        self.defining_docs = {
+            path: defining
+            for path, defining in self.defining_docs.items()
+            if path in self.visited and os.path.exists(path)
+        }
+        self.records[self._defining_key] = self.defining_docs
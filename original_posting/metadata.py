@@ -0,0 +1,271 @@
+"""
+The tags, titles and output paths of the documents of a project, kept in
+SQLite under `.op-cache/metadata.sqlite3` by the builds using `.op-cache`
+(`--cache`, `--compile`, `--incremental`) or writing the search index,
+e.g., for `op query`, which answers tag queries without building the project.
+
+The tags are stored pickled, as the records of `incremental` are: loading
+them runs the code a pickle names, so the store is trusted like the rest
+of `.op-cache`, and must not come from elsewhere.
+
+Besides the pickled tags, the store keeps the keys of the tags of each
+document, see `ptag_dsl.tag_keys`, so that a query only loads the
+documents which can match it.
+
+The store also remembers the digest of every output written, so that a
+build leaves an output alone when its content did not change, e.g., an
+index page whose matching documents are the same.
+
+The terms of the documents in the search index, see `search`, are kept in
+the store as well.
+"""
+from __future__ import annotations
+from collections import ChainMap
+from original_posting.types import OPDocument
+import hashlib
+import json
+import os
+import pathlib
+import pickle
+import sqlite3
+import typing
+
+METADATA_FILENAME = "metadata.sqlite3"
+
+# bump when the schema, or the pickled form of the tags, changes
+METADATA_FORMAT = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    path TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    output TEXT NOT NULL,
+    title TEXT NOT NULL,
+    tags BLOB,
+    -- 0 if some tag keys cannot be stored, so that every query loads the document
+    indexed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    path TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tag_keys (key TEXT NOT NULL, path TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS tag_keys_by_key ON tag_keys (key);
+CREATE INDEX IF NOT EXISTS tag_keys_by_path ON tag_keys (path);
+CREATE TABLE IF NOT EXISTS search_docs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    href TEXT NOT NULL,
+    -- of the output the terms were found in
+    digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS search_terms (
+    shard TEXT NOT NULL,
+    term TEXT NOT NULL,
+    doc INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS search_terms_by_shard ON search_terms (shard);
+CREATE INDEX IF NOT EXISTS search_terms_by_doc ON search_terms (doc);
+"""
+
+_TABLES = ("docs", "outputs", "tag_keys", "search_docs", "search_terms")
+
+
+class DocMetadata(typing.NamedTuple):
+    path: str  # relative to the project
+    title: str
+    output: str
+    tags: list[object]
+
+
+def code_digest(code: str) -> str:
+    return hashlib.sha1(code.encode("utf-8")).hexdigest()
+
+
+def _encode(value: object) -> str | None:
+    if isinstance(value, str):
+        return "s" + value
+    if isinstance(value, (bool, int, float)):
+        # equal numbers share a key, e.g., 1, 1.0 and True; distinct ones
+        # may too, which only adds candidates
+        try:
+            return "n" + repr(float(value))
+        except OverflowError:
+            return "n"
+    return None
+
+
+def encode_key(key: tuple) -> str | None:
+    """A key of `ptag_dsl.tag_keys` as stored, or None if it cannot be."""
+    parts = [key[0]]
+    for each in key[1:]:
+        encoded = _encode(each)
+        if encoded is None:
+            return None
+        parts.append(encoded)
+    return json.dumps(parts, ensure_ascii=False)
+
+
+class MetadataStore:
+    def __init__(self, path: pathlib.Path, readonly: bool = False):
+        if readonly:
+            self.conn = sqlite3.connect(f"{path.as_uri()}?mode=ro", uri=True)
+            return
+        path.parent.mkdir(0o777, parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        (version,) = self.conn.execute("PRAGMA user_version").fetchone()
+        if version != METADATA_FORMAT:
+            with self.conn:
+                for table in _TABLES:
+                    self.conn.execute(f"DROP TABLE IF EXISTS {table}")
+                self.conn.execute(f"PRAGMA user_version={METADATA_FORMAT}")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def put(self, doc: OPDocument):
+        """Record the tags, title and paths of a document just built."""
+        from original_posting.ptag_dsl import tag_keys
+
+        path = doc.project_based_path
+        try:
+            tags: bytes | None = pickle.dumps(list(doc.tags))
+        except Exception:
+            # e.g., tags holding functions: the document is never matched by queries
+            tags = None
+        keys: set[str] = set()
+        indexed = True
+        for tag in doc.tags:
+            for key in tag_keys(tag):
+                encoded = encode_key(key)
+                if encoded is None:
+                    indexed = False
+                else:
+                    keys.add(encoded)
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO docs (path, source, output, title, tags, indexed)"
+                " VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (path) DO UPDATE SET"
+                " source = excluded.source, output = excluded.output,"
+                " title = excluded.title, tags = excluded.tags, indexed = excluded.indexed",
+                (
+                    path,
+                    str(doc.source_path_absolute),
+                    str(doc.output_path_absolute),
+                    doc.title,
+                    tags,
+                    indexed,
+                ),
+            )
+            self.conn.execute("DELETE FROM tag_keys WHERE path = ?", (path,))
+            self.conn.executemany(
+                "INSERT INTO tag_keys (key, path) VALUES (?, ?)", [(k, path) for k in keys]
+            )
+
+    def output_unchanged(self, path: pathlib.Path, digest: str) -> bool:
+        """Whether the file at `path` is the one last written with `digest`."""
+        row = self.conn.execute(
+            "SELECT digest, size, mtime_ns FROM outputs WHERE path = ?", (str(path),)
+        ).fetchone()
+        if row is None or row[0] != digest:
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == (row[1], row[2])
+
+    def written(self, outputs: list[tuple[pathlib.Path, str]]):
+        """Record the outputs on disk and their digests."""
+        rows = []
+        for path, digest in outputs:
+            stat = os.stat(path)
+            rows.append((str(path), digest, stat.st_size, stat.st_mtime_ns))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO outputs (path, digest, size, mtime_ns) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def put_titles(self, docs: typing.Iterable[OPDocument]):
+        """Record the titles of the documents, as the callbacks left them."""
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE docs SET title = ? WHERE path = ?",
+                [(doc.title, doc.project_based_path) for doc in docs],
+            )
+
+    def forget_removed(self, built: typing.Collection[str]):
+        """Drop the documents not built whose source is gone."""
+        removed = [
+            (path,)
+            for (path, source) in self.conn.execute("SELECT path, source FROM docs")
+            if path not in built and not os.path.exists(source)
+        ]
+        if removed:
+            with self.conn:
+                self.conn.executemany("DELETE FROM docs WHERE path = ?", removed)
+                self.conn.executemany("DELETE FROM tag_keys WHERE path = ?", removed)
+
+    def _paths(self, requirement: tuple | None) -> set[str] | None:
+        """The documents found under the requirement of a pattern, or None for all."""
+        if requirement is None:
+            return None
+        if requirement[0] == "key":
+            key = encode_key(requirement[1])
+            if key is None:
+                return None
+            rows = self.conn.execute("SELECT path FROM tag_keys WHERE key = ?", (key,))
+            return {path for (path,) in rows}
+        left = self._paths(requirement[1])
+        right = self._paths(requirement[2])
+        if requirement[0] == "and":
+            if left is None or right is None:
+                return right if left is None else left
+            return left & right
+        if left is None or right is None:
+            return None
+        return left | right
+
+    def candidates(self, pattern) -> list[DocMetadata]:
+        """
+        The documents which can have a tag matching `pattern`, by path; their
+        tags are unpickled, trusting the store as the project's own.
+        """
+        select = "SELECT path, title, output, tags FROM docs WHERE tags IS NOT NULL"
+        paths = None
+        if getattr(pattern, "pure", False):
+            paths = self._paths(getattr(pattern, "requirement", None))
+        if paths is None:
+            rows = list(self.conn.execute(select))
+        else:
+            paths.update(path for (path,) in self.conn.execute("SELECT path FROM docs WHERE indexed = 0"))
+            rows = []
+            for path in paths:
+                rows.extend(self.conn.execute(select + " AND path = ?", (path,)))
+        rows.sort()
+        return [
+            DocMetadata(path, title, output, pickle.loads(tags))
+            for (path, title, output, tags) in rows
+        ]
+
+
+def query(store_path: pathlib.Path, source: str) -> list[DocMetadata]:
+    """The documents having a tag matched by the ptag pattern `source`."""
+    from original_posting.ptag_dsl import match_any_tag, string_to_pattern
+
+    pattern = string_to_pattern(source)
+    store = MetadataStore(store_path, readonly=True)
+    try:
+        docs = store.candidates(pattern)
+    finally:
+        store.close()
+    scope: ChainMap = ChainMap({}, {})
+    return [each for each in docs if match_any_tag(pattern, each.tags, scope)]
@@ -0,0 +1,159 @@
+"""
+Renders documents ahead of the build in worker processes, for `op --jobs N`.
+
+Every document is rendered speculatively by a worker as soon as it is found,
+with a storage of its own. The build still takes the documents one by one
+in the serial order, so `built_docs`, the callbacks and the output are the
+same as in a serial build. A document is rendered again by the build itself,
+at its place in that order, if in the worker it
+- read `project_docs`;
+- looked up or bound names in the shared storage, e.g., the Python scope
+  of '@begin py' and '@ptag-set', which only the build holds;
+- generated symbols with `global_gensym`, whose numbering depends on the
+  documents rendered before;
+- changed the process-wide settings of `Runtime`, e.g., `Runtime.operators`,
+  which the worker then undoes;
+- failed, so that the error is raised where a serial build raises it;
+- or if its result (code, tags, title, data and callbacks) cannot be pickled.
+
+The documents included by a document rendered in a worker are found when the
+build takes its result, and are submitted in turn. Once the build renders a
+document changing `Runtime`, the workers, which only have the settings of the
+start of the build, are stopped and the rest is rendered by the build.
+"""
+from __future__ import annotations
+from original_posting.types import OPDocument, Runtime
+from original_posting.parsing import get_command_entry, _cmd_modules
+from original_posting.incremental import runtime_state, restore_runtime_state
+from original_posting.utils import load_from_source, SOURCE_PACKAGE
+import dataclasses
+import pathlib
+import pickle
+import sys
+import typing
+
+if typing.TYPE_CHECKING:
+    from concurrent.futures import Future
+    from original_posting.build import Build, BuildOptions
+    from original_posting.incremental import DocTrace
+
+_SOURCE_MODULE_PREFIX = SOURCE_PACKAGE + "."
+
+
+class _Job(typing.NamedTuple):
+    project_based_path: str
+    project_path_absolute: pathlib.Path
+    source_path_absolute: pathlib.Path
+    working_dir_absolute: pathlib.Path
+    output_path_absolute: pathlib.Path
+
+
+class _Result(typing.NamedTuple):
+    commands: list[str]  # commands loaded by the worker
+    source_modules: list[str]  # files loaded by the worker through `load_from_source`
+    payload: bytes  # the pickled code, title, tags, data, callbacks and trace
+
+
+_worker_build: Build | None = None
+
+
+def _init_worker(
+    project_path: pathlib.Path,
+    opts: BuildOptions,
+    search_path: list[str],
+    html_parser: str,
+):
+    from original_posting.build import Build
+
+    global _worker_build
+    Runtime.search_path[:] = search_path
+    Runtime.html_parser = html_parser
+    _worker_build = Build(project_path, [], dataclasses.replace(opts, incremental=False))
+
+
+def _render(job: _Job) -> _Result | None:
+    build = _worker_build
+    assert build
+    doc = OPDocument(*job, project_docs=build.built_docs)
+    runtime = runtime_state()
+    try:
+        trace = build._render(doc)
+    except Exception:
+        trace = None
+    if runtime_state() != runtime:
+        # so that the next documents are rendered as at the start of the build
+        restore_runtime_state(runtime)
+        return None
+    if trace is None or trace.shares_state:
+        return None
+    try:
+        payload = pickle.dumps(
+            (doc.code, doc.title, doc.tags, doc.data, doc.callbacks, trace),
+            pickle.HIGHEST_PROTOCOL,
+        )
+    except Exception:
+        return None
+    source_modules = [
+        name[len(_SOURCE_MODULE_PREFIX) :]
+        for name in list(sys.modules)
+        if name.startswith(_SOURCE_MODULE_PREFIX)
+    ]
+    return _Result(list(_cmd_modules), source_modules, payload)
+
+
+class RenderPool:
+    def __init__(self, jobs: int, project_path: pathlib.Path, opts: BuildOptions):
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.executor = ProcessPoolExecutor(
+            jobs,
+            initializer=_init_worker,
+            initargs=(project_path, opts, list(Runtime.search_path), Runtime.html_parser),
+        )
+        self.futures: dict[str, Future[_Result | None]] = {}
+
+    def submit(self, doc: OPDocument):
+        job = _Job(
+            doc.project_based_path,
+            doc.project_path_absolute,
+            doc.source_path_absolute,
+            doc.working_dir_absolute,
+            doc.output_path_absolute,
+        )
+        self.futures[doc.project_based_path] = self.executor.submit(_render, job)
+
+    def take(self, doc: OPDocument) -> DocTrace | None:
+        """
+        Fill `doc` with what a worker rendered, or return None if
+        the build has to render it.
+        """
+        future = self.futures.pop(doc.project_based_path, None)
+        if future is None:
+            return None
+        try:
+            result = future.result()
+        except Exception:
+            return None
+        if result is None:
+            return None
+
+        # the classes and functions in the payload are pickled by reference to
+        # the modules of the commands, which must be the ones the build uses
+        for cmd_name in result.commands:
+            get_command_entry(cmd_name)
+        for file in result.source_modules:
+            if _SOURCE_MODULE_PREFIX + file not in sys.modules:
+                load_from_source(file)
+        try:
+            code, title, tags, data, callbacks, trace = pickle.loads(result.payload)
+        except Exception:
+            return None
+        doc.code = code
+        doc.title = title
+        doc.tags = tags
+        doc.data = data
+        doc.callbacks = callbacks
+        return trace
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
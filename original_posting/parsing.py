@@ -1,34 +1,59 @@
 from __future__ import annotations
 from original_posting.types import OPDocument, CommandEntry, Scope, Context, Runtime
 from original_posting.utils import create_syntax_error, load_from_source
-from pathlib import Path
+from original_posting.registry import CommandScript, commands
+import original_posting.builtin_names as names
 import os
 import io
+import bisect
+import hashlib
+import pickle
+import time
 import re
 import shlex
 import typing
+import warnings
 
 
 _line_end = re.compile("\n\r|\n|\r|$")
-_inline_command_head = re.compile(r"[^ \r\n\t\|]+\|")
+
+# Everything that can follow an '@' outside of a scope, tried in order:
+# '@begin', the operators '@(...)', '@[...]' and '@{...}' (whose bodies may
+# contain escaped delimiters), and finally the head of an inline command.
+_at_dispatch = re.compile(
+    r"@(?:"
+    r"(?P<begin>begin)"
+    r"|\((?P<paren>(?:[^\\)]|\\[()]|\\(?![()]))*)\)"
+    r"|\[(?P<bracket>(?:[^\\\]]|\\[\[\]]|\\(?![\[\]]))*)\]"
+    r"|\{(?P<brace>(?:[^\\}]|\\[{}]|\\(?![{}]))*)\}"
+    r"|(?P<inline>[^ \r\n\t\|]+)\|"
+    r")"
+)
+_operator_groups = {"paren": "()", "bracket": "[]", "brace": "{}"}
 
 
 _GLOBAL_STORAGE = {"builtin-rootdir": os.getcwd()}
 
 
-def new_context(filename: str, source: str, storage: dict, target_doc: OPDocument):
+def new_context(
+    filename: str,
+    source: str,
+    storage: dict,
+    target_doc: OPDocument,
+    tree: SourceTree | None = None,
+):
     return Context(
         source,
         len(source),
         pos=0,
-        line=0,
-        col=0,
         cur_scope=None,
         os="unknown",
         linesep=os.linesep,
         file=filename,
         storage=storage,
         target_doc=target_doc,
+        tree=tree or SourceTree(),
+        lines=LineTable(source, os.linesep),
     )
 
 
@@ -36,21 +61,26 @@ def new_context_from_existing(
     ctx: Context,
     start: int,
     end: int,
-    start_line: int,
-    start_col: int,
+    start_line: int | None = None,
+    start_col: int | None = None,
 ):
+    """
+    A context for `ctx.source[start:end]`, sharing the tree and the line
+    table of `ctx`; `start_line` and `start_col` are accepted from the
+    callers of older versions and ignored.
+    """
     return Context(
         ctx.source,
         end,
         pos=start,
-        line=start_line,
-        col=start_col,
         cur_scope=None,
         os=ctx.os,
         linesep=ctx.linesep,
         file=ctx.file,
         storage=ctx.storage,
         target_doc=ctx.target_doc,
+        tree=ctx.tree,
+        lines=ctx.lines,
     )
 
 
@@ -79,272 +109,519 @@ def find_match(
             offset += 1
 
 
-_cmd_modules: dict[str, typing.Type[CommandEntry]] = {}
+_cmd_modules: dict[str, tuple[CommandScript, typing.Type[CommandEntry]]] = {}
+command_import_times: dict[str, float] = {}  # seconds taken to load each command
 
 
 def get_command_entry(cmd_name: str):
-    if cmd_name in _cmd_modules:
-        return _cmd_modules[cmd_name]  # type: ignore
-
-    cmd_file_abs_path = find_file(cmd_name + ".py")
-    if not cmd_file_abs_path:
+    script = commands.find_command(cmd_name)
+    if not script:
         return
-    m = load_from_source(cmd_file_abs_path)
+    loaded = _cmd_modules.get(cmd_name)
+    if loaded and loaded[0] == script:
+        return loaded[1]
+
+    t0 = time.perf_counter()
+    if script.entry_point:
+        m = script.entry_point.load()
+    else:
+        m = load_from_source(script.path)
+    command_import_times[cmd_name] = time.perf_counter() - t0
+    if isinstance(m, type) and issubclass(m, CommandEntry):
+        _cmd_modules[cmd_name] = script, m
+        return m
     for v in m.__dict__.values():
         if (
             isinstance(v, type)
             and v is not CommandEntry
             and issubclass(v, CommandEntry)
         ):
-            _cmd_modules[cmd_name] = v
+            _cmd_modules[cmd_name] = script, v
             return v
 
 
 def find_file(filename: str) -> str | None:
-    for each in Runtime.search_path:
-        search_dir = Path(each).expanduser()
-        if not search_dir.exists():
-            continue
-        for p in search_dir.iterdir():
-            if p.name == filename:
-                return str(p.absolute())
+    script = commands.find_file(filename)
+    return script and script.path
 
 
-def _new_scope(ctx: Context, i: int):
-    orig_i = i
-    i += len("@begin")
-    ctx.col += len("@begin")
+class TextNode(typing.NamedTuple):
+    """Plain text, `source[start:end]`."""
+
+    start: int
+    end: int
+
+
+class OperatorNode(typing.NamedTuple):
+    """`@(...)`, `@[...]` or `@{...}`; the operand is `source[start:end]`."""
+
+    op: str
+    start: int
+    end: int
+    stop: int
+
+
+class InlineNode(typing.NamedTuple):
+    """`@name|...|`; the content is `source[start:end]`."""
+
+    name: str
+    at: int
+    start: int
+    end: int
+    stop: int
+
+
+class BlockNode(typing.NamedTuple):
+    """
+    `@begin name args...` ... `@end name`; the body is `source[start:end]`,
+    and `end` is -1 if the block is never closed.
+    """
+
+    name: str
+    args: tuple[str, ...]
+    at: int
+    start: int
+    end: int
+    stop: int
+
 
-    find = _line_end.search(ctx.source, i, ctx.n_source)
+if typing.TYPE_CHECKING:
+    Node = typing.Union[TextNode, OperatorNode, InlineNode, BlockNode]
+
+# bump when the layout of the nodes changes
+TREE_FORMAT = 2
+
+
+class SourceTree:
+    """
+    The nodes of a source, keyed by the spans they were parsed from.
+
+    A block's body is only parsed once its command asks for it through
+    `process_nest`, hence the bodies of '@plain' or '@comment' never are.
+    """
+
+    def __init__(
+        self,
+        spans: dict[tuple[int, int], tuple[Node, ...]] | None = None,
+        digest: str | None = None,
+    ):
+        self.spans = spans if spans is not None else {}
+        self.digest = digest
+        self.dirty = False
+
+    def source_digest(self, source: str) -> str:
+        if self.digest is None:
+            self.digest = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        return self.digest
+
+    def get(self, ctx: Context, start: int, end: int) -> tuple[Node, ...]:
+        nodes = self.spans.get((start, end))
+        if nodes is None:
+            nodes = self.spans[start, end] = parse(ctx, start, end)
+            self.dirty = True
+        return nodes
+
+    def dumps(self, digest: str) -> bytes:
+        return pickle.dumps(
+            (TREE_FORMAT, os.linesep, digest, self.spans), pickle.HIGHEST_PROTOCOL
+        )
+
+    @classmethod
+    def loads(cls, data: bytes, digest: str) -> SourceTree:
+        """Restore a tree dumped for a source of the same `digest`, or start afresh."""
+        try:
+            fmt, linesep, old_digest, spans = pickle.loads(data)
+        except Exception:
+            return cls(digest=digest)
+        if (fmt, linesep, old_digest) != (TREE_FORMAT, os.linesep, digest):
+            return cls(digest=digest)
+        return cls(spans, digest)
+
+
+class LineTable:
+    """
+    The offsets where the lines of a source start, only computed
+    once a position has to be reported, e.g., in a syntax error.
+    """
+
+    def __init__(self, source: str, linesep: str):
+        self.source = source
+        self.linesep = linesep
+        self._starts: list[int] | None = None
+
+    @property
+    def starts(self) -> list[int]:
+        if self._starts is None:
+            n = len(self.linesep)
+            self._starts = [0]
+            self._starts.extend(
+                m.start() + n for m in re.finditer(re.escape(self.linesep), self.source)
+            )
+        return self._starts
+
+    def line_of(self, pos: int) -> int:
+        """0-based line of the offset `pos`."""
+        return bisect.bisect_right(self.starts, pos) - 1
+
+    def col_of(self, pos: int) -> int:
+        """0-based column of the offset `pos`."""
+        return pos - self.starts[self.line_of(pos)]
+
+
+def _parse_block(ctx: Context, at: int, end: int):
+    source = ctx.source
+    i = at + len("@begin")
+    find = _line_end.search(source, i, end)
     if not find:
         raise create_syntax_error(
-            "@begin not found", ctx.source[orig_i:], ctx.line, i, ctx.file
+            "@begin not found", source[at:], ctx.lines.line_of(at), i, ctx.file
         )
+    i_line_end, body_start = find.span()
 
-    i_line_end, i_next = find.span()
-
-    cmd = ctx.source[i:i_line_end].strip()
-    args = shlex.split(cmd)
+    args = shlex.split(source[i:i_line_end].strip())
     if not args:
         raise create_syntax_error(
-            msg=f"{ctx.source[i:i_line_end]} is not a valid scope name",
-            text=ctx.source[orig_i:i_line_end],
-            line=ctx.line,
+            msg=f"{source[i:i_line_end]} is not a valid scope name",
+            text=source[at:i_line_end],
+            line=ctx.lines.line_of(at),
             offset=i,
             file=ctx.file,
         )
-    cmd, *args = args
-    cmd_entry = get_command_entry(cmd)
-    if not cmd_entry:
+    name, *args = args
+
+    # find the first unescaped '@end <name>' line
+    k = body_start
+    while source.startswith("\\@", k):
+        k += len("\\@")
+    j = source.find("@end", k)
+    while 0 <= j < end:
+        if j > k and source[j - 1] == "\\":
+            j = source.find("@end", j + 1)
+            continue
+        find = _line_end.search(source, j + len("@end"))
+        assert find
+        end_name = source[j + len("@end") : find.start()].strip()
+        if not end_name:
+            raise create_syntax_error(
+                f"'@end' followed by no command name, did you mean by '@end {name}'?",
+                text=source[j : find.start()],
+                line=ctx.lines.line_of(j),
+                offset=j + len("@end"),
+                file=ctx.file,
+            )
+        if end_name == name:
+            return BlockNode(name, tuple(args), at, body_start, j, find.end())
+        j = source.find("@end", j + 1)
+
+    return BlockNode(name, tuple(args), at, body_start, -1, end)
+
+
+def _parse_inline(ctx: Context, at: int, command_name_end: int, end: int):
+    source = ctx.source
+    cmd = source[at + 1 : command_name_end]
+    command_content_start = command_name_end
+    while command_content_start < end and source[command_content_start] == "|":
+        command_content_start += 1
+    n_xor_sign = command_content_start - command_name_end
+    command_content_end = source.find("|" * n_xor_sign, command_content_start, end)
+    if command_content_end < 0:
         raise create_syntax_error(
-            f"command {cmd} is not found",
-            text=ctx.source[orig_i:i_line_end],
-            line=ctx.line,
-            offset=i,
+            msg=f"{cmd} starts with {n_xor_sign} '|' sign, but no matching ending was found.",
+            text=source[at : command_content_start + 10],
+            line=ctx.lines.line_of(at),
+            offset=at,
             file=ctx.file,
         )
-    ctx.pos = i_next
-    ctx.line += 1
-    ctx.col = 0
-    ctx.cur_scope = Scope(cmd, cmd_entry(ctx), i_next, args, ctx.line, ctx.col)
-    return
+    i_next = command_content_end + n_xor_sign
+    return InlineNode(cmd, at, command_content_start, command_content_end, i_next)
 
 
-def _new_scope_inline(builder: io.StringIO, ctx: Context, i: int):
-    m = _inline_command_head.match(ctx.source, i + 1, ctx.n_source)
-    if not m:
-        return False
-    _, command_name_end = m.span()
-    command_name_end -= 1
-    cmd = ctx.source[i + 1 : command_name_end]
-    n_xor_sign = 0
-    xor_sign_i = command_name_end
-    while xor_sign_i < ctx.n_source and ctx.source[xor_sign_i] == "|":
-        n_xor_sign += 1
-        xor_sign_i += 1
-    pat = "|" * n_xor_sign
-    command_content_start = xor_sign_i
-    command_content_end = ctx.source.find(pat, command_content_start, ctx.n_source)
-    if command_content_end < 0:
+def _parse_operator(ctx: Context, at: int, m: re.Match):
+    group = m.lastgroup
+    assert group in _operator_groups
+    start, end = m.span(group)
+    if ctx.source.count(ctx.linesep, start, end):
         raise create_syntax_error(
-            msg=f"{cmd} starts with {n_xor_sign} '|' sign, but no matching ending was found.",
-            text=ctx.source[i : command_content_start + 10],
-            line=ctx.line,
-            offset=i,
-            file=ctx.file,
+            "unexpected newline",
+            ctx.source[at : end + 1],
+            ctx.lines.line_of(at),
+            at,
+            ctx.file,
         )
-    cmd_entry = get_command_entry(cmd)
-    if not cmd_entry:
-        raise create_syntax_error(
-            f"command {cmd} is not found",
-            text=ctx.source[i : command_content_start + 10],
-            line=ctx.line,
-            offset=i,
+    return OperatorNode(_operator_groups[group], start, end, m.end())
+
+
+def parse(ctx: Context, start: int, end: int) -> tuple[Node, ...]:
+    """Split `ctx.source[start:end]` into nodes, without running any command."""
+    source = ctx.source
+    nodes: list[Node] = []
+    i = start
+    while True:
+        while source.startswith("\\@", i):
+            i += len("\\@")
+        if i >= end:
+            break
+
+        # a run of plain text, up to the next '@' starting a command
+        # or the backslash escaping an '@'
+        j = i
+        m = None
+        while True:
+            j = source.find("@", j, end)
+            if j < 0:
+                j = end
+                if source.startswith("\\@", j - 1):
+                    j -= 1
+                break
+            if j > i and source[j - 1] == "\\":
+                j -= 1
+                break
+            m = _at_dispatch.match(source, j, end)
+            if m:
+                break
+            j += 1
+        if j > i:
+            nodes.append(TextNode(i, j))
+        i = j
+        if not m:
+            continue
+
+        group = m.lastgroup
+        if group == "begin":
+            node = _parse_block(ctx, j, end)
+        elif group == "inline":
+            node = _parse_inline(ctx, j, m.end(group), end)
+        else:
+            node = _parse_operator(ctx, j, m)
+        nodes.append(node)
+        i = node.stop
+    return tuple(nodes)
+
+
+def resolve_command(ctx: Context, node: InlineNode | BlockNode):
+    cmd_entry = get_command_entry(node.name)
+    if cmd_entry:
+        used_commands = ctx.storage.get(names.NAME_UsedCommands)
+        if used_commands is not None:
+            used_commands.add(node.name)
+        return cmd_entry
+    if isinstance(node, InlineNode):
+        text = ctx.source[node.at : node.start + 10]
+        offset = node.at
+    else:
+        offset = node.at + len("@begin")
+        find = _line_end.search(ctx.source, offset, ctx.n_source)
+        assert find
+        text = ctx.source[node.at : find.start()]
+    raise create_syntax_error(
+        f"command {node.name} is not found",
+        text=text,
+        line=ctx.lines.line_of(node.at),
+        offset=offset,
+        file=ctx.file,
+    )
+
+
+def command_failed(ctx: Context, node: InlineNode | BlockNode):
+    if isinstance(node, InlineNode):
+        return create_syntax_error(
+            f"{node.name} failed to process (args: {[]})",
+            text=ctx.source[node.at : node.stop + 20],
+            line=ctx.lines.line_of(node.at),
+            offset=node.at,
             file=ctx.file,
         )
-    i_next = command_content_end + n_xor_sign
-    ctx.pos = i_next
-    scope = ctx.cur_scope = Scope(cmd, cmd_entry(ctx), i_next, [], ctx.line, ctx.col)
+    cur_scope = ctx.cur_scope
+    assert cur_scope
+    find = _line_end.search(ctx.source, node.end + len("@end"))
+    assert find
+    return create_syntax_error(
+        f"{cur_scope.name} failed to process (args: {cur_scope.args})",
+        text=ctx.source[node.end : find.start()],
+        line=ctx.lines.line_of(node.end),
+        offset=node.end + len("@end"),
+        file=ctx.file,
+    )
+
+
+def _eval_inline(ctx: Context, node: InlineNode):
+    cmd_entry = resolve_command(ctx, node)
+    ctx.pos = node.stop
+    scope = ctx.cur_scope = Scope(node.name, cmd_entry(ctx), node.stop, [], lines=ctx.lines)
     try:
-        text = scope.cmd_entry.inline_proc(command_content_start, i_next - n_xor_sign)
+        return scope.cmd_entry.inline_proc(node.start, node.end)
     except Exception as e:
-        raise create_syntax_error(
-            f"{cmd} failed to process (args: {[]})",
-            text=ctx.source[i : i_next + 20],
-            line=ctx.line,
-            offset=i,
-            file=ctx.file,
-        ) from e
+        raise command_failed(ctx, node) from e
     finally:
         ctx.cur_scope = None
-    builder.write(text)
-    l_inc = ctx.source.count(ctx.linesep, i, i_next)
-    if l_inc:
-        ctx.line += l_inc
-        ctx.col = 0
+
+
+def _eval_block(ctx: Context, node: BlockNode):
+    cmd_entry = resolve_command(ctx, node)
+    ctx.pos = node.start
+    cur_scope = ctx.cur_scope = Scope(
+        node.name, cmd_entry(ctx), node.start, list(node.args), lines=ctx.lines
+    )
+    try:
+        if node.end < 0:
+            # never closed: the rest of the source is swallowed
+            return ""
+        try:
+            text = cur_scope.cmd_entry.proc(cur_scope.args, cur_scope.start, node.end)
+            if not isinstance(text, str):
+                raise TypeError(f"command {cur_scope.name}'s `proc` method didn't return a string, but a (an) {type(text)}.")
+        except Exception as e:
+            raise command_failed(ctx, node) from e
+        return text
+    finally:
+        ctx.cur_scope = None
+
+
+def evaluate(builder: io.StringIO, ctx: Context, nodes: typing.Iterable[Node]):
+    """Run the commands in `nodes` and write the results to `builder`."""
+    source = ctx.source
+    for node in nodes:
+        if isinstance(node, TextNode):
+            builder.write(source[node.start : node.end])
+        elif isinstance(node, OperatorNode):
+            ctx.pos = node.stop
+            builder.write(Runtime.operators[node.op](ctx, node.start, node.end))
+        elif isinstance(node, InlineNode):
+            builder.write(_eval_inline(ctx, node))
+        else:
+            builder.write(_eval_block(ctx, node))
+    ctx.pos = ctx.n_source
+
+
+def _render(ctx: Context, start: int, end: int):
+    nodes = ctx.tree.get(ctx, start, end)
+    buf = io.StringIO()
+    render_cache = ctx.storage.get(names.NAME_RenderCache)
+    if render_cache:
+        for text in render_cache.get(ctx, start, end, nodes)(ctx):
+            buf.write(text)
+        ctx.pos = ctx.n_source
     else:
-        ctx.col = i_next
+        evaluate(buf, ctx, nodes)
+    return buf.getvalue()
+
+
+def process(
+    filename: str,
+    source: str,
+    storage: dict,
+    target_doc: OPDocument,
+    tree: SourceTree | None = None,
+):
+    storage = storage or _GLOBAL_STORAGE
+    ctx = new_context(filename, source, storage, target_doc, tree)
+    return _render(ctx, 0, ctx.n_source)
+
+
+def process_nest(ctx: Context, start: int, end: int):
+    assert ctx.cur_scope
+    new_ctx = new_context_from_existing(ctx, start, end)
+    return _render(new_ctx, start, end)
+
+
+# The scanner of older versions, kept for the command scripts calling it.
+
+
+def process_iter(builder: io.StringIO, ctx: Context):
+    """
+    Deprecated, use `process_nest`.
+
+    Older versions rendered one character or command per call; this renders
+    the rest of `ctx.source` on the first call, so that the loop
+    `while process_iter(buf, ctx): pass` still works. Within `ctx.cur_scope`,
+    the text is skipped up to its '@end', which runs the command.
+    """
+    warnings.warn(
+        "process_iter is deprecated, use process_nest instead", DeprecationWarning, stacklevel=2
+    )
+    source = ctx.source
+    i = ctx.pos
+    while source.startswith("\\@", i):
+        i += len("\\@")
+    ctx.pos = i
+    if i >= ctx.n_source:
+        return False
+    if not ctx.cur_scope:
+        evaluate(builder, ctx, ctx.tree.get(ctx, i, ctx.n_source))
+        return True
+    j = source.find("@end", i, ctx.n_source)
+    while j >= 0:
+        if not (j > i and source[j - 1] == "\\") and _end_scope(builder, ctx, j):
+            ctx.cur_scope = None
+            return True
+        j = source.find("@end", j + 1, ctx.n_source)
+    # never closed: the rest of the source is swallowed
+    ctx.pos = ctx.n_source
+    return True
+
+
+def _new_scope(ctx: Context, i: int):
+    """Enter the block starting with the '@begin' at `i`."""
+    node = _parse_block(ctx, i, ctx.n_source)
+    cmd_entry = resolve_command(ctx, node)
+    ctx.pos = node.start
+    ctx.cur_scope = Scope(
+        node.name, cmd_entry(ctx), node.start, list(node.args), lines=ctx.lines
+    )
+
 
+def _new_scope_inline(builder: io.StringIO, ctx: Context, i: int):
+    """Run the inline command at `i`, if any."""
+    m = _at_dispatch.match(ctx.source, i, ctx.n_source)
+    if not m or m.lastgroup != "inline":
+        return False
+    node = _parse_inline(ctx, i, m.end("inline"), ctx.n_source)
+    builder.write(_eval_inline(ctx, node))
     return True
 
 
 def _end_scope(builder: io.StringIO, ctx: Context, i: int):
-    o_orig = i
-    i += len("@end")
-    find = _line_end.search(ctx.source, i)
+    """Run the command of `ctx.cur_scope` if the '@end' at `i` closes it."""
+    find = _line_end.search(ctx.source, i + len("@end"))
     if not find:
         return False
     i_line_end, i_next = find.span()
-    cmd = ctx.source[i:i_line_end].strip()
+    name = ctx.source[i + len("@end") : i_line_end].strip()
     cur_scope = ctx.cur_scope
     assert cur_scope
-    if not cmd.strip():
+    if not name:
         raise create_syntax_error(
             f"'@end' followed by no command name, did you mean by '@end {cur_scope.name}'?",
-            text=ctx.source[o_orig:i_line_end],
-            line=ctx.line,
-            offset=i,
+            text=ctx.source[i:i_line_end],
+            line=ctx.lines.line_of(i),
+            offset=i + len("@end"),
             file=ctx.file,
         )
-    if cmd != cur_scope.name:
+    if name != cur_scope.name:
         return False
+    node = BlockNode(name, tuple(cur_scope.args), cur_scope.start, cur_scope.start, i, i_next)
     try:
-        text = cur_scope.cmd_entry.proc(cur_scope.args, cur_scope.start, o_orig)
+        text = cur_scope.cmd_entry.proc(cur_scope.args, cur_scope.start, i)
         if not isinstance(text, str):
             raise TypeError(f"command {cur_scope.name}'s `proc` method didn't return a string, but a (an) {type(text)}.")
     except Exception as e:
-        raise create_syntax_error(
-            f"{cur_scope.name} failed to process (args: {cur_scope.args})",
-            text=ctx.source[o_orig:i_line_end],
-            line=ctx.line,
-            offset=i,
-            file=ctx.file,
-        ) from e
+        raise command_failed(ctx, node) from e
     builder.write(text)
     ctx.pos = i_next
-    ctx.line += 1
-    ctx.col = 0
     return True
 
 
-_parens_escape = frozenset({r"\(", r"\)"})
-_brackets_escape = frozenset({r"\[", r"\]"})
-_braces_escape = frozenset({r"\{", r"\}"})
-_escapes = {
-    "[]": _brackets_escape,
-    "()": _parens_escape,
-    "{}": _braces_escape,
-}
-
-
 def _handle_operator(builder: io.StringIO, ctx: Context, i: int):
-    for l, r, op in ("(", ")", "()"), ("[", "]", "[]"), ("{", "}", "{}"):
-        found = find_match(l, r, _escapes[op], ctx.source, i + 1, ctx.n_source)
-        if found:
-            (start, end), ctx.pos = found
-            l_inc = str.count(ctx.source, ctx.linesep, start, end)
-            if l_inc:
-                raise create_syntax_error(
-                    "unexpected newline", ctx.source[i : end + 1], ctx.line, i, ctx.file
-                )
-            ctx.col += 1
-            builder.write(Runtime.operators[op](ctx, start, end))
-            ctx.col = end + 1
-            return True
-    return False
-
-
-def process_iter(builder: io.StringIO, ctx: Context):
-    i = ctx.pos
-    while ctx.source.startswith("\\@", i):
-        i += len("\\@")
-    ctx.pos = i
-    if i >= ctx.n_source:
+    """Apply the operator at `i`, if any."""
+    m = _at_dispatch.match(ctx.source, i, ctx.n_source)
+    if not m or m.lastgroup not in _operator_groups:
         return False
-
-    if ctx.cur_scope:
-        if ctx.source.startswith("@end", i) and _end_scope(builder, ctx, i):
-            ctx.cur_scope = None
-            return True
-        c = ctx.source[i]
-
-        if c in ctx.linesep:
-            ctx.line += 1
-            ctx.col = 0
-        else:
-            ctx.col += 1
-        ctx.pos = i + 1
-        return True
-
-    if ctx.source.startswith("@begin", i):
-        _new_scope(ctx, i)
-        ctx.line += 1
-        ctx.col = 0
-        return True
-    elif ctx.source.startswith("@", i):
-        # operators
-        if _handle_operator(builder, ctx, i):
-            return True
-        # inline commands
-        if _new_scope_inline(builder, ctx, i):
-            return True
-
-    c = ctx.source[i]
-    builder.write(c)
-    if c in ctx.linesep:
-        ctx.line += 1
-        ctx.col = 0
-    else:
-        ctx.col += 1
-    ctx.pos = i + 1
+    node = _parse_operator(ctx, i, m)
+    ctx.pos = node.stop
+    builder.write(Runtime.operators[node.op](ctx, node.start, node.end))
     return True
 
 
-def process(filename: str, source: str, storage: dict, target_doc: OPDocument):
-    storage = storage or _GLOBAL_STORAGE
-    ctx = new_context(filename, source, storage, target_doc)
-    buf = io.StringIO()
-    while process_iter(buf, ctx):
-        pass
-    return buf.getvalue()
-
-
-def process_nest(ctx: Context, start: int, end: int):
-    assert ctx.cur_scope
-    cur_scope = ctx.cur_scope
-    new_ctx = new_context_from_existing(
-        ctx,
-        start,
-        end,
-        cur_scope.start_line,
-        cur_scope.start_col,
-    )
-    buf = io.StringIO()
-    while process_iter(buf, new_ctx):
-        pass
-    return buf.getvalue()
-
-
 __all__ = [
     "process",
     "process_nest",
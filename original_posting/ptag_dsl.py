@@ -2,7 +2,10 @@ from __future__ import annotations
 import textwrap
 from typing import Sequence
 from collections import ChainMap
+from collections.abc import Mapping
+import original_posting.builtin_names as names
 import builtins
+import weakref
 import ast
 import functools
 import typing
@@ -11,12 +14,128 @@ import typing
 P = typing.Callable[[object, dict], bool]
 
 
+class Term(Mapping):
+    """
+    A parametric tag 'f(a, b)', immutable and interned when hashable.
+
+    For the code written against the former dict form, a term is also a
+    read-only mapping with the keys "__func__" and "__args__", the latter
+    giving its arguments as a list; `as_dict` converts it back entirely.
+    A term is not a `dict`, so `isinstance(tag, dict)` is false for it,
+    and dict patterns such as '{__func__: f}' do not match it: test for
+    `Term`, or for `collections.abc.Mapping`, instead.
+    """
+
+    __slots__ = ("func", "args", "_hash", "_key", "__weakref__")
+    func: object
+    args: tuple[object, ...]
+
+    _interned: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+
+    def __new__(cls, func: object, args: typing.Iterable[object] = ()):
+        args = tuple(args)
+        try:
+            key = (_intern_key(func), tuple(map(_intern_key, args)))
+            term = cls._interned.get(key)
+        except TypeError:
+            return cls._make(func, args, None, None)
+        if term is None:
+            term = cls._interned[key] = cls._make(func, args, hash((func, args)), key)
+        return term
+
+    @classmethod
+    def _make(cls, func: object, args: tuple[object, ...], hash_value: int | None, key: tuple | None):
+        term = object.__new__(cls)
+        object.__setattr__(term, "func", func)
+        object.__setattr__(term, "args", args)
+        object.__setattr__(term, "_hash", hash_value)
+        object.__setattr__(term, "_key", key)
+        return term
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        return (Term, (self.func, self.args))
+
+    def __hash__(self):
+        if self._hash is None:
+            raise TypeError(f"unhashable arguments in {self!r}")
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, Term):
+            return self.func == other.func and self.args == other.args
+        if isinstance(other, dict):
+            return self.as_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Term({self.func!r}, {self.args!r})"
+
+    def __getitem__(self, key):
+        if key == "__func__":
+            return self.func
+        if key == "__args__":
+            return list(self.args)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(("__func__", "__args__"))
+
+    def __len__(self):
+        return 2
+
+    def as_dict(self) -> dict[str, object]:
+        """The former dict form of the term, with the terms in its arguments converted too."""
+        return {
+            "__func__": self.func,
+            "__args__": [each.as_dict() if isinstance(each, Term) else each for each in self.args],
+        }
+
+
+def _intern_key(value: object) -> object:
+    """
+    The key of `value` in the table of the interned terms, holding the types
+    at every level, so that arguments equal but printed differently, e.g.,
+    1 and True, or (1, 2) and (1.0, 2), are kept in distinct terms.
+    Raises `TypeError` for unhashable values.
+    """
+    if isinstance(value, Term):
+        if value._key is None:
+            raise TypeError(f"unhashable arguments in {value!r}")
+        return (Term, value._key)
+    if isinstance(value, tuple):
+        return (type(value), tuple(map(_intern_key, value)))
+    hash(value)
+    return (type(value), value)
+
+
+# How a pattern narrows down the tags it can match, for `match_batch`: None if
+# any tag can match, ("key", k) if only the tags of the key k (see `tag_keys`)
+# can match, and ("and", r1, r2) or ("or", r1, r2) to combine requirements,
+# e.g., ("and", ("key", ("func", "f", 1)), ("key", ("arg", "f", 1, 0, "x"))) for 'f("x")'.
+Requirement = typing.Optional[tuple]
+
+
+def _indexed(apply, children: Sequence[P] = (), requirement: Requirement = None):
+    """
+    Attach to a pattern its requirement, and whether it is pure, i.e., it
+    matches a tag whatever the scope, as it has no predicate 'P[..]'.
+    """
+    apply.requirement = requirement
+    apply.pure = all(getattr(each, "pure", False) for each in children)
+    return apply
+
+
 def cps_capture(id: str) -> P:
     def apply(o, scope):
         scope[id] = o
         return True
 
-    return apply
+    return _indexed(apply)
 
 
 def cps_seq(p_elts: Sequence[P]) -> P:
@@ -30,7 +149,7 @@ def cps_seq(p_elts: Sequence[P]) -> P:
                 return False
         return True
 
-    return apply
+    return _indexed(apply, p_elts)
 
 
 def cps_seq3(p_init: Sequence[P], p_pack: P, p_tail) -> P:
@@ -49,33 +168,41 @@ def cps_seq3(p_init: Sequence[P], p_pack: P, p_tail) -> P:
                 return False
         return p_pack(o[len(p_init) : len(o) - len(p_tail)], scope)
 
-    return apply
+    return _indexed(apply, [*p_init, p_pack, *p_tail])
 
 
 def cps_literal(v) -> P:
     def apply(o, scope):
         return o == v
 
-    return apply
+    try:
+        hash(v)
+    except TypeError:
+        return _indexed(apply)
+    return _indexed(apply, requirement=("key", ("lit", v)))
 
 def cps_not(p: P) -> P:
     def apply(o, scope):
         return not p(o, {**scope})
-    return apply
+    return _indexed(apply, [p])
 
 _undef = object()
 
 
 def cps_deconstruct(p_name: P, p_args: list[P]) -> P:
     def apply(o, scope):
-        if not isinstance(o, dict):
-            return False
-        v = o.get("__func__", _undef)
-        if v is _undef:
-            return False
-        args = o.get("__args__", _undef)
-        if args is _undef or not isinstance(args, list):
+        if isinstance(o, Term):
+            v = o.func
+            args = o.args
+        elif not isinstance(o, dict):
             return False
+        else:
+            v = o.get("__func__", _undef)
+            if v is _undef:
+                return False
+            args = o.get("__args__", _undef)
+            if args is _undef or not isinstance(args, list):
+                return False
         if len(args) != len(p_args):
             return False
         if not p_name(v, scope):
@@ -85,7 +212,23 @@ def cps_deconstruct(p_name: P, p_args: list[P]) -> P:
                 return False
         return True
 
-    return apply
+    name = _literal_of(p_name)
+    if name is _undef:
+        return _indexed(apply, [p_name, *p_args], ("key", ("arity", len(p_args))))
+    requirement: Requirement = ("key", ("func", name, len(p_args)))
+    for i, p in enumerate(p_args):
+        arg = _literal_of(p)
+        if arg is not _undef:
+            requirement = ("and", requirement, ("key", ("arg", name, len(p_args), i, arg)))
+    return _indexed(apply, [p_name, *p_args], requirement)
+
+
+def _literal_of(p: P) -> object:
+    """The value matched by a literal pattern, or `_undef`."""
+    requirement = getattr(p, "requirement", None)
+    if requirement and requirement[0] == "key" and requirement[1][0] == "lit":
+        return requirement[1][1]
+    return _undef
 
 
 def cps_dict(kv: list[tuple[object, P]]) -> P:
@@ -97,28 +240,28 @@ def cps_dict(kv: list[tuple[object, P]]) -> P:
                 return False
         return True
 
-    return apply
+    return _indexed(apply, [p for (_, p) in kv])
 
 
 def cps_typecheck(t: type):
     def apply(o, scope):
         return isinstance(o, t)
 
-    return apply
+    return _indexed(apply)
 
 
 def cps_or(p1: P, p2: P):
     def apply(o, scope):
         return p1(o, scope) or p2(o, scope)
 
-    return apply
+    return _indexed(apply, [p1, p2], _combine("or", p1, p2))
 
 
 def cps_and(p1: P, p2: P):
     def apply(o, scope):
         return p1(o, scope) and p2(o, scope)
 
-    return apply
+    return _indexed(apply, [p1, p2], _combine("and", p1, p2))
 
 
 def cps_and_seq(p1: P, p2: P):
@@ -136,13 +279,15 @@ def cps_and_seq(p1: P, p2: P):
                 r = True
         return l and r
 
-    return apply
+    return _indexed(apply, [p1, p2])
 
 
 def cps_predicate(f):
     def apply(o, scope):
         return f(o, scope)
 
+    apply.requirement = None
+    apply.pure = False
     return apply
 
 
@@ -150,6 +295,20 @@ def cps_wildcard(o, scope):
     return True
 
 
+_indexed(cps_wildcard)
+
+
+def _combine(op: str, p1: P, p2: P) -> Requirement:
+    r1 = getattr(p1, "requirement", None)
+    r2 = getattr(p2, "requirement", None)
+    if op == "and":
+        if r1 is None or r2 is None:
+            return r1 or r2
+    elif r1 is None or r2 is None:
+        return None
+    return (op, r1, r2)
+
+
 class PTagPredicationBuilder(ast.NodeTransformer):
     def visit_slice(self, node: ast.slice):
         """Python 3.7 compat"""
@@ -165,6 +324,32 @@ class PTagPredicationBuilder(ast.NodeTransformer):
         raise TypeError(f"slice: {node} is not supported")
 
 
+def _predicate_condition(node: ast.Subscript) -> ast.expr:
+    """The condition of a predicate 'P[expr]', or 'P[expr1, expr2, ...]'."""
+    assert (
+        isinstance(node.value, ast.Name) and node.value.id == "P"
+    ), "only predicate in form of 'P[expr]' is supported"
+
+    n: ast.expr = PTagPredicationBuilder().visit(node.slice)
+
+    if isinstance(n, ast.Tuple):
+        return ast.BoolOp(
+            op=ast.And(),
+            values=list(n.elts),
+            lineno=node.lineno,
+            col_offset=node.col_offset,
+            end_lineno=node.end_lineno,
+            end_col_offset=node.end_col_offset,
+        )
+    return n
+
+
+def _compile_condition(condition: ast.expr):
+    expr_node = ast.Expression(condition)
+    ast.fix_missing_locations(expr_node)
+    return compile(expr_node, "<string>", "eval")
+
+
 class PTagPatternBuilder(ast.NodeTransformer):
     def visit(self, node):
         method = "visit_" + node.__class__.__name__
@@ -174,25 +359,7 @@ class PTagPatternBuilder(ast.NodeTransformer):
         return visitor(node)
 
     def visit_Subscript(self, node: ast.Subscript):
-        assert (
-            isinstance(node.value, ast.Name) and node.value.id == "P"
-        ), "only predicate in form of 'P[expr]' is supported"
-
-        n: ast.expr = PTagPredicationBuilder().visit(node.slice)
-
-        if isinstance(n, ast.Tuple):
-            condition: ast.expr = ast.BoolOp(
-                op=ast.And(),
-                values=list(n.elts),
-                lineno=node.lineno,
-                col_offset=node.col_offset,
-            )
-        else:
-            condition = n
-
-        expr_node = ast.Expression(condition)
-        ast.fix_missing_locations(expr_node)
-        c = compile(expr_node, "<string>", "eval")
+        c = _compile_condition(_predicate_condition(node))
 
         def predicate(o, scope):
             local_dict = {"_": o}
@@ -266,6 +433,258 @@ class PTagPatternBuilder(ast.NodeTransformer):
         return cps_deconstruct(func, args)
 
 
+def _lookup(scope: typing.Mapping, name: str):
+    """A name of a predicate, found as `eval` finds it in the closure matcher."""
+    try:
+        return scope[name]
+    except KeyError:
+        pass
+    try:
+        return builtins.__dict__[name]
+    except KeyError:
+        raise NameError(f"name {name!r} is not defined") from None
+
+
+def _bound(captures: dict[str, object]) -> dict[str, object]:
+    return {k: v for (k, v) in captures.items() if v is not _undef}
+
+
+class _PredicateRenamer(ast.NodeTransformer):
+    def __init__(self, names: typing.Callable[[str], str]):
+        self.names = names
+
+    def visit_Name(self, node: ast.Name):
+        return ast.parse(self.names(node.id), mode="eval").body
+
+
+class PTagPatternCompiler:
+    """
+    Generates the Python source of a function `match(o, scope)` for a pattern,
+    matching as the closures of `PTagPatternBuilder` do.
+
+    The pattern becomes a single expression, evaluated in the order of the
+    closures. The captures are kept in locals and written to the scope when
+    the function returns; predicates read them from the locals, or else from
+    the scope, where earlier attempts may have left them. The captures under
+    'not' get their own locals, as the closures capture into a copy of the scope.
+    """
+
+    def __init__(self):
+        self.counter = 0
+        # globals of the generated function
+        self.namespace: dict[str, object] = {
+            "_undef": _undef,
+            "Sequence": Sequence,
+            "Term": Term,
+            "_lookup": _lookup,
+            "_bound": _bound,
+            "_eval": eval,
+            "_builtins": builtins.__dict__,
+            "ChainMap": ChainMap,
+        }
+        # name -> local of its captures, for the top level and each enclosing 'not'
+        self.levels: list[dict[str, str]] = [{}]
+        self.locals: list[str] = []
+
+    def fresh(self, prefix: str) -> str:
+        self.counter += 1
+        return f"_{prefix}{self.counter}"
+
+    def const(self, v: object) -> str:
+        if v is None or type(v) in (bool, int, str, bytes):
+            return repr(v)
+        name = self.fresh("c")
+        self.namespace[name] = v
+        return name
+
+    def bind(self, subject: str) -> tuple[str, str]:
+        """A local for `subject`, and the condition assigning it, which always holds."""
+        if subject.isidentifier():
+            return subject, ""
+        name = self.fresh("o")
+        return name, f"({name} := {subject}) is {name} and "
+
+    def capture(self, name: str) -> str:
+        level = self.levels[-1]
+        local = level.get(name)
+        if local is None:
+            local = level[name] = self.fresh("v")
+            self.locals.append(local)
+        return local
+
+    def captured(self, name: str, otherwise: str) -> str:
+        """The latest capture of `name` in this call, or else `otherwise`."""
+        result = otherwise
+        for level in self.levels:
+            if name in level:
+                result = f"{level[name]} if {level[name]} is not _undef else {result}"
+        return f"({result})"
+
+    def generate(self, node: ast.expr) -> str:
+        body = self.visit(node, "o")
+        lines = ["def match(o, scope):"]
+        if self.locals:
+            lines.append("    {} = _undef".format(" = ".join(self.locals)))
+        if not self.levels[0]:
+            lines.append(f"    return {body}")
+            return "\n".join(lines)
+        lines.append("    try:")
+        lines.append(f"        return {body}")
+        lines.append("    finally:")
+        for (name, local) in self.levels[0].items():
+            lines.append(f"        if {local} is not _undef:")
+            lines.append(f"            scope[{name!r}] = {local}")
+        return "\n".join(lines)
+
+    def visit(self, node: ast.expr, subject: str) -> str:
+        method = "visit_" + node.__class__.__name__
+        visitor = getattr(self, method, None)
+        if not visitor:
+            raise TypeError(f"{node.__class__.__name__} is not supported")
+        return visitor(node, subject)
+
+    def visit_Name(self, node: ast.Name, subject: str) -> str:
+        if node.id == "_":
+            return "True"
+        return f"({subject} == {self.const(node.id)})"
+
+    def visit_Constant(self, node: ast.Constant, subject: str) -> str:
+        return f"({subject} == {self.const(node.value)})"
+
+    def visit_UnaryOp(self, node: ast.UnaryOp, subject: str) -> str:
+        v = node.operand
+        if isinstance(node.op, ast.Invert):
+            if not isinstance(v, ast.Name):
+                raise ValueError(f"~x: x needs to be a name but got {v}")
+            local = self.capture(v.id)
+            return f"(({local} := {subject}) is {local})"
+        if isinstance(node.op, ast.Not):
+            self.levels.append({})
+            try:
+                return f"(not {self.visit(v, subject)})"
+            finally:
+                self.levels.pop()
+        raise ValueError(f"UnaryOp: {node.op} is not supported")
+
+    def visit_BoolOp(self, node: ast.BoolOp, subject: str) -> str:
+        if isinstance(node.op, ast.Or):
+            op = " or "
+        elif isinstance(node.op, ast.And):
+            op = " and "
+        else:
+            raise ValueError(f"BoolOp: {node.op} is not supported")
+        o, bind = self.bind(subject)
+        return f"({bind}({op.join(self.visit(each, o) for each in node.values)}))"
+
+    def visit_List(self, node: ast.List, subject: str) -> str:
+        o, bind = self.bind(subject)
+        idx_pack = -1
+        for i, e in enumerate(node.elts):
+            if isinstance(e, ast.Starred):
+                idx_pack = i
+        conditions = [f"isinstance({o}, Sequence)"]
+        if idx_pack == -1:
+            conditions.append(f"len({o}) == {len(node.elts)}")
+            for i, e in enumerate(node.elts):
+                conditions.append(self.visit(e, f"{o}[{i}]"))
+        else:
+            init = node.elts[:idx_pack]
+            star = node.elts[idx_pack]
+            assert isinstance(star, ast.Starred)
+            tail = node.elts[idx_pack + 1 :]
+            conditions.append(f"len({o}) >= {len(init) + len(tail)}")
+            for i, e in enumerate(init):
+                conditions.append(self.visit(e, f"{o}[{i}]"))
+            for i, e in enumerate(tail):
+                conditions.append(self.visit(e, f"{o}[{i} + len({o}) - {len(tail)}]"))
+            conditions.append(
+                self.visit(star.value, f"{o}[{len(init)} : len({o}) - {len(tail)}]")
+            )
+        return f"({bind}{' and '.join(conditions)})"
+
+    def visit_Dict(self, node: ast.Dict, subject: str) -> str:
+        o, bind = self.bind(subject)
+        conditions = [f"isinstance({o}, dict)"]
+        for (k, v) in zip(node.keys, node.values):
+            if k is None:
+                raise SyntaxError("Dict packing is not supported yet")
+            if isinstance(k, ast.Name):
+                k_value: object = k.id
+            elif not isinstance(k, ast.Constant):
+                raise SyntaxError("Dict keys must be constant")
+            else:
+                k_value = k.value
+            # looked up even for '_', as a missing key raises `KeyError`
+            value, bind_value = self.bind(f"{o}[{self.const(k_value)}]")
+            conditions.append(f"({bind_value}{self.visit(v, value)})")
+        return f"({bind}{' and '.join(conditions)})"
+
+    def visit_Call(self, node: ast.Call, subject: str) -> str:
+        if node.keywords:
+            raise SyntaxError("Keyword arguments are not supported")
+        o, bind = self.bind(subject)
+        func = self.fresh("f")
+        args = self.fresh("a")
+        conditions = [
+            f"(isinstance({o}, Term) and ({func} := {o}.func) is {func} and ({args} := {o}.args) is {args}"
+            f" or isinstance({o}, dict)"
+            f" and ({func} := {o}.get('__func__', _undef)) is not _undef"
+            f" and ({args} := {o}.get('__args__', _undef)) is not _undef"
+            f" and isinstance({args}, list))",
+            f"len({args}) == {len(node.args)}",
+            self.visit(node.func, func),
+        ]
+        for i, e in enumerate(node.args):
+            conditions.append(self.visit(e, f"{args}[{i}]"))
+        return f"({bind}{' and '.join(conditions)})"
+
+    def visit_Subscript(self, node: ast.Subscript, subject: str) -> str:
+        condition = _predicate_condition(node)
+        o, bind = self.bind(subject)
+        names = sorted({k for level in self.levels for k in level})
+        if any(isinstance(n, _NESTED_SCOPES) for n in ast.walk(condition)):
+            # names in nested scopes are not looked up in the scope by `eval`
+            predicate = self.fresh("p")
+            self.namespace[predicate] = _compile_condition(condition)
+            captures = ", ".join(f"{k!r}: {self.captured(k, '_undef')}" for k in names)
+            return (
+                f"({bind}_eval({predicate}, _builtins, "
+                f"ChainMap({{'_': {o}}}, _bound({{{captures}}}), scope)))"
+            )
+
+        def rename(name: str) -> str:
+            if name == "_":
+                return o
+            return self.captured(name, f"_lookup(scope, {name!r})")
+
+        condition = _PredicateRenamer(rename).visit(condition)
+        return f"({bind}({ast.unparse(condition)}))"
+
+
+_NESTED_SCOPES = (
+    ast.Lambda,
+    ast.ListComp,
+    ast.SetComp,
+    ast.DictComp,
+    ast.GeneratorExp,
+    ast.NamedExpr,
+)
+
+
+def compile_pattern(node: ast.expr) -> P:
+    """A pattern as a single generated function, with the requirement and purity of its closures."""
+    closure = PTagPatternBuilder().visit(node)
+    compiler = PTagPatternCompiler()
+    source = compiler.generate(node)
+    namespace = compiler.namespace
+    exec(compile(source, "<ptag-pattern>", "exec"), namespace)
+    match = namespace["match"]
+    match.requirement = closure.requirement
+    match.pure = closure.pure
+    match.source = source
+    return match
+
+
 class PTagPatternConjunction(ast.NodeVisitor):
     def __init__(self):
         self.result = []
@@ -278,7 +697,7 @@ class PTagPatternConjunction(ast.NodeVisitor):
         return visitor(node)
 
     def visit_Expr(self, node: ast.Expr):
-        value = PTagPatternBuilder().visit(node.value)
+        value = compile_pattern(node.value)
         self.result.append(value)
         return node
 
@@ -298,23 +717,22 @@ def parse_expr(code: str):
 
 
 class PTagExprBuilder(ast.NodeTransformer):
+    """
+    Builds the tag of an expression, where 'f(a, b)' makes a `Term`, found
+    as `names.VARNAME_ptag_term` in the scope of the evaluation.
+    """
+
     def visit_Name(self, node: ast.Name):
-        return ast.Constant(node.id, lineno=node.lineno, col_offset=node.col_offset)
+        return ast.copy_location(ast.Constant(node.id), node)
 
     def visit_Call(self, node: ast.Call):
         if node.keywords:
             raise SyntaxError("Keyword arguments are not supported")
         func = self.visit(node.func)
         args = list(map(self.visit, node.args))
-        return ast.Dict(
-            [ast.Constant("__func__"), ast.Constant("__args__")],
-            [
-                func,
-                ast.List(
-                    args, ast.Load(), line=node.lineno, col_offset=node.col_offset
-                ),
-            ],
-        )
+        term = ast.copy_location(ast.Name(names.VARNAME_ptag_term, ast.Load()), node)
+        args_tuple = ast.copy_location(ast.Tuple(args, ast.Load()), node)
+        return ast.copy_location(ast.Call(term, [func, args_tuple], []), node)
 
 
 class PTagExprDisjunctionBuilder(ast.NodeTransformer):
@@ -344,16 +762,157 @@ def string_expr_builder(code: str):
     return bc
 
 
+# source -> compiled patterns, shared by the documents
+_compiled_patterns: dict[str, P] = {}
+_compiled_conjunctions: dict[str, list[P]] = {}
+
+
 def string_to_pattern(code: str) -> P:
-    return PTagPatternBuilder().visit(parse_expr(code.strip()))
+    code = code.strip()
+    pattern = _compiled_patterns.get(code)
+    if pattern is None:
+        pattern = _compiled_patterns[code] = compile_pattern(parse_expr(code))
+    return pattern
 
 
 def string_pattern_builder(code: str) -> list[P]:
     if code.startswith(" "):
         code = textwrap.dedent(code)
-    builder = PTagPatternConjunction()
-    builder.visit(ast.parse(code))
-    return builder.result
+    patterns = _compiled_conjunctions.get(code)
+    if patterns is None:
+        builder = PTagPatternConjunction()
+        builder.visit(ast.parse(code))
+        patterns = _compiled_conjunctions[code] = builder.result
+    return list(patterns)
+
+
+def tag_keys(tag: object) -> list[object]:
+    """The keys under which `tag` is indexed, see `Requirement`."""
+    if isinstance(tag, Term):
+        return _functor_keys(tag.func, tag.args)
+    if isinstance(tag, dict):
+        func = tag.get("__func__", _undef)
+        args = tag.get("__args__", _undef)
+        if func is _undef or not isinstance(args, list):
+            return []
+        return _functor_keys(func, args)
+    try:
+        hash(tag)
+    except TypeError:
+        return []
+    return [("lit", tag)]
+
+
+def _functor_keys(func: object, args: Sequence[object]) -> list[object]:
+    keys: list[object] = [("arity", len(args))]
+    try:
+        hash(func)
+    except TypeError:
+        return keys
+    keys.append(("func", func, len(args)))
+    for i, arg in enumerate(args):
+        # only literal patterns have "arg" keys
+        if isinstance(arg, (dict, list, Term)):
+            continue
+        try:
+            hash(arg)
+        except TypeError:
+            continue
+        keys.append(("arg", func, len(args), i, arg))
+    return keys
+
+
+def _anchors(requirement: Requirement) -> set[object] | None:
+    """
+    Keys one of which every tag meeting `requirement` is found under, or
+    None if there are none, e.g., for the requirement of '_'.
+    """
+    if requirement is None:
+        return None
+    if requirement[0] == "key":
+        return {requirement[1]}
+    left = _anchors(requirement[1])
+    right = _anchors(requirement[2])
+    if requirement[0] == "and":
+        if left is None or right is None:
+            return right if left is None else left
+        return min(left, right, key=_anchor_cost)
+    if left is None or right is None:
+        return None
+    return left | right
+
+
+def _admits(requirement: Requirement, keys: set[object]) -> bool:
+    """
+    Whether a document having the tag keys `keys` is in the intersection, for
+    'and', or union, for 'or', of the documents found under the keys of
+    `requirement`, as no other document has a tag meeting it.
+    """
+    if requirement is None:
+        return True
+    if requirement[0] == "key":
+        return requirement[1] in keys
+    if requirement[0] == "and":
+        return _admits(requirement[1], keys) and _admits(requirement[2], keys)
+    return _admits(requirement[1], keys) or _admits(requirement[2], keys)
+
+
+def _has_and(requirement: Requirement) -> bool:
+    if requirement is None or requirement[0] == "key":
+        return False
+    return requirement[0] == "and" or _has_and(requirement[1]) or _has_and(requirement[2])
+
+
+# how many tags a key usually selects, from the fewest
+_key_kinds = ("lit", "arg", "func", "arity")
+
+
+def _anchor_cost(anchors: set[object]):
+    return (max(_key_kinds.index(key[0]) for key in anchors), len(anchors))  # type: ignore
+
+
+def match_batch(
+    queries: Sequence[tuple[P, typing.MutableMapping]], docs: typing.Iterable[typing.Any]
+) -> list[list[typing.Any]]:
+    """
+    The documents, in order, having a tag matched by each of `queries`, given
+    as a pattern and the scope of its matches, in one pass over the documents.
+
+    The keys of the tags of a document are computed once, and only select the
+    queries anchored under them, so that the work grows with the documents and
+    the matches rather than with the documents times the queries. A query
+    whose requirement has an 'and', e.g., 'post("rust")', is then tried only
+    if the document is in the intersection of the documents found under both
+    sides, see `_admits`. Queries with predicates are tried on every document,
+    as a predicate may see what earlier attempts captured in the scope.
+    """
+    results: list[list[typing.Any]] = [[] for _ in queries]
+    everywhere: list[int] = []
+    anchored: dict[object, list[int]] = {}
+    intersected: dict[int, Requirement] = {}
+    for i, (p, _) in enumerate(queries):
+        requirement = getattr(p, "requirement", None)
+        anchors = _anchors(requirement) if getattr(p, "pure", False) else None
+        if anchors is None:
+            everywhere.append(i)
+            continue
+        for key in anchors:
+            anchored.setdefault(key, []).append(i)
+        if _has_and(requirement):
+            intersected[i] = requirement
+
+    for doc in docs:
+        tried = set(everywhere)
+        keys = {key for tag in doc.tags for key in tag_keys(tag)}
+        for key in keys:
+            tried.update(anchored.get(key, ()))
+        for i in tried:
+            if i in intersected and not _admits(intersected[i], keys):
+                continue
+            p, scope = queries[i]
+            if match_any_tag(p, doc.tags, scope):
+                results[i].append(doc)
+    return results
 
 
 def match_tag(p: P, o: object, group: dict | None = None) -> bool:
@@ -372,6 +931,7 @@ def match_any_tag(p: P, obs: list[object], group: dict | None = None) -> bool:
 
 
 if __name__ == "__main__":
+    globals()[names.VARNAME_ptag_term] = Term
     x = parse_expr("[1, 2, a(c, 2)]")
     x = PTagExprBuilder().visit(x)
     ast.fix_missing_locations(x)
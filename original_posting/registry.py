@@ -0,0 +1,166 @@
+"""
+Maps command names to the scripts implementing them.
+
+The directories of `Runtime.search_path` are listed once with `os.scandir`
+and only listed again when their mtime changes, so looking up a command,
+found or not, is a dict hit. Besides `<name>.py` files, a search directory
+may hold a manifest `op-commands.json` mapping command names to script
+paths relative to it, e.g., `{"toc": "lib/toc_v2.py"}`, which take
+precedence over the files of the same directory. Commands shipped by
+installed packages are registered as entry points of the group
+`original_posting.commands`, e.g., `toc = "my_package.toc"`, and are only
+used when no search directory provides the command.
+"""
+from __future__ import annotations
+from original_posting.types import Runtime
+from pathlib import Path
+import json
+import os
+import typing
+import warnings
+
+if typing.TYPE_CHECKING:
+    import importlib.metadata
+
+MANIFEST_NAME = "op-commands.json"
+ENTRY_POINT_GROUP = "original_posting.commands"
+
+
+class CommandScript(typing.NamedTuple):
+    path: str  # the script file, or the value of the entry point
+    mtime_ns: int  # 0 for entry points
+    entry_point: importlib.metadata.EntryPoint | None = None
+
+
+class _Directory(typing.NamedTuple):
+    mtime_ns: int
+    files: dict[str, CommandScript]  # file name -> script
+    commands: dict[str, CommandScript]  # command name -> script
+
+
+def _scan(directory: str, mtime_ns: int) -> _Directory:
+    files: dict[str, CommandScript] = {}
+    commands: dict[str, CommandScript] = {}
+    with os.scandir(directory) as it:
+        for entry in it:
+            try:
+                mtime_ns = entry.stat().st_mtime_ns
+            except OSError:
+                # e.g., a dangling symbolic link, which is not found as before
+                continue
+            script = CommandScript(os.path.abspath(entry.path), mtime_ns)
+            files[entry.name] = script
+            if entry.name.endswith(".py"):
+                commands[entry.name[: -len(".py")]] = script
+
+    manifest = files.get(MANIFEST_NAME)
+    if manifest:
+        commands.update(_read_manifest(directory, manifest.path))
+    return _Directory(mtime_ns, files, commands)
+
+
+def _read_manifest(directory: str, manifest_path: str) -> dict[str, CommandScript]:
+    """The commands of a manifest; a manifest or an entry which cannot be read is skipped."""
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            mapping = json.load(f)
+        if not isinstance(mapping, dict):
+            raise ValueError(f"expected an object, got {type(mapping).__name__}")
+    except (OSError, ValueError) as e:
+        warnings.warn(f"{manifest_path} is skipped: {e}")
+        return {}
+    commands: dict[str, CommandScript] = {}
+    for cmd_name, relpath in mapping.items():
+        try:
+            path = os.path.abspath(os.path.join(directory, relpath))
+            commands[cmd_name] = CommandScript(path, os.stat(path).st_mtime_ns)
+        except (OSError, TypeError, ValueError) as e:
+            warnings.warn(f"the command {cmd_name!r} of {manifest_path} is skipped: {e}")
+    return commands
+
+
+def _load_entry_points() -> dict[str, CommandScript]:
+    import importlib.metadata
+
+    eps = importlib.metadata.entry_points()
+    if hasattr(eps, "select"):
+        group = eps.select(group=ENTRY_POINT_GROUP)
+    else:  # Python < 3.10
+        group = eps.get(ENTRY_POINT_GROUP, ())  # type: ignore
+    return {ep.name: CommandScript(ep.value, 0, ep) for ep in group}
+
+
+class CommandRegistry:
+    def __init__(self):
+        self._search_path: tuple[str, ...] | None = None
+        self._dirs: list[tuple[str, _Directory]] = []
+        self._entry_points: dict[str, CommandScript] | None = None
+        # name -> script, or None if no search directory provides it
+        self._commands: dict[str, CommandScript | None] = {}
+        self._files: dict[str, CommandScript | None] = {}
+
+    def refresh(self, rescan: bool = False):
+        """
+        List again the search directories that changed since the last call,
+        or all of them if `rescan` is set, e.g., when a script was edited in place.
+        """
+        search_path = tuple(Runtime.search_path)
+        old_dirs = dict(self._dirs) if search_path == self._search_path and not rescan else {}
+        changed = search_path != self._search_path or rescan
+        dirs: list[tuple[str, _Directory]] = []
+        for each in search_path:
+            directory = str(Path(each).expanduser())
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except OSError:
+                changed = changed or directory in old_dirs
+                continue
+            old = old_dirs.get(directory)
+            if old is None or old.mtime_ns != mtime_ns:
+                old = _scan(directory, mtime_ns)
+                changed = True
+            dirs.append((directory, old))
+        self._search_path = search_path
+        self._dirs = dirs
+        if changed:
+            self._commands.clear()
+            self._files.clear()
+
+    def _sync(self):
+        if self._search_path is None or self._search_path != tuple(Runtime.search_path):
+            self.refresh()
+
+    def find_command(self, cmd_name: str) -> CommandScript | None:
+        self._sync()
+        try:
+            return self._commands[cmd_name]
+        except KeyError:
+            pass
+        for _, directory in self._dirs:
+            script = directory.commands.get(cmd_name)
+            if script:
+                break
+        else:
+            if self._entry_points is None:
+                self._entry_points = _load_entry_points()
+            script = self._entry_points.get(cmd_name)
+        self._commands[cmd_name] = script
+        return script
+
+    def find_file(self, filename: str) -> CommandScript | None:
+        self._sync()
+        try:
+            return self._files[filename]
+        except KeyError:
+            pass
+        for _, directory in self._dirs:
+            script = directory.files.get(filename)
+            if script:
+                break
+        else:
+            script = None
+        self._files[filename] = script
+        return script
+
+
+commands = CommandRegistry()
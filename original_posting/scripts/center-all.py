@@ -1,5 +1,6 @@
 from __future__ import annotations
 from original_posting.types import CommandEntry, Context, OPDocument
+from original_posting.dom import get_dom, uses_dom
 from original_posting.parsing import process_nest
 import bs4
 import wisepy2
@@ -15,19 +16,19 @@ body {{
 def parse_args(*, width: int = 1200):
     return width
 
+@uses_dom
 class AddStyleSheet:
     def __init__(self, width: int):
         self.width = width
     def __call__(self, op: OPDocument):
-        html = bs4.BeautifulSoup(op.code, "html.parser")
+        html = get_dom(op)
         style = html.new_tag("style")
-        style.contents.append(bs4.Stylesheet(style_sheet.format(self.width)))
+        style.append(bs4.Stylesheet(style_sheet.format(self.width)))
         head = html.find("head")
         if isinstance(head, bs4.Tag):
-            head.contents.append(style)
+            head.append(style)
         else:
-            html.contents.insert(0, style)
-        op.code = str(html)
+            html.insert(0, style)
 class ContainerHtml(CommandEntry):
     _inc = 0
     def __init__(self, ctx: Context):
@@ -1,29 +1,118 @@
+"""
+'code' highlights code with pygments.
+
+The lexers, the formatter and the style sheet are made once per process.
+The highlighted HTML is also kept in `<cache dir>/highlight`, by the digest
+of the language, the style, the form and the code, when the build has a
+cache directory, e.g., with `--incremental`.
+"""
 from __future__ import annotations
-from pygments import highlight
-from pygments.formatters import HtmlFormatter
-from pygments.lexers import get_lexer_by_name
 from original_posting.utils import load_from_source
 from original_posting.types import CommandEntry, Context, OPDocument
+from original_posting.dom import get_dom, uses_dom
 from original_posting.parsing import process_nest
 from wisepy2 import wise
+import original_posting.builtin_names as names
+import functools
+import hashlib
+import os
 import pathlib
+import re
 import typing
 import textwrap
-import bs4
 
+# bump when the HTML highlighted from the same code changes, besides with pygments
+HIGHLIGHT_FORMAT = 1
+STYLE_NAME = "quiet_light"
 
+_pre_pattern = re.compile(r"<pre[^>]*>(.*)</pre>", re.DOTALL)
+
+# pygments and the style module are imported on the first highlighting
 if typing.TYPE_CHECKING:
     from .pygments_styles import quiet_light as mod
 else:
-    mod = load_from_source(
-        str(pathlib.Path(__file__).parent / "pygments_styles" / "quiet_light.py")
-    )
+    mod = None
+
+
+def _style_module():
+    global mod
+    if mod is None:
+        mod = load_from_source(
+            str(pathlib.Path(__file__).parent / "pygments_styles" / "quiet_light.py")
+        )
+    return mod
+
+
+@functools.lru_cache(maxsize=None)
+def _formatter():
+    from pygments.formatters import HtmlFormatter
+
+    return HtmlFormatter(style=getattr(_style_module(), STYLE_NAME))
+
+
+@functools.lru_cache(maxsize=None)
+def _style_defs() -> str:
+    return _formatter().get_style_defs()
+
+
+@functools.lru_cache(maxsize=None)
+def _lexer(lang: str):
+    from pygments.lexers import get_lexer_by_name
+
+    return get_lexer_by_name(lang)
+
+
+def _highlight(lang: str, code: str, inline: bool) -> str:
+    from pygments import highlight
+
+    highlighted_code = highlight(code, _lexer(lang), _formatter())
+    if not inline:
+        return highlighted_code
+    # the content of <pre> in a <code>, escaped as bs4 escapes text
+    m = _pre_pattern.search(highlighted_code)
+    assert m
+    inner = m.group(1).replace("&quot;", '"').replace("&#39;", "'")
+    return f"<code>{inner}</code>"
+
+
+class HighlightCache:
+    """Highlighted HTML on disk, by the digest of what it is highlighted from."""
+
+    def __init__(self, cache_dir: pathlib.Path):
+        self.directory = cache_dir / "highlight"
+
+    def _path(self, lang: str, code: str, inline: bool) -> pathlib.Path:
+        import pygments
+
+        key = "\0".join(
+            [str(HIGHLIGHT_FORMAT), pygments.__version__, STYLE_NAME, lang, str(inline), code]
+        )
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return self.directory / name[:2] / f"{name}.html"
+
+    def highlight(self, lang: str, code: str, inline: bool) -> str:
+        path = self._path(lang, code, inline)
+        try:
+            return path.read_text(encoding="utf-8")
+        except OSError:
+            pass
+        highlighted_code = _highlight(lang, code, inline)
+        try:
+            path.parent.mkdir(0o777, parents=True, exist_ok=True)
+            # renamed into place, as the workers of `--jobs` may write it at once
+            temp = path.with_suffix(f".{os.getpid()}.tmp")
+            temp.write_text(highlighted_code, encoding="utf-8")
+            os.replace(temp, path)
+        except OSError:
+            pass
+        return highlighted_code
 
 
 def parse_args(lang: str = "", nodedent: bool = False) -> typing.Tuple[str, bool]:
     return lang, nodedent
 
 
+@uses_dom
 class InsertStyle:
     def __init__(self, lazy_style_sheet: typing.Callable[[], str]):
         self.lazy_style_sheet = lazy_style_sheet
@@ -31,20 +120,23 @@ class InsertStyle:
     def __call__(self, doc: OPDocument):
         style_inserted = doc.data.setdefault(InsertStyle, False)
         if not style_inserted:
-            html = bs4.BeautifulSoup(doc.code, "html.parser")
+            html = get_dom(doc)
             style_node = html.find("style")
             if not style_node:
                 style_node = html.new_tag("style")
                 html.insert(0, style_node)
             style_node.append(self.lazy_style_sheet())
             doc.data[InsertStyle] = True
-            doc.code = str(html)
 
 
 class CachedLanguageKey:
     pass
 
 
+class StyleCallbackKey:
+    pass
+
+
 class CodeHighlightEntry(CommandEntry):
     def __init__(self, ctx: Context):
         self.ctx = ctx
@@ -77,19 +169,14 @@ class CodeHighlightEntry(CommandEntry):
                 "--lang is not set. You might need to call '@begin code language' firstly."
             )
 
-        formatter = HtmlFormatter(style=mod.quiet_light)
-        self.ctx.target_doc.callbacks.append(InsertStyle(formatter.get_style_defs))
+        if StyleCallbackKey not in local_data:
+            local_data[StyleCallbackKey] = True
+            self.ctx.target_doc.callbacks.append(InsertStyle(_style_defs))
 
         code = process_nest(self.ctx, start, end)
-        lexer = get_lexer_by_name(lang)
-        if inline:
-            hightlighted_code = highlight(code, lexer, formatter)
-            html = bs4.BeautifulSoup(hightlighted_code, "html.parser")
-            pre = html.find("pre")
-            assert isinstance(pre, bs4.Tag)
-            code_tag = html.new_tag("code")
-            code_tag.contents.extend(pre.contents)
-            return str(code_tag)
-        code = textwrap.dedent(code)
-        hightlighted_code = highlight(code, lexer, formatter)
-        return hightlighted_code
+        if not inline:
+            code = textwrap.dedent(code)
+        cache_dir = self.ctx.storage.get(names.NAME_CacheDir)
+        if cache_dir is None:
+            return _highlight(lang, code, inline)
+        return HighlightCache(pathlib.Path(cache_dir)).highlight(lang, code, inline)
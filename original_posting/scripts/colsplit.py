@@ -2,9 +2,6 @@ from __future__ import annotations
 from concurrent.futures import process
 from original_posting.types import CommandEntry, Context
 from original_posting.parsing import process_nest
-import bs4
-
-_html_factory = bs4.BeautifulSoup("", "html.parser")
 
 class ColSplit(CommandEntry):
     _inc = 0
@@ -2,15 +2,15 @@ from __future__ import annotations
 from original_posting.types import Runtime, CommandEntry, Context, OPDocument
 from original_posting.parsing import process_nest
 from json import dumps
+from original_posting.dom import html_factory, parse_fragment
 from xml.sax.saxutils import escape
-import bs4
 
 
 
 FootNoteId = str
 FootNoteContent = str
 
-_html_factory = bs4.BeautifulSoup("", "html.parser")
+_quote = {'"': "&quot;"}
 
 class FootNoteCmd(CommandEntry):
     _inc = 0
@@ -21,23 +21,14 @@ class FootNoteCmd(CommandEntry):
     def callback(op_doc: OPDocument):
         inserted_footnodes: list[tuple[FootNoteId, FootNoteContent]]
         inserted_footnodes =  op_doc.data.setdefault(FootNoteCmd, [])
-        # TODO: html ast
-        hr = _html_factory.new_tag("hr")
-        h2 = _html_factory.new_tag("h2")
-        h2.append("脚注")
-        ol = _html_factory.new_tag("ol")
-        for (title, content) in inserted_footnodes:
-            li = _html_factory.new_tag("li")
-            li.append(escape(title))
-            li.append(":")
-            li.attrs["id"] = title
-            p = _html_factory.new_tag("p")
-            li.contents.append(p)
-            p = _html_factory.new_tag("p")
-            p.contents.extend(bs4.BeautifulSoup("<div>"+content+"</div>", "html.parser").contents[0].contents) # type: ignore
-            li.contents.append(p)
-            ol.contents.append(li)
-        op_doc.code += '\n' + str(hr) + "\n" + str(h2) + "\n" + str(ol)
+        items = [
+            # the title is escaped twice, as it always was
+            f'<li id="{escape(title, _quote)}">{escape(escape(title))}:<p></p><p>{content}</p></li>'
+            for (title, content) in inserted_footnodes
+        ]
+        # the contents of all the footnotes are normalized in a single parse
+        ol = parse_fragment("<ol>" + "".join(items) + "</ol>").decode_contents()
+        op_doc.code += '\n<hr/>\n<h2>脚注</h2>\n' + ol
 
 
     def proc(self, argv: list[str], start: int, end: int):
@@ -53,10 +44,10 @@ class FootNoteCmd(CommandEntry):
         inserted_footnodes.append((title, content))
         if self.callback not in self.ctx.target_doc.callbacks:
             self.ctx.target_doc.callbacks.append(self.callback)
-        a = _html_factory.new_tag("a", href="#" + title)
-        sup = _html_factory.new_tag("sup")
-        small2 = _html_factory.new_tag("small")
-        small = _html_factory.new_tag("small")
+        a = html_factory().new_tag("a", href="#" + title)
+        sup = html_factory().new_tag("sup")
+        small2 = html_factory().new_tag("small")
+        small = html_factory().new_tag("small")
         small2.contents.append(small)
         small.append(escape(title))
         sup.contents.append(small2)
@@ -1,18 +1,19 @@
 from __future__ import annotations
 from original_posting.types import CommandEntry, Context, OPDocument
 from original_posting.parsing import process_nest
-import bs4
+from original_posting.dom import html_factory
+import original_posting.builtin_names as names
+import typing
 import wisepy2
-import yaml
 import io
 import shutil
 
+if typing.TYPE_CHECKING:
+    import bs4
+
 def parse_args(id: str):
     return id
 
-_html_factory = bs4.BeautifulSoup("", "html.parser")
-
-
 def AddImage(op: OPDocument):
     images: set[str] = op.data.setdefault((ImageAdderEntry, "path"), set())
     for image_path in images:
@@ -30,6 +31,8 @@ class ImageAdderEntry(CommandEntry):
         self.ctx = ctx
 
     def proc(self, argv: list[str], start: int, end: int):
+        import yaml
+
         identity = wisepy2.wise(parse_args)(argv)
         source = process_nest(self.ctx, start, end)
         configs = yaml.load(io.StringIO(source), yaml.loader.SafeLoader)
@@ -37,14 +40,17 @@ class ImageAdderEntry(CommandEntry):
             imagepath = str(configs["src"])
             image_paths: set[str] = self.ctx.target_doc.data.setdefault((ImageAdderEntry, "path"), set())
             image_paths.add(imagepath)
+            depend = self.ctx.storage.get(names.NAME_DependencyImpl)
+            if depend:
+                depend(self.ctx.target_doc.source_path_absolute.parent.joinpath(imagepath))
             width = configs.get("width", "1200px")
             img_float = configs.get("float", "")
             images: dict[str, bs4.Tag] = self.ctx.target_doc.data.setdefault(ImageAdderEntry, {})
-            tag_image = _html_factory.new_tag("image")
+            tag_image = html_factory().new_tag("image")
             tag_image.attrs["width"] = width
             tag_image.attrs["src"] = imagepath
             if img_float:
-                tag_div = _html_factory.new_tag("div")
+                tag_div = html_factory().new_tag("div")
                 tag_div.attrs["style"] = "width: {}; float: {}; display: inline-block;".format(width, img_float)
                 tag_div.contents.append(tag_image)
                 images[identity] = tag_div
@@ -10,6 +10,9 @@ class IncludeDirEntry(CommandEntry):
 
     def inline_proc(self, _start: int, _stop: int) -> str:
         directory = Path(process_nest(self.ctx, _start, _stop).strip())
+        depend = self.ctx.storage.get(names.NAME_DependencyImpl)
+        if depend:
+            depend(directory)
         for each in directory.iterdir():
             if each.is_file() and each.suffix == '.op':
                 include = self.ctx.storage[names.NAME_IncludeImpl]
@@ -22,6 +25,9 @@ class IncludeDirEntry(CommandEntry):
             if not each_dir:
                 continue
             directory = Path(each_dir)
+            depend = self.ctx.storage.get(names.NAME_DependencyImpl)
+            if depend:
+                depend(directory)
             for file in directory.iterdir():
                 if file.is_file() and file.suffix == '.op':
                     include = self.ctx.storage[names.NAME_IncludeImpl]
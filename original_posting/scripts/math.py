@@ -1,6 +1,5 @@
 from original_posting.types import CommandEntry, Context, OPDocument
 from original_posting.parsing import process_nest
-import latex2mathml.converter
 
 class Mathjax(CommandEntry):
     def __init__(self, ctx: Context):
@@ -20,5 +19,7 @@ class Mathjax(CommandEntry):
         """
 
     def proc(self, args: list[str], _start: int, _stop: int) -> str:
+        import latex2mathml.converter
+
         code = process_nest(self.ctx, _start, _stop)
         return latex2mathml.converter.convert(code)
@@ -1,7 +1,7 @@
 from __future__ import annotations
 from original_posting.types import CommandEntry, Context
 from original_posting.parsing import process_nest
-from original_posting.ptag_dsl import string_to_expr_code
+from original_posting.ptag_dsl import Term, string_to_expr_code
 import original_posting.builtin_names as names
 
 
@@ -13,6 +13,7 @@ class PTagExprEntry(CommandEntry):
         source = process_nest(self.ctx, _start, _stop)
         scope: dict = self.ctx.storage.setdefault(names.NAME_PythonScope, {})
         PTAG_EXPRS = scope.setdefault(names.VARNAME_ptag_exprs, {})
+        scope[names.VARNAME_ptag_term] = Term
         ptag_expr = eval(string_to_expr_code(source), scope)
         key = len(PTAG_EXPRS)
         PTAG_EXPRS[key] = ptag_expr
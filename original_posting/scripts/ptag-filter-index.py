@@ -1,57 +1,215 @@
+"""
+'ptag-filter-index' lists the documents having a tag matched by the given patterns.
+e.g.,
+    @begin ptag-filter-index --page_size 20 --sort title --json
+    post(_)
+    @end ptag-filter-index
+
+Options of the block form:
+- `--page_size N`: list N documents in the page, and the next ones in
+  `<output stem>.<list id>/index-2.html`, `index-3.html`, ..., with links
+  between the pages.
+- `--sort title|path`: sort the documents by the text displayed, or by
+  their paths, instead of listing them in the order they were built.
+  `--reverse` sorts them in descending order.
+- `--json`: also write the pages as `index-1.json`, `index-2.json`, ... in
+  the same directory, for scripts loading the pages lazily; the list gets
+  the attributes `data-pages` and `data-shards`, the URL of the directory.
+
+A new document only changes the pages from the one it is listed in; the
+pages left unchanged are not written again.
+"""
 from __future__ import annotations
+import html as html_escape
+import json
 import os
 import pathlib
+import typing
 from typing import ChainMap
 from original_posting.parsing import process_nest
 from original_posting.ptag_dsl import (
     P,
     string_pattern_builder,
     cps_and,
-    match_any_tag,
+    match_batch,
     string_to_pattern,
 )
 from original_posting.types import OPDocument, CommandEntry, Context
-from original_posting.utils import get_relative_path, global_gensym
+from original_posting.dom import get_dom, parse_fragment, uses_dom
+from original_posting.utils import get_relative_path, doc_gensym
 import original_posting.builtin_names as names
 import functools
-import bs4
+import wisepy2
+
+
+class Arguments(typing.NamedTuple):
+    page_size: int
+    sort: str
+    reverse: bool
+    json: bool
+
+
+def parse_args(*, page_size: int = 0, sort: str = "", reverse: bool = False, json: bool = False):
+    if page_size < 0:
+        raise ValueError(f"--page_size must be positive, got {page_size}.")
+    if sort not in ("", "title", "path"):
+        raise ValueError(f"--sort must be 'title' or 'path', got {sort!r}.")
+    return Arguments(page_size=page_size, sort=sort, reverse=reverse, json=json)
+
+
+_default_arguments = parse_args()
 
 
 def default_format(doc: OPDocument):
     return doc.title or doc.output_path_absolute.name
 
 
+class FilterQueries:
+    """
+    The queries of all the filters of a build, evaluated together with
+    `match_batch` by the first filter running, once all the documents are
+    rendered; the other filters take their results.
+    """
+
+    def __init__(self):
+        self.queries: list[FilterIndex] = []
+        self.results: dict[int, list[OPDocument]] = {}
+        self.evaluated_on: tuple[int, int] | None = None
+
+    def matches(self, query: FilterIndex, project_docs: dict[str, OPDocument]) -> list[OPDocument]:
+        evaluated_on = (id(project_docs), len(project_docs))
+        if id(query) not in self.results or self.evaluated_on != evaluated_on:
+            batch = [(each.P, ChainMap({}, each.scope)) for each in self.queries]
+            results = match_batch(batch, project_docs.values())
+            self.results = {id(each): result for (each, result) in zip(self.queries, results)}
+            self.evaluated_on = evaluated_on
+        return self.results[id(query)]
+
+
+def filter_queries(ctx: Context) -> FilterQueries:
+    return ctx.storage.setdefault(names.NAME_FilterQueries, FilterQueries())
+
+
+class Entry(typing.NamedTuple):
+    title: str
+    href: str  # relative to the directory of the page listing the documents
+    path: str  # relative to the project
+
+
+def _page_name(n: int, suffix: str) -> str:
+    return f"index-{n}{suffix}"
+
+
+def _nav_html(pages: list[str], n: int) -> str:
+    """
+    Links to the first, previous, next and last of `pages`, from the page
+    `n` (starting from 1), so that it stays short however many pages there are.
+    """
+    links = []
+    for text, target in (("first", 1), ("prev", n - 1), ("next", n + 1), ("last", len(pages))):
+        if target == n or not 1 <= target <= len(pages):
+            links.append(f"<span>{text}</span>")
+        else:
+            links.append(f'<a href="{html_escape.escape(pages[target - 1])}">{text}</a>')
+    links.insert(2, f"<span>{n} / {len(pages)}</span>")
+    return '<nav class="filtered-index-pages">' + " ".join(links) + "</nav>"
+
+
+def _items_html(entries: typing.Iterable[Entry], prefix: str) -> str:
+    return "".join(
+        '<li><a href="{}">{}</a></li>'.format(
+            html_escape.escape(prefix + each.href), html_escape.escape(each.title, quote=False)
+        )
+        for each in entries
+    )
+
+
+@uses_dom
 class FilterIndex:
-    def __init__(self, ctx: Context, scope: dict, pattern: P, html_id: str):
+    def __init__(
+        self,
+        ctx: Context,
+        scope: dict,
+        pattern: P,
+        html_id: str,
+        args: Arguments = _default_arguments,
+    ):
         self.P = pattern
         self.html_id = html_id
         self.scope = scope
         self.ctx = ctx
+        self.args = args
+        self.queries = filter_queries(ctx)
+        self.queries.queries.append(self)
+
+    def entries(self, doc: OPDocument) -> list[Entry]:
+        format_func = self.ctx.storage.get(names.NAME_IndexFormatter, default_format)
+
+        # TODO: use root directory of output path instead of project path
+        parts1 = ('..', ) * (len(doc.output_path_absolute.relative_to(doc.project_path_absolute).parts) - 1)
+        entries = []
+        for each in self.queries.matches(self, doc.project_docs):
+            part2 = each.output_path_absolute.relative_to(doc.project_path_absolute).parts
+            path = os.path.join(*parts1, *part2)
+            # path = str(pathlib.Path(each.project_based_path).with_suffix(".html"))
+            display_text = format_func(each) or default_format(each)
+            entries.append(Entry(display_text, path, each.project_based_path))
+        if self.args.sort:
+            entries.sort(key=lambda each: getattr(each, self.args.sort), reverse=self.args.reverse)
+        elif self.args.reverse:
+            entries.reverse()
+        return entries
 
     def __call__(self, doc: OPDocument):
-        html = bs4.BeautifulSoup(doc.code, "html.parser")
+        html = get_dom(doc)
         ul = html.find("ul", attrs={"id": self.html_id})
         if not ul:
             return
-        format_func = self.ctx.storage.get(names.NAME_IndexFormatter, default_format)
-        scope = ChainMap({}, self.scope)
+        entries = self.entries(doc)
+        size = self.args.page_size or max(len(entries), 1)
+        chunks = [entries[i : i + size] for i in range(0, len(entries), size)] or [[]]
 
-        # TODO: use root directory of output path instead of project path
-        parts1 = ('..', ) * (len(doc.output_path_absolute.relative_to(doc.project_path_absolute).parts) - 1)
-        for each in doc.project_docs.values():
+        for each in chunks[0]:
+            li = html.new_tag("li")
+            a = html.new_tag("a", href=each.href)
+            a.append(each.title)
+            li.append(a)
+            ul.append(li)
+
+        if len(chunks) == 1 and not self.args.json:
+            return
 
-            if match_any_tag(self.P, each.tags, scope):  # type: ignore
-                part2 = each.output_path_absolute.relative_to(doc.project_path_absolute).parts
-                path = os.path.join(*parts1, *part2)
-                # path = str(pathlib.Path(each.project_based_path).with_suffix(".html"))
-                display_text = format_func(each) or default_format(each)
-                li = html.new_tag("li")
-                a = html.new_tag("a", href=path)
-                a.append(display_text)
-                li.append(a)
-                ul.append(li)
+        # the other pages, relative to the page of the document, and to each other
+        output = doc.output_path_absolute
+        pages_dir = output.parent / f"{output.stem}.{self.html_id}"
+        pages = [f"{pages_dir.name}/{_page_name(n, output.suffix)}" for n in range(1, len(chunks) + 1)]
+        pages[0] = output.name
+        if len(chunks) > 1:
+            ul.insert_after(parse_fragment(_nav_html(pages, 1)).contents[0])
+        local_pages = ["../" + output.name] + [
+            _page_name(n, output.suffix) for n in range(2, len(chunks) + 1)
+        ]
+        for n in range(2, len(chunks) + 1):
+            doc.outputs[pages_dir / _page_name(n, output.suffix)] = (
+                '<!DOCTYPE html>\n<html><head><meta charset="utf-8">'
+                f"<title>{html_escape.escape(default_format(doc), quote=False)} ({n} / {len(chunks)})</title>"
+                f'</head><body><ul id="{self.html_id}">{_items_html(chunks[n - 1], "../")}</ul>'
+                f"{_nav_html(local_pages, n)}</body></html>\n"
+            )
 
-        doc.code = str(html)
+        if self.args.json:
+            ul["data-pages"] = str(len(chunks))
+            ul["data-shards"] = pages_dir.name
+            for n, chunk in enumerate(chunks, 1):
+                doc.outputs[pages_dir / _page_name(n, ".json")] = json.dumps(
+                    {
+                        # no page count, so that a new page only changes the last shard
+                        "page": n,
+                        "next": n + 1 if n < len(chunks) else None,
+                        "items": [each._asdict() for each in chunk],
+                    },
+                    ensure_ascii=False,
+                )
 
 
 class PTagQueryDocsEntry(CommandEntry):
@@ -64,6 +222,7 @@ class PTagQueryDocsEntry(CommandEntry):
         self.ctx = ctx
 
     def proc(self, argv: list[str], start: int, end: int):
+        args = wisepy2.wise(parse_args)(argv)
         ctx = self.ctx
         scope = self.ctx.storage.setdefault(names.NAME_PythonScope, {})
         source = process_nest(self.ctx, start, end)
@@ -71,8 +230,8 @@ class PTagQueryDocsEntry(CommandEntry):
         if not patterns:
             raise ValueError("At least one pattern is required.")
         matcher = functools.reduce(cps_and, patterns)
-        html_id = global_gensym("filtered-index")
-        ctx.target_doc.callbacks.append(FilterIndex(self.ctx, scope, matcher, html_id))
+        html_id = doc_gensym(ctx.target_doc, "filtered-index")
+        ctx.target_doc.callbacks.append(FilterIndex(self.ctx, scope, matcher, html_id, args))
         return f'<ul id="{html_id}"></ul>'
 
     def inline_proc(self, _start: int, _stop: int) -> str:
@@ -80,6 +239,6 @@ class PTagQueryDocsEntry(CommandEntry):
         scope = self.ctx.storage.setdefault(names.NAME_PythonScope, {})
         source = process_nest(self.ctx, _start, _stop)
         pattern = string_to_pattern(source)
-        html_id = global_gensym("filtered-index")
+        html_id = doc_gensym(ctx.target_doc, "filtered-index")
         ctx.target_doc.callbacks.append(FilterIndex(self.ctx, scope, pattern, html_id))
         return f'<ul id="{html_id}"></ul>'
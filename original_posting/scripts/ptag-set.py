@@ -1,6 +1,6 @@
 from __future__ import annotations
 from original_posting import CommandEntry, Context, process_nest
-from original_posting.ptag_dsl import string_to_expr_code, string_expr_builder
+from original_posting.ptag_dsl import Term, string_to_expr_code, string_expr_builder
 import original_posting.builtin_names as names
 
 
@@ -20,6 +20,7 @@ class PTagSetEntry(CommandEntry):
                 cur_doc_tags.append(x)
 
         scope["__ptag_add"] = __ptag_add
+        scope[names.VARNAME_ptag_term] = Term
 
         exec(string_expr_builder(source), scope)
         return ""
@@ -29,6 +30,7 @@ class PTagSetEntry(CommandEntry):
         scope = ctx.storage.setdefault(names.NAME_PythonScope, {})
         cur_doc_tags = ctx.target_doc.tags
         source = process_nest(self.ctx, _start, _stop)
+        scope[names.VARNAME_ptag_term] = Term
 
         v = eval(string_to_expr_code(source), scope)
         if v is not None:
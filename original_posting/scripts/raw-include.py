@@ -3,6 +3,7 @@ from xml.sax.saxutils import escape
 from original_posting.types import CommandEntry, Context, OPDocument, Scope
 from original_posting.parsing import process_nest, new_context
 from original_posting.utils import get_relative_path
+import original_posting.builtin_names as names
 import bs4
 
 
@@ -18,6 +19,9 @@ class RawInclude(CommandEntry):
         cur_doc = self.ctx.target_doc
         file = process_nest(self.ctx, start, end)
         file = self.ctx.target_doc.working_dir_absolute.joinpath(file).absolute()
+        depend = self.ctx.storage.get(names.NAME_DependencyImpl)
+        if depend:
+            depend(file)
         proj_based_path = get_relative_path(file, cur_doc.project_path_absolute)
         old_project_based_path = cur_doc.project_based_path
         old_project_path_absolute = cur_doc.project_path_absolute
@@ -38,9 +42,7 @@ class RawInclude(CommandEntry):
                 "raw-include",
                 self,
                 0,
-                [],
-                0,
-                0
+                []
             )
             s =  process_nest(new_ctx, 0, len(new_ctx.source))
             return s
@@ -2,10 +2,8 @@ from __future__ import annotations
 from xml.sax.saxutils import escape
 from original_posting.types import CommandEntry, Context, OPDocument
 from original_posting.parsing import process_nest
+from original_posting.dom import html_factory
 import wisepy2
-import bs4
-
-_html_factory = bs4.BeautifulSoup("", "html.parser")
 
 class RawLink(CommandEntry):
     _inc = 0
@@ -17,6 +15,6 @@ class RawLink(CommandEntry):
 
     def inline_proc(self, start: int, end: int):
         link = process_nest(self.ctx, start, end)
-        a = _html_factory.new_tag("a", attrs={'href': link})
+        a = html_factory().new_tag("a", attrs={'href': link})
         a.append(escape(link))
         return str(a)
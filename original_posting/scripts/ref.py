@@ -1,13 +1,13 @@
 from __future__ import annotations
-from sqlite3 import connect
 from original_posting.types import Runtime, CommandEntry, Context, OPDocument
 from original_posting.parsing import process_nest, get_command_entry
+from original_posting.dom import get_dom, html_factory, parse_fragment
 from json import dumps
-from xml.sax.saxutils import escape
+from xml.sax.saxutils import escape, unescape
 from wisepy2 import wise
 import shlex
 import typing
-import bs4
+import re
 
 class ParseArgs(typing.TypedDict):
     mode: typing.Literal['mk', 'use']
@@ -24,7 +24,13 @@ class ArgParser:
 FootNoteId = str
 FootNoteContent = str
 
-_html_factory = bs4.BeautifulSoup("", "html.parser")
+# the placeholders emitted by '@ref|use ..|' and '@ref|mk|', as serialized by bs4
+_ref_pattern = re.compile(
+    r"""<a href=("#([^"]*)"|'#([^']*)') unsolved-kind="rfootnote-ref"></a>"""
+)
+_mk_placeholder = '<div unsolved-kind="rfootnote-mk"></div>'
+_quote = {'"': "&quot;"}
+_unquote = {"&quot;": '"'}
 
 class RFootNoteCmd(CommandEntry):
     _inc = 0
@@ -35,36 +41,26 @@ class RFootNoteCmd(CommandEntry):
     def callback(op_doc: OPDocument):
         inserted_footnodes: dict[FootNoteId, FootNoteContent]
         inserted_footnodes = op_doc.data.setdefault(RFootNoteCmd, {})
-        html = bs4.BeautifulSoup(op_doc.code, "html.parser")
-        # TODO: html ast
-        ol = _html_factory.new_tag("ol")
         order: dict[FootNoteId, int] = {}
+        items = []
         for i, (title, content) in enumerate(inserted_footnodes.items()):
             order[title] = i + 1
-            li = _html_factory.new_tag("li")
-            li.attrs["id"] = title
-            p = _html_factory.new_tag("p")
-            p.contents.extend(bs4.BeautifulSoup("<div>" + content + "<div>", "html.parser").contents[0].contents) # type: ignore
-            li.contents.append(p)
-            ol.contents.append(li)
+            items.append(f'<li id="{escape(title, _quote)}"><p>{content}<div></div></p></li>')
+        # the contents of all the footnotes are normalized in a single parse
+        ol_html = parse_fragment("<ol>" + "".join(items) + "</ol>").decode_contents()
 
-        ol = bs4.BeautifulSoup(str(ol), "html.parser")
-        for tag in ol, html:
-            for each in tag.find_all("a", attrs={"unsolved-kind": "rfootnote-ref"}):
-                if not isinstance(each, bs4.element.Tag):
-                    continue
-                del each.attrs['unsolved-kind']
-                i = order.get(each.attrs['href'][1:])
-                if i:
-                    each.append(f"[{i}]")
+        def resolve(m: re.Match):
+            i = order.get(unescape(m.group(2) or m.group(3), _unquote))
+            return f"<a href={m.group(1)}>" + (f"[{i}]" if i else "") + "</a>"
 
-        for each in html.find_all("div", attrs={"unsolved-kind": "rfootnote-mk"}):
-            if not isinstance(each, bs4.element.Tag):
-                continue
-            del each.attrs['unsolved-kind']
-            each.contents.append(ol)
-
-        op_doc.code = str(html)
+        ol_html = _ref_pattern.sub(resolve, ol_html)
+        code = _ref_pattern.sub(resolve, op_doc.code)
+        op_doc.code = code.replace(_mk_placeholder, "<div>" + ol_html + "</div>")
+        # the page is serialized by bs4 as it always was, by parsing it here
+        # unless a later callback parses it anyway
+        later = op_doc.callbacks[op_doc.callbacks.index(RFootNoteCmd.callback) + 1:]
+        if not any(getattr(each, "uses_dom", False) for each in later):
+            get_dom(op_doc)
 
     def proc(self, argv: list[str], start: int, end: int):
         title = argv[0].strip()
@@ -82,11 +78,11 @@ class RFootNoteCmd(CommandEntry):
 
         mode = args['mode']
         if mode == 'mk':
-            div = _html_factory.new_tag("div", attrs={"unsolved-kind": "rfootnote-mk"})
+            div = html_factory().new_tag("div", attrs={"unsolved-kind": "rfootnote-mk"})
             return str(div)
         elif mode == 'use':
             title = args['title']
-            a = _html_factory.new_tag("a", href="#" + title, attrs={"unsolved-kind": "rfootnote-ref"})
+            a = html_factory().new_tag("a", href="#" + title, attrs={"unsolved-kind": "rfootnote-ref"})
         else:
             raise ValueError("Unknown mode: " + mode)
         return str(a)
\ No newline at end of file
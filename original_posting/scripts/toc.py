@@ -4,8 +4,10 @@ e.g.,
     @toc|--depth 2|
 """
 from original_posting.types import CommandEntry, Context, OPDocument
+from original_posting.dom import get_dom, uses_dom
 from original_posting.parsing import process_nest
-from original_posting.utils import global_gensym, make_valid_identifier
+from original_posting.utils import doc_gensym, make_valid_identifier
+import bisect
 import bs4
 import wisepy2
 import typing
@@ -20,60 +22,101 @@ def parse_args(*, depth: int = 2):
     return Arguments(depth=depth)
 
 
+class HeadingIndex:
+    """
+    The headings `h1` .. `h{max_level}` of a page in document order, found in
+    a single walk, with the spans of the nodes in that order so that the
+    headings of a section are a slice of them.
+    """
+
+    def __init__(self, root: bs4.Tag, max_level: int):
+        names = [f"h{level}" for level in range(1, max_level + 1)]
+        self.headings: dict[str, list[bs4.Tag]] = {name: [] for name in names}
+        self.positions: dict[str, list[int]] = {name: [] for name in names}
+        # id of a tag -> its position, and the last position of its descendants
+        self.pos: dict[int, int] = {id(root): 0}
+        self.end: dict[int, int] = {}
+        # id of a heading -> its next sibling of the same name
+        self.next_same: dict[int, bs4.Tag] = {}
+
+        counter = 1
+        stack = [(root, iter(root.contents), {})]
+        while stack:
+            tag, children, last_same = stack[-1]
+            for child in children:
+                if not isinstance(child, bs4.Tag):
+                    continue
+                self.pos[id(child)] = counter
+                if child.name in self.headings:
+                    self.headings[child.name].append(child)
+                    self.positions[child.name].append(counter)
+                    previous = last_same.get(child.name)
+                    if previous is not None:
+                        self.next_same[id(previous)] = child
+                    last_same[child.name] = child
+                counter += 1
+                stack.append((child, iter(child.contents), {}))
+                break
+            else:
+                self.end[id(tag)] = counter - 1
+                stack.pop()
+
+    def find(self, name: str, first: int, last: int) -> list[bs4.Tag]:
+        """The headings named `name` between the positions `first` and `last`."""
+        positions = self.positions[name]
+        i = bisect.bisect_left(positions, first)
+        j = bisect.bisect_right(positions, last)
+        return self.headings[name][i:j]
+
+    def section(self, heading: bs4.Tag) -> tuple[int, int]:
+        """
+        The positions of the siblings following `heading`, up to the next
+        one of the same name, and of their descendants.
+        """
+        parent = heading.parent
+        assert parent
+        next_same = self.next_same.get(id(heading))
+        if next_same is None:
+            last = self.end[id(parent)]
+        else:
+            last = self.pos[id(next_same)] - 1
+        return self.end[id(heading)] + 1, last
+
+
 def generate_toc(
     depth: int,
     max_depth: int,
-    nodes: list[bs4.Tag],
+    first: int,
+    last: int,
+    index: HeadingIndex,
     doc: bs4.BeautifulSoup,
+    op_doc: OPDocument,
 ) -> bs4.Tag:
-    tag_name = f"h{depth}"
     ul = doc.new_tag("ul")
-
-    def add_sub(n: bs4.Tag):
+    for n in index.find(f"h{depth}", first, last):
         title = n.text
-        address = global_gensym(make_valid_identifier(title))
+        address = doc_gensym(op_doc, make_valid_identifier(title))
         n.insert(0, doc.new_tag("div", id=address))
         li = doc.new_tag("li")
         a = doc.new_tag("a", href="#" + address)
         a.append(title)
         li.append(a)
         if depth <= max_depth:
-            parent = n.parent
-            assert parent
-            i = parent.index(n) + 1
-            parent_contents = parent.contents
-            next_level_nodes = []
-            while i < len(parent_contents):
-                sibling = parent_contents[i]
-                if isinstance(sibling, bs4.Tag):
-                    if sibling.name == tag_name:
-                        break
-                    next_level_nodes.append(sibling)
-                i += 1
-            li.append(generate_toc(depth + 1, max_depth, next_level_nodes, doc))
+            li.append(
+                generate_toc(depth + 1, max_depth, *index.section(n), index, doc, op_doc)
+            )
         ul.append(li)
-
-    for node in nodes:
-        if not isinstance(node, bs4.Tag):
-            continue
-
-        if isinstance(node, bs4.Tag) and node.name == tag_name:
-            add_sub(node)
-
-        for n in node.find_all(tag_name):
-            add_sub(n)
-
     return ul
 
 
+@uses_dom
 class Replacer:
     def __init__(self, uuid: str, depth: int):
         self.uuid = uuid
         self.depth = depth
 
     def __call__(self, doc: OPDocument) -> None:
-        source: str = doc.code
-        html = bs4.BeautifulSoup(source, "html.parser")
+        html = get_dom(doc)
         title_node = html.find("title")
         if not title_node:
             title_node = html.new_tag("title")
@@ -89,9 +132,9 @@ class Replacer:
         toc = html.find("div", {"class": "toc", "refid": self.uuid})
         if not toc:
             return
-        inner = generate_toc(1, self.depth, [html], html)
+        index = HeadingIndex(html, self.depth + 1)
+        inner = generate_toc(1, self.depth, 0, index.end[id(html)], index, html, doc)
         toc.append(inner)
-        doc.code = str(html)
 
 
 class TocEntry(CommandEntry):
@@ -100,7 +143,7 @@ class TocEntry(CommandEntry):
 
     def proc(self, argv: list[str], _start: int, _stop: int) -> str:
         args = wisepy2.wise(parse_args)(argv)
-        ref_id = global_gensym(make_valid_identifier("toc"))
+        ref_id = doc_gensym(self.ctx.target_doc, make_valid_identifier("toc"))
         self.ctx.target_doc.callbacks.append(Replacer(ref_id, args.depth))
         return f'<div class="toc" refid="{ref_id}"></div>'
 
@@ -0,0 +1,185 @@
+"""
+The full-text search index of a site, written by the builds with
+`--search_index` under `<out>/search/`, so that a page can search the site
+by loading a few small files instead of every page:
+- `index.json`: `{"format", "prefix", "docs_per_shard", "terms", "docs"}`,
+  the names of the term shards and the numbers of the document shards;
+- `terms-<shard>.json`: `{term: [document id, ...]}`, for the terms of a shard;
+- `docs-<n>.json`: `{document id: [title, href]}`, for the ids from
+  `n * docs_per_shard`, the hrefs being relative to the output directory.
+
+A term is a run of letters, digits and underscores, or a single CJK
+ideograph, casefolded, found in the text of an output after the callbacks.
+The shard of a term is made of its first `prefix` characters as hex code
+points joined with '-', e.g., "6f-70" for "op" and "op-cache".
+
+The terms of the documents are kept in the metadata store, so that a build
+only tokenizes the documents whose output changed, and only writes the
+shards they touch.
+"""
+from __future__ import annotations
+from original_posting.types import OPDocument
+from original_posting.metadata import code_digest
+import html
+import json
+import os
+import pathlib
+import re
+import sqlite3
+import typing
+
+SEARCH_DIRNAME = "search"
+SEARCH_FORMAT = 1
+PREFIX = 2
+DOCS_PER_SHARD = 500
+MAX_TERM_LENGTH = 64
+
+_ignored_pattern = re.compile(
+    r"<(script|style)\b.*?</\1\s*>|<!--.*?-->", re.IGNORECASE | re.DOTALL
+)
+_tag_pattern = re.compile(r"<[^>]*>")
+_cjk = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_term_pattern = re.compile(f"[{_cjk}]|[^\\W{_cjk}]+")
+
+
+def terms(code: str) -> set[str]:
+    """The terms of the text of the HTML `code`."""
+    text = html.unescape(_tag_pattern.sub(" ", _ignored_pattern.sub(" ", code)))
+    return {
+        term for term in _term_pattern.findall(text.casefold()) if len(term) <= MAX_TERM_LENGTH
+    }
+
+
+def shard_of(term: str) -> str:
+    return "-".join(f"{ord(c):x}" for c in term[:PREFIX])
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+class SearchIndex:
+    def __init__(self, conn: sqlite3.Connection, outdir: pathlib.Path):
+        self.conn = conn
+        self.outdir = outdir
+        self.directory = outdir / SEARCH_DIRNAME
+        # to write again: the term shards, and the numbers of the document shards
+        self.dirty_terms: set[str] = set()
+        self.dirty_docs: set[int] = set()
+
+    def files(self, docs: typing.Iterable[OPDocument]) -> typing.Iterator[tuple[pathlib.Path, str]]:
+        """
+        Update the index with the documents of a build, the others being
+        dropped, and generate the files of the index to write, by path.
+
+        The changes to the store are only kept if all the files are taken.
+        """
+        with self.conn:
+            self._update(docs)
+            yield from self._dirty_files()
+
+    def _update(self, docs: typing.Iterable[OPDocument]):
+        built: set[int] = set()
+        for doc in docs:
+            built.add(self._update_one(doc))
+        removed = [
+            doc_id
+            for (doc_id,) in self.conn.execute("SELECT id FROM search_docs")
+            if doc_id not in built
+        ]
+        for doc_id in removed:
+            self._forget_terms(doc_id)
+            self.conn.execute("DELETE FROM search_docs WHERE id = ?", (doc_id,))
+            self.dirty_docs.add(doc_id // DOCS_PER_SHARD)
+
+    def _update_one(self, doc: OPDocument) -> int:
+        title = doc.title or doc.output_path_absolute.name
+        href = pathlib.PurePath(
+            os.path.relpath(doc.output_path_absolute, self.outdir)
+        ).as_posix()
+        digest = code_digest(doc.code)
+        row = self.conn.execute(
+            "SELECT id, title, href, digest FROM search_docs WHERE path = ?",
+            (doc.project_based_path,),
+        ).fetchone()
+        if row is None:
+            cursor = self.conn.execute(
+                "INSERT INTO search_docs (path, title, href, digest) VALUES (?, ?, ?, ?)",
+                (doc.project_based_path, title, href, digest),
+            )
+            doc_id = typing.cast(int, cursor.lastrowid)
+        else:
+            doc_id = row[0]
+            if row[1:] == (title, href, digest):
+                return doc_id
+            self.conn.execute(
+                "UPDATE search_docs SET title = ?, href = ?, digest = ? WHERE id = ?",
+                (title, href, digest, doc_id),
+            )
+            if row[3] == digest:
+                self.dirty_docs.add(doc_id // DOCS_PER_SHARD)
+                return doc_id
+            self._forget_terms(doc_id)
+        self.dirty_docs.add(doc_id // DOCS_PER_SHARD)
+        rows = [(shard_of(term), term, doc_id) for term in terms(doc.code)]
+        self.conn.executemany("INSERT INTO search_terms (shard, term, doc) VALUES (?, ?, ?)", rows)
+        self.dirty_terms.update(shard for (shard, _, _) in rows)
+        return doc_id
+
+    def _forget_terms(self, doc_id: int):
+        self.dirty_terms.update(
+            shard
+            for (shard,) in self.conn.execute(
+                "SELECT DISTINCT shard FROM search_terms WHERE doc = ?", (doc_id,)
+            )
+        )
+        self.conn.execute("DELETE FROM search_terms WHERE doc = ?", (doc_id,))
+
+    def _dirty_files(self) -> typing.Iterator[tuple[pathlib.Path, str]]:
+        shards = [
+            shard
+            for (shard,) in self.conn.execute("SELECT DISTINCT shard FROM search_terms ORDER BY 1")
+        ]
+        doc_shards = [
+            n
+            for (n,) in self.conn.execute(
+                "SELECT DISTINCT id / ? FROM search_docs ORDER BY 1", (DOCS_PER_SHARD,)
+            )
+        ]
+        # e.g., removed by hand, or written to another output directory
+        self.dirty_terms.update(shard for shard in shards if not self._term_path(shard).exists())
+        self.dirty_docs.update(n for n in doc_shards if not self._docs_path(n).exists())
+
+        for shard in sorted(self.dirty_terms):
+            postings: dict[str, list[int]] = {}
+            for term, doc_id in self.conn.execute(
+                "SELECT term, doc FROM search_terms WHERE shard = ? ORDER BY term, doc", (shard,)
+            ):
+                postings.setdefault(term, []).append(doc_id)
+            # an emptied shard is no longer listed, but may still be loaded by stale pages
+            yield self._term_path(shard), _dumps(postings)
+
+        for n in sorted(self.dirty_docs):
+            table = {
+                str(doc_id): [title, href]
+                for (doc_id, title, href) in self.conn.execute(
+                    "SELECT id, title, href FROM search_docs WHERE id >= ? AND id < ? ORDER BY id",
+                    (n * DOCS_PER_SHARD, (n + 1) * DOCS_PER_SHARD),
+                )
+            }
+            yield self._docs_path(n), _dumps(table)
+
+        manifest = {
+            "format": SEARCH_FORMAT,
+            "prefix": PREFIX,
+            "docs_per_shard": DOCS_PER_SHARD,
+            "terms": shards,
+            "docs": doc_shards,
+        }
+        yield self.directory / "index.json", _dumps(manifest)
+
+    def _term_path(self, shard: str) -> pathlib.Path:
+        return self.directory / f"terms-{shard}.json"
+
+    def _docs_path(self, n: int) -> pathlib.Path:
+        return self.directory / f"docs-{n}.json"
@@ -0,0 +1,295 @@
+"""
+A long-lived build process, for `op serve`, so that editors do not pay the
+interpreter startup and the loading of the commands and their libraries
+(e.g., Pygments, mistletoe and bs4) on every save.
+
+The requests are JSON objects POSTed over HTTP, on localhost or on a Unix
+socket, and handled one at a time:
+- `/render` `{"file": ..., "project_path": ...}` renders a document alone,
+  without the documents it includes and without writing the output, and
+  returns `{"html": ..., "title": ..., "timings": ...}`. It sees the storage
+  left by the last `/build` of the project, e.g., the Python scope defined by
+  its index, but does not change it;
+- `/build` `{"entry": ..., "project_path": ..., "out": ..., "force": ...,
+  "suffix": ...}` builds a project incrementally, as `op` does, and returns
+  `{"outputs": [...], "rendered": ..., "timings": ...}`;
+- `GET /status` returns how many documents are kept in memory.
+
+As the requests run the code of the documents and write files, the daemon
+only takes them from local clients: a POST must have the content type
+`application/json`, which a web page cannot send to another origin without
+asking first, and on localhost the `Host` and any `Origin` must be local
+too, against DNS rebinding. Relative paths are resolved against
+`project_path`, which is then required, and the documents and the output
+directory must be inside the project.
+
+Like `op --watch`, every request starts from a fresh storage and restarts the
+numbering of `global_gensym`. The parsed documents and, with `--compile`,
+their render functions are kept in memory between requests, up to
+`max_docs` of each; the least recently used are evicted first.
+"""
+from __future__ import annotations
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from original_posting.build import Build, BuildOptions
+from original_posting.codegen import RenderCache
+from original_posting.registry import commands
+from original_posting.incremental import BUILD_NAMES
+from original_posting.utils import reset_gensym
+import original_posting.builtin_names as names
+import json
+import os
+import re
+import socketserver
+import time
+import traceback
+import typing
+
+DEFAULT_PORT = 8391
+
+
+class LRUCache(OrderedDict):
+    """A dict keeping at most `maxsize` entries, evicting the least recently used."""
+
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _ms(seconds: float):
+    return round(seconds * 1000, 3)
+
+
+class Daemon:
+    def __init__(self, compile: bool = False, max_docs: int = 256):
+        self.compile = compile
+        self.trees: LRUCache = LRUCache(max_docs)
+        self.render_cache: RenderCache | None = None
+        if compile:
+            self.render_cache = RenderCache()
+            self.render_cache.functions = LRUCache(max_docs)
+        # project path -> the storage left by its last build
+        self.storages: dict[str, dict[str, typing.Any]] = {}
+
+    def _build(self, project_path: str, opts: BuildOptions, files: list[str]):
+        reset_gensym()
+        # scripts may be edited in place, which leaves the mtime of their directory
+        commands.refresh(rescan=True)
+        return Build(
+            project_path,
+            files,
+            opts,
+            trees=self.trees,
+            render_cache=self.render_cache,
+        )
+
+    def render(self, request: dict[str, typing.Any]):
+        file = _required(request, "file")
+        if request.get("project_path") or not os.path.isabs(file):
+            project_path = _project_path(request, "file")
+        else:
+            project_path = self._project_of(file)
+        file = _inside(project_path, file, "file")
+        t0 = time.perf_counter()
+        opts = BuildOptions(False, ".html", "out", compile=self.compile)
+        build = self._build(project_path, opts, [])
+        for k, v in self.storages.get(project_path, {}).items():
+            build.storage[k] = dict(v) if k == names.NAME_PythonScope else v
+        t1 = time.perf_counter()
+        doc = build.render_one(file)
+        t2 = time.perf_counter()
+        return {
+            "html": doc.code,
+            "title": doc.title,
+            "timings": {"setup_ms": _ms(t1 - t0), "render_ms": _ms(t2 - t1)},
+        }
+
+    def build(self, request: dict[str, typing.Any]):
+        entry = _required(request, "entry")
+        if request.get("project_path") or not os.path.isabs(entry):
+            project_path = _project_path(request, "entry")
+        else:
+            project_path = os.path.realpath(os.path.dirname(entry))
+        entry = _inside(project_path, entry, "entry")
+        out = request.get("out", "out")
+        if not isinstance(out, str) or not out:
+            raise BadRequest("'out' must be a path")
+        out = os.path.relpath(_inside(project_path, out, "out"), project_path)
+        suffix = request.get("suffix", ".html")
+        if not isinstance(suffix, str) or not _suffix_pattern.fullmatch(suffix):
+            raise BadRequest(f"invalid suffix {suffix!r}")
+        opts = BuildOptions(
+            request.get("force", False) is True,
+            suffix,
+            out,
+            compile=self.compile,
+            incremental=True,
+        )
+        t0 = time.perf_counter()
+        build = self._build(project_path, opts, [entry])
+        build.build_all()
+        self.storages[project_path] = {
+            k: v for k, v in dict.items(build.storage) if k not in BUILD_NAMES
+        }
+        return {
+            "outputs": [str(doc.output_path_absolute) for doc in build.built_docs.values()],
+            "rendered": len(build.traces),
+            "timings": {"total_ms": _ms(time.perf_counter() - t0)},
+        }
+
+    def _project_of(self, file: str):
+        """The innermost project built before holding `file`, or the directory of `file`."""
+        file = os.path.realpath(file)
+        projects = [p for p in self.storages if file.startswith(p + os.sep)]
+        if projects:
+            return max(projects, key=len)
+        return os.path.dirname(file)
+
+    def status(self):
+        return {
+            "documents": len(self.trees),
+            "functions": len(self.render_cache.functions) if self.render_cache else 0,
+        }
+
+
+def _required(request: dict[str, typing.Any], key: str):
+    value = request.get(key)
+    if not isinstance(value, str) or not value:
+        raise BadRequest(f"missing {key!r}")
+    return value
+
+
+_suffix_pattern = re.compile(r"\.[\w.-]+")
+
+
+def _project_path(request: dict[str, typing.Any], key: str) -> str:
+    project_path = request.get("project_path")
+    if not isinstance(project_path, str) or not os.path.isabs(project_path):
+        raise BadRequest(f"an absolute 'project_path' is required with a relative {key!r}")
+    return os.path.realpath(project_path)
+
+
+def _inside(project_path: str, path: str, key: str) -> str:
+    """`path`, resolved against `project_path`, if it is inside the project."""
+    project_path = os.path.realpath(project_path)
+    resolved = os.path.realpath(os.path.join(project_path, path))
+    if os.path.commonpath([resolved, project_path]) != project_path:
+        raise BadRequest(f"{key!r} must be inside {project_path}")
+    return resolved
+
+
+_local_host_pattern = re.compile(r"(localhost|127\.0\.0\.1|\[::1\])(:\d+)?", re.IGNORECASE)
+_local_origin_pattern = re.compile(r"https?://" + _local_host_pattern.pattern, re.IGNORECASE)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: typing.Any
+
+    def _refused(self) -> str | None:
+        """Why the request may come from elsewhere than a local client, if it may."""
+        # no browser connects to a Unix socket, whatever the host it names
+        host = self.headers.get("Host", "")
+        if not isinstance(self.server, _UnixHTTPServer) and not _local_host_pattern.fullmatch(host):
+            return f"the host {host!r} is not local"
+        origin = self.headers.get("Origin")
+        if origin is not None and not _local_origin_pattern.fullmatch(origin):
+            return f"the origin {origin!r} is not local"
+        return None
+
+    def _reply(self, status: int, body: dict[str, typing.Any]):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        refused = self._refused()
+        if refused:
+            self._reply(403, {"error": refused})
+        elif self.path == "/status":
+            self._reply(200, self.server.op_daemon.status())
+        else:
+            self._reply(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        daemon: Daemon = self.server.op_daemon
+        handlers = {"/render": daemon.render, "/build": daemon.build}
+        handler = handlers.get(self.path)
+        if handler is None:
+            self._reply(404, {"error": f"unknown path {self.path}"})
+            return
+        refused = self._refused()
+        if refused:
+            self._reply(403, {"error": refused})
+            return
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type != "application/json":
+            self._reply(415, {"error": "the content type must be application/json"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            self._reply(400, {"error": str(e)})
+            return
+        try:
+            if not isinstance(request, dict):
+                raise BadRequest("expected a JSON object")
+            body = handler(request)
+        except BadRequest as e:
+            self._reply(400, {"error": str(e)})
+        except Exception:
+            self._reply(500, {"error": traceback.format_exc()})
+        else:
+            self._reply(200, body)
+
+
+class _UnixHTTPServer(socketserver.UnixStreamServer):
+    def get_request(self):
+        request, _ = super().get_request()
+        # `BaseHTTPRequestHandler` logs the host of the client address
+        return request, ("local", 0)
+
+
+def serve(
+    daemon: Daemon,
+    port: int = DEFAULT_PORT,
+    socket_path: str = "",
+):
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = _UnixHTTPServer(socket_path, _Handler)
+        print(f"Serving on {socket_path}.")
+    else:
+        server = HTTPServer(("127.0.0.1", port), _Handler)
+        print(f"Serving on http://127.0.0.1:{port}.")
+    server.op_daemon = daemon  # type: ignore
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
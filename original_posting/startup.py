@@ -0,0 +1,59 @@
+"""
+Import timings for `op --startup_report`.
+"""
+from __future__ import annotations
+import builtins
+import sys
+import time
+import typing
+
+
+class ImportTimer:
+    """
+    While entered, records how long the first import of each module
+    takes, the modules it imports included.
+    """
+
+    def __init__(self):
+        self.modules: dict[str, float] = {}
+        self._import = builtins.__import__
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level:
+            package = (globals or {}).get("__package__") or ""
+            if level > 1:
+                package = package.rsplit(".", level - 1)[0]
+            name_abs = f"{package}.{name}" if name else package
+        else:
+            name_abs = name
+        if name_abs in sys.modules:
+            return self._import(name, globals, locals, fromlist, level)
+        t0 = time.perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            self.modules.setdefault(name_abs, time.perf_counter() - t0)
+
+    def __enter__(self):
+        builtins.__import__ = self._timed_import
+        return self
+
+    def __exit__(self, *_):
+        builtins.__import__ = self._import
+
+
+def print_report(
+    modules: dict[str, float],
+    commands: dict[str, float],
+    total: float,
+    file: typing.TextIO = sys.stderr,
+    threshold: float = 0.001,
+):
+    """Print the import times of commands and of the modules above `threshold` seconds."""
+    rows = [(t, "command", name) for name, t in commands.items()]
+    rows.extend((t, "module", name) for name, t in modules.items() if t >= threshold)
+    rows.sort(reverse=True)
+    print(f"{'ms':>10}  {'kind':<8} name", file=file)
+    for t, kind, name in rows:
+        print(f"{t * 1000:>10.1f}  {kind:<8} {name}", file=file)
+    print(f"{total * 1000:>10.1f}  {'total':<8} build", file=file)
@@ -4,6 +4,10 @@ import pathlib
 import typing
 import abc
 
+if typing.TYPE_CHECKING:
+    from original_posting.parsing import SourceTree, LineTable
+    from original_posting.dom import DocumentDom
+
 DEFAULT_SCRIPT_PATH = "~/.original-posting"
 DEFAULT_SCRIPT_PATH_INTERNAL = pathlib.Path(__file__).parent.joinpath("scripts").as_posix()
 
@@ -21,6 +25,7 @@ class OPDocument:
     - `working_dir_absolute`: the absolute path of the source file's directory.
     - `project_path_absolute`: the absolute path of the project root.
     - `title`: the title of the document.
+    - `outputs`: other files written with the output, by absolute path, e.g., the pages of an index.
 
     Before performing the callback, `code` is always an empty string.
     """
@@ -36,19 +41,56 @@ class OPDocument:
     data: dict = field(default_factory=dict)
     code: str = ""
     title: str = ""
+    outputs: typing.Dict[pathlib.Path, str] = field(default_factory=dict)
+    # the parsed `code` while the callbacks run, see `original_posting.dom`
+    dom: typing.Optional[DocumentDom] = field(default=None, repr=False, compare=False)
 
     def __repr__(self) -> str:
 
         return f'<OPDocuement {self.project_based_path} in {self.project_path_absolute}>'
 
-@dataclass
+@dataclass(init=False)
 class Scope:
     name: str
     cmd_entry: CommandEntry
     start: int
     args: list[str]
-    start_line: int
-    start_col: int
+
+    def __init__(
+        self,
+        name: str,
+        cmd_entry: CommandEntry,
+        start: int,
+        args: list[str],
+        start_line: int | None = None,
+        start_col: int | None = None,
+        lines: LineTable | None = None,
+    ):
+        """
+        `start_line` and `start_col` are computed from `lines` when first
+        read, unless given, as the scripts of older versions do.
+        """
+        self.name = name
+        self.cmd_entry = cmd_entry
+        self.start = start
+        self.args = args
+        self._start_line = start_line
+        self._start_col = start_col
+        self._lines = lines
+
+    @property
+    def start_line(self) -> int:
+        """0-based line of `start`."""
+        if self._start_line is None:
+            self._start_line = self._lines.line_of(self.start) if self._lines else 0
+        return self._start_line
+
+    @property
+    def start_col(self) -> int:
+        """0-based column of `start`."""
+        if self._start_col is None:
+            self._start_col = self._lines.col_of(self.start) if self._lines else 0
+        return self._start_col
 
 
 class CommandEntry(abc.ABC):
@@ -64,19 +106,66 @@ class CommandEntry(abc.ABC):
         return self.proc([], start, end)
 
 
-@dataclass
+@dataclass(init=False)
 class Context:
     source: str
     n_source: int
     pos: int
-    line: int
-    col: int
     cur_scope: Scope | None
     os: str  # which os the source is written
     linesep: str
     file: str
     storage: dict  # application storage
     target_doc: OPDocument
+    tree: SourceTree  # parsed spans of `source`
+    lines: LineTable  # line offsets of `source`, shared by nested contexts
+
+    def __init__(
+        self,
+        source: str,
+        n_source: int,
+        pos: int,
+        cur_scope: Scope | None,
+        os: str,
+        linesep: str,
+        file: str,
+        storage: dict,
+        target_doc: OPDocument,
+        tree: SourceTree | None = None,
+        lines: LineTable | None = None,
+        line: int | None = None,
+        col: int | None = None,
+    ):
+        """
+        `line` and `col` are accepted from the callers of older versions and
+        ignored: both are computed from `pos` when read.
+        """
+        self.source = source
+        self.n_source = n_source
+        self.pos = pos
+        self.cur_scope = cur_scope
+        self.os = os
+        self.linesep = linesep
+        self.file = file
+        self.storage = storage
+        self.target_doc = target_doc
+        if tree is None or lines is None:
+            from original_posting.parsing import LineTable, SourceTree
+
+            tree = SourceTree() if tree is None else tree
+            lines = LineTable(source, linesep) if lines is None else lines
+        self.tree = tree
+        self.lines = lines
+
+    @property
+    def line(self) -> int:
+        """0-based line of `pos`."""
+        return self.lines.line_of(self.pos)
+
+    @property
+    def col(self) -> int:
+        """0-based column of `pos`."""
+        return self.lines.col_of(self.pos)
 
 
 if typing.TYPE_CHECKING:
@@ -95,6 +184,8 @@ def _default_op(ctx: Context, _start: int, _stop: int) -> str:
 
 class Runtime:
     search_path: list[str] = [DEFAULT_SCRIPT_PATH, DEFAULT_SCRIPT_PATH_INTERNAL]
+    # the bs4 backend parsing the HTML in the commands, e.g., "lxml"
+    html_parser: str = "html.parser"
     operators: dict[typing.Literal["[]", "()", "{}"], Operator] = {
         "[]": _default_op,
         "{}": _default_op,
@@ -2,17 +2,35 @@ from __future__ import annotations
 import pathlib
 import importlib.util
 import io
+import sys
+import types
+import typing
+
+if typing.TYPE_CHECKING:
+    from original_posting.types import OPDocument
+
+
+# the package of the modules loaded by `load_from_source`
+SOURCE_PACKAGE = "__source__"
 
 
 def load_from_source(file: str, mod_name: str | None = None):
-    mod_name = mod_name or f"__source__.{file}"
+    mod_name = mod_name or f"{SOURCE_PACKAGE}.{file}"
     spec = importlib.util.spec_from_file_location(mod_name, file)
     if not spec:
         raise IOError(f"{file} not found")
     module = importlib.util.module_from_spec(spec)
     if not spec.loader:
         raise IOError(f"{file} is not a valid python module")
-    spec.loader.exec_module(module)
+    # registered so that the objects it defines can be pickled by reference
+    if SOURCE_PACKAGE not in sys.modules:
+        sys.modules[SOURCE_PACKAGE] = types.ModuleType(SOURCE_PACKAGE)
+    sys.modules[mod_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[mod_name]
+        raise
     return module
 
 
@@ -36,15 +54,42 @@ def get_relative_path(file: str | pathlib.Path, rootdir: str | pathlib.Path):
 
 _cnt_ref = [0]
 
+# the key of `OPDocument.data` counting the names generated by `doc_gensym`
+NAME_GensymCount = "__builtin.gensym-count"
+
+
+def gensym_count() -> int:
+    """How many symbols `global_gensym` has generated so far."""
+    return _cnt_ref[0]
+
+
+def reset_gensym():
+    """Number the symbols from 0 again, for a new build in the same process."""
+    _cnt_ref[0] = 0
+
 
 def global_gensym(name: str):
-    """Generate a name that never collides with other names generated by this function."""
+    """
+    Generate a name that never collides with other names generated by this function.
+    The names depend on the documents built before, see `doc_gensym`.
+    """
     try:
         return f"{name}_{_cnt_ref[0]}"
     finally:
         _cnt_ref[0] += 1
 
 
+def doc_gensym(doc: OPDocument, name: str):
+    """
+    Generate a name that never collides with other names generated by this function
+    for the same document. Unlike `global_gensym`, the names are numbered per document,
+    so an unchanged document gets the same names whatever the documents built before.
+    """
+    n = doc.data.get(NAME_GensymCount, 0)
+    doc.data[NAME_GensymCount] = n + 1
+    return f"{name}_{n}"
+
+
 def make_valid_identifier(string: str):
     """Transform a name to a valid Python identifier."""
     buf = io.StringIO()
@@ -0,0 +1,168 @@
+"""
+Rebuilds a project whenever its files or the command scripts change, for
+`op --watch`.
+
+Every rebuild is incremental, so only the documents affected by a change
+are rendered again, and it runs in the same process, so the loaded commands
+and the libraries they imported (e.g., Pygments and its lexers) stay warm.
+The storage, hence the shared Python scope, starts afresh with every
+rebuild, and is defined again by the documents defining it; the numbering
+of `global_gensym` starts again from 0 as well.
+
+Changes are watched through inotify if `inotify_simple` is installed, and by
+polling the mtimes of the files otherwise.
+"""
+from __future__ import annotations
+from original_posting.build import Build, BuildOptions, CACHE_DIRNAME
+from original_posting.registry import commands
+from original_posting.types import Runtime
+from original_posting.utils import reset_gensym
+from pathlib import Path
+import dataclasses
+import os
+import time
+import traceback
+import typing
+
+# events arriving within this delay are handled by the same rebuild
+DEBOUNCE = 0.1
+POLL_INTERVAL = 0.3
+
+
+def _subdirs(root: str, dirs: list[str], excluded: frozenset[str]):
+    return [
+        d
+        for d in dirs
+        if d != "__pycache__" and os.path.join(root, d) not in excluded
+    ]
+
+
+def _walk(directory: str, excluded: frozenset[str]):
+    """The files under `directory`, skipping the directories in `excluded`."""
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = _subdirs(root, dirs, excluded)
+        for file in files:
+            yield os.path.join(root, file)
+
+
+class PollingWatcher:
+    def __init__(self, directories: list[str], excluded: frozenset[str]):
+        self.directories = directories
+        self.excluded = excluded
+        self.mtimes = self._scan()
+
+    def _scan(self):
+        mtimes: dict[str, int] = {}
+        for directory in self.directories:
+            for file in _walk(directory, self.excluded):
+                try:
+                    mtimes[file] = os.stat(file).st_mtime_ns
+                except OSError:
+                    pass
+        return mtimes
+
+    def wait(self) -> set[str]:
+        """Block until files change, and return them."""
+        while True:
+            time.sleep(POLL_INTERVAL)
+            mtimes = self._scan()
+            changed = {
+                file
+                for file in self.mtimes.keys() | mtimes.keys()
+                if self.mtimes.get(file) != mtimes.get(file)
+            }
+            self.mtimes = mtimes
+            if changed:
+                return changed
+
+
+class InotifyWatcher:
+    def __init__(self, directories: list[str], excluded: frozenset[str]):
+        import inotify_simple
+
+        self.flags = (
+            inotify_simple.flags.CLOSE_WRITE
+            | inotify_simple.flags.CREATE
+            | inotify_simple.flags.DELETE
+            | inotify_simple.flags.MOVED_FROM
+            | inotify_simple.flags.MOVED_TO
+        )
+        self.is_dir = inotify_simple.flags.ISDIR
+        self.inotify = inotify_simple.INotify()
+        self.excluded = excluded
+        self.watched: dict[int, str] = {}
+        for directory in directories:
+            self._add(directory)
+
+    def _add(self, directory: str):
+        for root, dirs, _ in os.walk(directory):
+            dirs[:] = _subdirs(root, dirs, self.excluded)
+            self.watched[self.inotify.add_watch(root, self.flags)] = root
+
+    def wait(self) -> set[str]:
+        """Block until files change, and return them."""
+        changed: set[str] = set()
+        timeout = None
+        while True:
+            events = self.inotify.read(timeout=timeout)
+            if not events and changed:
+                return changed
+            for event in events:
+                directory = self.watched.get(event.wd)
+                if directory is None:
+                    continue
+                path = os.path.join(directory, event.name)
+                if path in self.excluded or event.name == "__pycache__":
+                    continue
+                if event.mask & self.is_dir and os.path.isdir(path):
+                    self._add(path)
+                changed.add(path)
+            timeout = int(DEBOUNCE * 1000)
+
+
+def make_watcher(directories: list[str], excluded: frozenset[str]):
+    try:
+        return InotifyWatcher(directories, excluded)
+    except (ImportError, OSError):
+        return PollingWatcher(directories, excluded)
+
+
+def watch(
+    project_path: str | Path,
+    files_to_build: typing.Sequence[str],
+    opts: BuildOptions,
+):
+    opts = dataclasses.replace(opts, incremental=True)
+    project_path = Path(project_path).absolute()
+    search_dirs = [
+        str(Path(each).expanduser().absolute())
+        for each in Runtime.search_path
+        if Path(each).expanduser().is_dir()
+    ]
+    excluded = frozenset(
+        [
+            str(project_path / opts.outdir),
+            str(project_path / CACHE_DIRNAME),
+            str(project_path / ".git"),
+        ]
+    )
+    watcher = make_watcher([str(project_path), *search_dirs], excluded)
+
+    def rebuild():
+        t0 = time.perf_counter()
+        reset_gensym()
+        try:
+            Build(project_path, files_to_build, opts).build_all()
+        except Exception:
+            traceback.print_exc()
+            return
+        print(f"Built in {(time.perf_counter() - t0) * 1000:.0f}ms.")
+
+    rebuild()
+    while True:
+        print("Watching for changes...")
+        changed = watcher.wait()
+        prefixes = tuple(d + os.sep for d in search_dirs)
+        if any(file.startswith(prefixes) for file in changed):
+            commands.refresh(rescan=True)
+        rebuild()
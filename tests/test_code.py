@@ -0,0 +1,103 @@
+from original_posting.parsing import get_command_entry
+from tests.utils import build, write_files
+import sys
+import pytest
+
+PAGES = {
+    "index.op": """\
+@begin code --lang python
+def f(x):
+    return "<%s>" % x
+@end code
+inline @code|f('a & b')| in a sentence
+@include|a.op|
+@include|b.op|
+""",
+    "a.op": """\
+@begin code --lang rust
+fn main() { println!("hi"); }
+@end code
+@begin code --lang python
+def f(x):
+    return "<%s>" % x
+@end code
+""",
+    "b.op": """\
+<p>no code here</p>
+@begin code --lang python
+    indented = True
+@end code
+""",
+}
+
+
+@pytest.fixture
+def highlights(monkeypatch):
+    """The code highlighted by pygments, by language and form."""
+    module = sys.modules[get_command_entry("code").__module__]
+    highlight = module._highlight
+    calls = []
+
+    def counting_highlight(lang, code, inline):
+        calls.append((lang, code, inline))
+        return highlight(lang, code, inline)
+
+    monkeypatch.setattr(module, "_highlight", counting_highlight)
+    return calls
+
+
+def test_the_highlighted_code(tmp_path):
+    outputs = build(write_files(tmp_path, PAGES))
+    index = outputs["index.html"].decode("utf-8")
+    # one style sheet per page with code
+    assert index.count("<style>") == 1 and index.startswith("<style>pre {")
+    assert '<div class="highlight"><pre>' in index
+    assert '<span class="s2">"&lt;</span><span class="si">%s</span>' in index
+    # the inline form takes the content of <pre>, escaped as bs4 escapes text
+    assert "inline <code>" in index and "f</span>" in index and "&amp; b'" in index
+    assert outputs["b.html"].count(b"<style>") == 1
+    assert b'<span class="n">indented</span>' in outputs["b.html"]
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{"cache": True}, {"incremental": True}, {"compile": True}, {"cache": True, "jobs": 2}],
+)
+def test_cached_highlights_give_the_same_pages(tmp_path, highlights, options):
+    expected = build(write_files(tmp_path / "plain", PAGES))
+    plain_calls = len(highlights)
+    project = write_files(tmp_path / "cached", PAGES)
+    assert build(project, **options) == expected
+    # the same code in two documents is highlighted once, and once again next time
+    files = sorted((project / ".op-cache" / "highlight").glob("*/*.html"))
+    assert len(files) == 4
+    assert all(path.parent.name == path.stem[:2] and len(path.stem) == 40 for path in files)
+    if options.get("jobs", 1) == 1:
+        assert len(highlights) - plain_calls == 4
+    highlights.clear()
+    assert build(project, cache=True) == expected
+    assert highlights == []
+
+
+def test_edited_code_is_highlighted_again(tmp_path, highlights):
+    project = write_files(tmp_path, PAGES)
+    build(project, cache=True)
+    highlights.clear()
+    write_files(project, {"b.op": PAGES["b.op"].replace("True", "False")})
+    outputs = build(project, cache=True)
+    assert highlights == [("python", "indented = False", False)]
+    assert b'<span class="kc">False</span>' in outputs["b.html"]
+    assert len(list((project / ".op-cache" / "highlight").glob("*/*.html"))) == 5
+
+
+def test_a_damaged_cache_is_written_again(tmp_path, highlights):
+    project = write_files(tmp_path, PAGES)
+    expected = build(project, cache=True)
+    directory = project / ".op-cache" / "highlight"
+    for path in directory.glob("*/*.html"):
+        path.unlink()
+    highlights.clear()
+    assert build(project, cache=True) == expected
+    assert len(highlights) == 4
+    assert len(list(directory.glob("*/*.html"))) == 4
+    assert not list(directory.glob("*/*.tmp"))
@@ -0,0 +1,30 @@
+from original_posting import codegen
+from tests.utils import build, copy_fixture
+import pytest
+
+
+def test_compiled_build_matches_interpreted(tmp_path):
+    project = copy_fixture("site", tmp_path)
+    expected = build(project)
+    assert build(project, compile=True) == expected
+
+
+def test_bytecode_is_reused(tmp_path, monkeypatch):
+    project = copy_fixture("site", tmp_path)
+    expected = build(project, compile=True)
+    assert list((project / ".op-cache" / "compiled").glob("*.bin"))
+
+    def generate(*args):
+        raise AssertionError("the cached bytecode should be used")
+
+    monkeypatch.setattr(codegen, "generate", generate)
+    assert build(project, compile=True) == expected
+
+
+def test_bytecode_of_a_changed_source_is_not_reused(tmp_path):
+    project = copy_fixture("site", tmp_path)
+    build(project, compile=True)
+    index = project / "index.op"
+    index.write_text(index.read_text().replace("Index of", "Contents of"))
+    outputs = build(project, compile=True)
+    assert b"Contents of Demo" in outputs["index.html"]
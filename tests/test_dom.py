@@ -0,0 +1,83 @@
+from original_posting.build import Build, BuildOptions
+from original_posting.dom import get_dom, h1_text, run_callbacks, uses_dom
+from original_posting.types import OPDocument
+from tests.utils import copy_fixture, run_op
+import pytest
+
+
+def make_doc(tmp_path, code: str) -> OPDocument:
+    doc = OPDocument("t.op", tmp_path, tmp_path / "t.op", tmp_path, tmp_path / "t.html", {})
+    doc.code = code
+    return doc
+
+
+@uses_dom
+def add_class(doc: OPDocument):
+    for p in get_dom(doc).find_all("p"):
+        p["class"] = "x"
+
+
+@uses_dom
+def add_id(doc: OPDocument):
+    for p in get_dom(doc).find_all("p"):
+        p["id"] = "y"
+
+
+def append_script(doc: OPDocument):
+    doc.code += "<script></script>"
+
+
+def test_callbacks_share_one_parse(tmp_path):
+    doc = make_doc(tmp_path, "<p>a</p><p>b</p>")
+    doc.callbacks = [add_class, add_id]
+    dom = run_callbacks(doc)
+    assert (dom.parses, dom.serializations) == (1, 1)
+    assert doc.code == '<p class="x" id="y">a</p><p class="x" id="y">b</p>'
+    assert doc.dom is None
+
+
+def test_string_callbacks_see_the_changes_before_them(tmp_path):
+    doc = make_doc(tmp_path, "<p>a</p>")
+    doc.callbacks = [add_class, append_script, add_id]
+    dom = run_callbacks(doc)
+    assert (dom.parses, dom.serializations) == (2, 2)
+    assert doc.code == '<p class="x" id="y">a</p><script></script>'
+
+
+def test_no_parse_without_dom_callbacks(tmp_path):
+    doc = make_doc(tmp_path, "<p>a</p>")
+    doc.callbacks = [append_script]
+    dom = run_callbacks(doc)
+    assert (dom.parses, dom.serializations) == (0, 0)
+
+
+def test_dom_is_only_available_to_callbacks(tmp_path):
+    with pytest.raises(RuntimeError):
+        get_dom(make_doc(tmp_path, ""))
+
+
+def test_h1_text():
+    assert h1_text('<p>x</p><h1 id="t">A <em>b</em> &amp; c</h1><h1>d</h1>') == "A b & c"
+    assert h1_text("<h10>no</h10>") is None
+
+
+def test_site_dom_counts(tmp_path, monkeypatch):
+    project = copy_fixture("site", tmp_path)
+    monkeypatch.chdir(project)
+    opts = BuildOptions(force=True, suffix=".html", outdir="out")
+    build = Build(project, [str(project / "index.op")], opts)
+    build.build_all()
+    # the index has 4 callbacks on the DOM: one parse for the table of
+    # contents and the filter indices, another for the highlighted code after
+    # the string callbacks of the footnotes
+    assert build.dom_counts == {
+        "index.op": (2, 2),
+        "posts/a.op": (0, 0),
+        "posts/b.op": (1, 1),
+        "parts/c.op": (0, 0),
+        "parts/d.op": (1, 1),
+    }
+
+    report = run_op(project, "index.op", "--force", "--dom_report").stderr.splitlines()
+    assert report[0].split() == ["parses", "serializations", "document"]
+    assert ["2", "2", "index.op"] in [line.split() for line in report]
@@ -0,0 +1,175 @@
+from original_posting.parsing import get_command_entry
+from original_posting.ptag_dsl import match_any_tag
+from tests.utils import build, write_files
+from collections import ChainMap
+import json
+import re
+import sys
+import pytest
+
+TAGS = {
+    "a.op": ['post("rust")', "lang(en)"],
+    "b.op": ['post("go")', "draft(1)"],
+    "c.op": ['post("rust")', "lang(fr)"],
+    "d.op": ["lang(de)"],
+}
+
+INDEX = """\
+@ptag-filter-index|post(_)|
+@begin ptag-filter-index
+post(~x)
+P[x != "go"]
+@end ptag-filter-index
+@ptag-filter-index|lang(en) or lang(fr) or draft(_)|
+@ptag-filter-index|nothing(_)|
+@include|a.op|
+@include|b.op|
+@include|c.op|
+@include|d.op|
+@include|e.op|
+"""
+
+
+def project_files(filters_in_e: str = '@ptag-filter-index|lang(_)|\n') -> dict[str, str]:
+    files = {
+        name: "".join(f"@ptag-set|{tag}|\n" for tag in tags) + f"<h1>{name[0].upper()}</h1>\n"
+        for name, tags in TAGS.items()
+    }
+    files["e.op"] = "<h1>E</h1>\n" + filters_in_e
+    files["index.op"] = INDEX
+    return files
+
+
+def lists(code: bytes) -> list[list[str]]:
+    return [
+        # the hrefs go through the output directory, see `FilterIndex.entries`
+        re.findall(r'<a href="(?:\.\./out/)?([^"]*)">', each)
+        for each in re.findall(r'<ul id="[^"]*">(.*?)</ul>', code.decode("utf-8"))
+    ]
+
+
+@pytest.fixture
+def sweeps(monkeypatch):
+    """The arguments and results of every call to `match_batch` by the filters."""
+    module = sys.modules[get_command_entry("ptag-filter-index").__module__]
+    match_batch = module.match_batch
+    calls = []
+
+    def counting_match_batch(queries, docs):
+        queries, docs = list(queries), list(docs)
+        results = match_batch(queries, docs)
+        calls.append((queries, docs, results))
+        return results
+
+    monkeypatch.setattr(module, "match_batch", counting_match_batch)
+    return calls
+
+
+def test_the_queries_of_a_build_are_swept_once(tmp_path, sweeps):
+    outputs = build(write_files(tmp_path, project_files()))
+    assert lists(outputs["index.html"]) == [
+        ["a.html", "b.html", "c.html"],
+        ["a.html", "c.html"],
+        ["a.html", "b.html", "c.html"],
+        [],
+    ]
+    assert lists(outputs["e.html"]) == [["a.html", "c.html", "d.html"]]
+    # the five filters of index.op and e.op
+    [(queries, docs, results)] = sweeps
+    assert len(queries) == 5
+    assert [doc.project_based_path for doc in docs] == ["index.op", "a.op", "b.op", "c.op", "d.op", "e.op"]
+    for (pattern, scope), result in zip(queries, results):
+        assert result == [doc for doc in docs if match_any_tag(pattern, doc.tags, ChainMap({}, scope.maps[1]))]
+
+
+@pytest.mark.parametrize("options", [{"incremental": True}, {"jobs": 2}])
+def test_the_sweep_matches_a_plain_build(tmp_path, sweeps, options):
+    files = project_files()
+    expected = build(write_files(tmp_path / "plain", files))
+    assert build(write_files(tmp_path / "other", files), **options) == expected
+    assert len(sweeps) == 2
+
+
+def test_documents_without_filters_make_no_sweep(tmp_path, sweeps):
+    files = project_files(filters_in_e="")
+    files["index.op"] = "".join(f"@include|{name}|\n" for name in TAGS)
+    build(write_files(tmp_path, files))
+    assert sweeps == []
+
+
+def paged_files(n: int, options: str) -> dict[str, str]:
+    files = {f"p{i}.op": f"@ptag-set|post({i})|\n<h1>Post {i}</h1>\n" for i in range(n)}
+    files["index.op"] = f"@begin ptag-filter-index {options}\npost(_)\n@end ptag-filter-index\n" + "".join(
+        f"@include|{name}|\n" for name in files
+    )
+    return files
+
+
+def titles(code: bytes) -> list[str]:
+    return re.findall(r'<li><a href="[^"]*">([^<]*)</a></li>', code.decode("utf-8"))
+
+
+def test_pages_and_shards(tmp_path):
+    project = write_files(tmp_path, paged_files(7, "--page_size 3 --sort path --json"))
+    outputs = build(project)
+    pages = "index.filtered-index_0/"
+    assert sorted(outputs) == sorted(
+        [f"p{i}.html" for i in range(7)]
+        + ["index.html", pages + "index-2.html", pages + "index-3.html"]
+        + [pages + f"index-{n}.json" for n in (1, 2, 3)]
+    )
+    assert titles(outputs["index.html"]) == ["Post 0", "Post 1", "Post 2"]
+    assert titles(outputs[pages + "index-2.html"]) == ["Post 3", "Post 4", "Post 5"]
+    assert titles(outputs[pages + "index-3.html"]) == ["Post 6"]
+    assert b'data-pages="3" data-shards="index.filtered-index_0"' in outputs["index.html"]
+    assert b"<span>1 / 3</span>" in outputs["index.html"]
+    assert b'<a href="../index.html">first</a>' in outputs[pages + "index-3.html"]
+    assert b"<span>next</span> <span>last</span>" in outputs[pages + "index-3.html"]
+
+    shards = [json.loads(outputs[pages + f"index-{n}.json"]) for n in (1, 2, 3)]
+    assert [(each["page"], each["next"]) for each in shards] == [(1, 2), (2, 3), (3, None)]
+    assert shards[2]["items"] == [{"title": "Post 6", "href": "../out/p6.html", "path": "p6.op"}]
+    assert [item["path"] for each in shards for item in each["items"]] == [f"p{i}.op" for i in range(7)]
+
+    # every link of every page leads to a page built
+    out = project / "out"
+    for name, code in outputs.items():
+        if name.endswith(".html"):
+            for href in re.findall(r'href="([^"]*)"', code.decode("utf-8")):
+                assert ((out / name).parent / href).resolve().is_file(), (name, href)
+
+
+def test_sorted_pages(tmp_path):
+    files = paged_files(5, "--page_size 2 --sort title --reverse")
+    files["p2.op"] = "@ptag-set|post(2)|\n<h1>A first</h1>\n"
+    outputs = build(write_files(tmp_path, files))
+    pages = "index.filtered-index_0/"
+    assert titles(outputs["index.html"]) == ["Post 4", "Post 3"]
+    assert titles(outputs[pages + "index-2.html"]) == ["Post 1", "Post 0"]
+    assert titles(outputs[pages + "index-3.html"]) == ["A first"]
+    assert not any(name.endswith(".json") for name in outputs)
+
+
+def test_one_page(tmp_path):
+    outputs = build(write_files(tmp_path, paged_files(3, "--json")))
+    assert titles(outputs["index.html"]) == ["Post 0", "Post 1", "Post 2"]
+    assert b"filtered-index-pages" not in outputs["index.html"]
+    shard = json.loads(outputs["index.filtered-index_0/index-1.json"])
+    assert (shard["page"], shard["next"], len(shard["items"])) == (1, None, 3)
+
+
+def test_a_new_document_rewrites_the_last_pages_only(tmp_path):
+    files = paged_files(7, "--page_size 3 --sort path --json")
+    project = write_files(tmp_path, files)
+    build(project, incremental=True)
+    out = project / "out"
+    pages = out / "index.filtered-index_0"
+    kept = [out / "index.html", pages / "index-2.html", pages / "index-1.json", pages / "index-2.json"]
+    before = [path.stat().st_mtime_ns for path in kept]
+
+    new = paged_files(8, "--page_size 3 --sort path --json")
+    write_files(project, {"p7.op": new["p7.op"], "index.op": new["index.op"]})
+    outputs = build(project, incremental=True)
+    assert [path.stat().st_mtime_ns for path in kept] == before
+    assert titles(outputs["index.filtered-index_0/index-3.html"]) == ["Post 6", "Post 7"]
+    assert outputs == build(write_files(tmp_path / "fresh", new))
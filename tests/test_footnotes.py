@@ -0,0 +1,137 @@
+from original_posting import dom
+from original_posting.parsing import process
+from original_posting.dom import run_callbacks
+from original_posting.types import OPDocument
+from xml.sax.saxutils import escape
+import bs4
+import random
+import pytest
+
+TITLES = ["r1", "r-2", "a&b", "été", "x<y"]
+TEXTS = ["plain", "<b>bold</b> text", "a &amp; b", "<i>x</i><br/>y", ""]
+
+
+def reference_footnotes(code: str, footnotes: list[tuple[str, str]]) -> str:
+    """The former '@footnote' callback, building the list with one soup per footnote."""
+    factory = bs4.BeautifulSoup("", "html.parser")
+    hr = factory.new_tag("hr")
+    h2 = factory.new_tag("h2")
+    h2.append("脚注")
+    ol = factory.new_tag("ol")
+    for title, content in footnotes:
+        li = factory.new_tag("li")
+        li.append(escape(title))
+        li.append(":")
+        li.attrs["id"] = title
+        li.contents.append(factory.new_tag("p"))
+        p = factory.new_tag("p")
+        div = bs4.BeautifulSoup("<div>" + content + "</div>", "html.parser").contents[0]
+        p.contents.extend(div.contents)  # type: ignore
+        li.contents.append(p)
+        ol.contents.append(li)
+    return code + "\n" + str(hr) + "\n" + str(h2) + "\n" + str(ol)
+
+
+def reference_refs(code: str, refs: dict[str, str]) -> str:
+    """The former '@ref' callback, parsing the page and the list."""
+    factory = bs4.BeautifulSoup("", "html.parser")
+    html = bs4.BeautifulSoup(code, "html.parser")
+    ol = factory.new_tag("ol")
+    order: dict[str, int] = {}
+    for i, (title, content) in enumerate(refs.items()):
+        order[title] = i + 1
+        li = factory.new_tag("li")
+        li.attrs["id"] = title
+        p = factory.new_tag("p")
+        div = bs4.BeautifulSoup("<div>" + content + "<div>", "html.parser").contents[0]
+        p.contents.extend(div.contents)  # type: ignore
+        li.contents.append(p)
+        ol.contents.append(li)
+    ol = bs4.BeautifulSoup(str(ol), "html.parser")
+    for tag in ol, html:
+        for each in tag.find_all("a", attrs={"unsolved-kind": "rfootnote-ref"}):
+            del each.attrs["unsolved-kind"]
+            i = order.get(each.attrs["href"][1:])
+            if i:
+                each.append(f"[{i}]")
+    for each in html.find_all("div", attrs={"unsolved-kind": "rfootnote-mk"}):
+        del each.attrs["unsolved-kind"]
+        each.contents.append(ol)
+    return str(html)
+
+
+def random_source(rand: random.Random) -> str:
+    parts = []
+    for _ in range(rand.randint(1, 12)):
+        r = rand.random()
+        text = rand.choice(TEXTS)
+        title = rand.choice(TITLES)
+        if r < 0.35:
+            parts.append(f"<p>{text} @footnote|{title}: {text}|</p>")
+        elif r < 0.55:
+            parts.append(f"@begin ref {title}\n{text} @ref|use {rand.choice(TITLES)}|\n@end ref")
+        elif r < 0.8:
+            parts.append(f"<p>see @ref|use {title}|</p>")
+        elif r < 0.9:
+            parts.append("<div>@ref|mk|</div>")
+        else:
+            parts.append(f"<p>{text}</p>")
+    return "\n".join(parts) + "\n"
+
+
+def render(tmp_path, source: str) -> OPDocument:
+    doc = OPDocument("t.op", tmp_path, tmp_path / "t.op", tmp_path, tmp_path / "t.html", {})
+    doc.code = process("t.op", source, {}, doc)
+    return doc
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_numbering_and_ids_match_the_reference(tmp_path, seed):
+    doc = render(tmp_path, random_source(random.Random(seed)))
+    expected = doc.code
+    # the commands keep their entries under their classes
+    entries = {getattr(k, "__name__", k): v for k, v in doc.data.items()}
+    for callback in doc.callbacks:
+        if callback.__qualname__ == "FootNoteCmd.callback":
+            expected = reference_footnotes(expected, entries["FootNoteCmd"])
+        else:
+            assert callback.__qualname__ == "RFootNoteCmd.callback"
+            expected = reference_refs(expected, entries["RFootNoteCmd"])
+    run_callbacks(doc)
+    assert doc.code == expected
+
+
+def test_pages_are_serialized_as_before(tmp_path):
+    source = (
+        "<p class='x'>a<br>b &#39; c</p>\n\n\n<p>see @ref|use r|</p>\n"
+        "@begin ref r\nnote\n@end ref\n<div>@ref|mk|</div>\n"
+    )
+    doc = render(tmp_path, source)
+    [refs] = doc.data.values()
+    expected = reference_refs(doc.code, refs)
+    run_callbacks(doc)
+    # bs4 closes the void tags, quotes the attributes, decodes the entities
+    # and collapses the blank lines, though no other callback parses the page
+    assert doc.code == expected
+    assert '<p class="x">a<br/>b \' c</p>\n<p>' in doc.code
+
+
+def test_many_footnotes_parse_once(tmp_path, monkeypatch):
+    source = "".join(
+        f"<p>@footnote|n{i}: <b>{i}</b>| @ref|use r{i}|</p>\n@begin ref r{i}\n<i>{i}</i>\n@end ref\n"
+        for i in range(500)
+    ) + "@ref|mk|\n"
+    doc = render(tmp_path, source)
+    parses = []
+    make_soup = dom.make_soup
+
+    def counting_make_soup(markup: str):
+        parses.append(markup)
+        return make_soup(markup)
+
+    monkeypatch.setattr(dom, "make_soup", counting_make_soup)
+    run_callbacks(doc)
+    # one for the list of each of '@footnote' and '@ref', and one for the page
+    assert len(parses) == 3
+    assert doc.code.count('<li id="n') == 500
+    assert '<a href="#r499">[500]</a>' in doc.code
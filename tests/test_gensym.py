@@ -0,0 +1,42 @@
+from original_posting.types import OPDocument
+from original_posting.utils import doc_gensym, global_gensym, reset_gensym
+from tests.utils import build, write_files
+
+PAGE = """\
+@toc|--depth 2|
+@begin md
+# {name}
+## Part
+text
+@end md
+@begin code --lang python
+x = 1
+@end code
+@ptag-set|post("{name}")|
+"""
+
+
+def test_doc_gensym_is_per_document(tmp_path):
+    a = OPDocument("a.op", tmp_path, tmp_path / "a.op", tmp_path, tmp_path / "a.html", {})
+    b = OPDocument("b.op", tmp_path, tmp_path / "b.op", tmp_path, tmp_path / "b.html", {})
+    global_gensym("x")
+    assert [doc_gensym(a, "x"), doc_gensym(b, "x"), doc_gensym(a, "y")] == ["x_0", "x_0", "y_1"]
+    reset_gensym()
+    assert global_gensym("x") == "x_0"
+
+
+def test_pages_do_not_depend_on_the_build_order(tmp_path):
+    pages = {name + ".op": PAGE.format(name=name) for name in "abc"}
+    first = build(
+        write_files(tmp_path / "1", {**pages, "index.op": "@include|a.op|\n@include|b.op|\n"}),
+    )
+    # another index, more documents before, and another order
+    second = build(
+        write_files(
+            tmp_path / "2",
+            {**pages, "index.op": "@toc\n# I\n@include|c.op|\n@include|b.op|\n@include|a.op|\n"},
+        )
+    )
+    assert first["a.html"] == second["a.html"]
+    assert first["b.html"] == second["b.html"]
+    assert b'refid="ccc_0"' in first["a.html"]
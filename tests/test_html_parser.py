@@ -0,0 +1,95 @@
+from original_posting.dom import get_dom, html_factory, make_soup, parse_fragment, run_callbacks, uses_dom
+from original_posting.types import OPDocument, Runtime
+from tests.utils import build, copy_fixture, write_files
+import pytest
+
+pytest.importorskip("lxml")
+
+PARSERS = ["html.parser", "lxml"]
+
+
+@pytest.fixture(params=PARSERS)
+def parser(request, monkeypatch) -> str:
+    monkeypatch.setattr(Runtime, "html_parser", request.param)
+    return request.param
+
+
+@uses_dom
+def mark_paragraphs(doc: OPDocument):
+    for p in get_dom(doc).find_all("p"):
+        p["class"] = "x"
+
+
+def append_footer(doc: OPDocument):
+    doc.code += "<footer>f</footer>"
+
+
+def test_fragments_parse_alike(parser):
+    markup = "<li>a &amp; <b>b</b></li><li>c</li>"
+    assert parse_fragment(markup).decode_contents() == markup
+
+
+def append_paragraph(doc: OPDocument):
+    doc.code += "<p>b</p>"
+
+
+def make_doc(tmp_path, code: str) -> OPDocument:
+    doc = OPDocument("t.op", tmp_path, tmp_path / "t.op", tmp_path, tmp_path / "t.html", {})
+    doc.code = code
+    return doc
+
+
+def test_pages_are_not_wrapped(tmp_path, parser):
+    doc = make_doc(tmp_path, "<style>s</style><p>a</p>")
+    doc.callbacks = [mark_paragraphs, append_footer, append_paragraph, mark_paragraphs]
+    run_callbacks(doc)
+    assert doc.code == '<style>s</style><p class="x">a</p><footer>f</footer><p class="x">b</p>'
+
+
+def test_whole_pages_are_kept(tmp_path, parser):
+    doc = make_doc(tmp_path, "<html><head><title>t</title></head><body><p>a</p></body></html>")
+    doc.callbacks = [mark_paragraphs]
+    run_callbacks(doc)
+    assert doc.code == '<html><head><title>t</title></head><body><p class="x">a</p></body></html>'
+
+
+def normalize(code: bytes):
+    return make_soup(code.decode("utf-8")).prettify()
+
+
+def test_site_is_the_same_with_lxml(tmp_path, monkeypatch):
+    project = copy_fixture("site", tmp_path)
+    expected = build(project)
+    monkeypatch.setattr(Runtime, "html_parser", "lxml")
+    outputs = build(project)
+    assert outputs.keys() == expected.keys()
+    for name in outputs:
+        if name.endswith(".html"):
+            assert normalize(outputs[name]) == normalize(expected[name]), name
+
+
+PAGES = {
+    "index.op": "@include|a.op|\n",
+    # lxml closes the <p> before the <div>, when '@ref' parses the page
+    "a.op": "<p>a<div>b</div></p>\n<p>@ref|use r|</p>\n@begin ref r\nnote\n@end ref\n@ref|mk|\n",
+}
+SETTING = '@begin py\n__import__("original_posting").Runtime.html_parser = "lxml"\n@end py\n'
+
+
+@pytest.mark.parametrize("options", [{}, {"incremental": True}, {"jobs": 2}])
+def test_projects_select_the_parser(tmp_path, monkeypatch, options):
+    # restored after the build sets it
+    monkeypatch.setattr(Runtime, "html_parser", "html.parser")
+    plain = build(write_files(tmp_path / "plain", PAGES))
+    project = write_files(tmp_path / "set", {**PAGES, "index.op": SETTING + PAGES["index.op"]})
+    outputs = build(project, **options)
+    assert Runtime.html_parser == "lxml"
+    assert html_factory().builder.NAME == "lxml"
+    assert b"<p>a</p><div>b</div>" in outputs["a.html"]
+    assert b"<p>a<div>b</div></p>" in plain["a.html"]
+
+    monkeypatch.setattr(Runtime, "html_parser", "lxml")
+    assert build(write_files(tmp_path / "lxml", PAGES))["a.html"] == outputs["a.html"]
+    if options.get("incremental"):
+        Runtime.html_parser = "html.parser"
+        assert build(project, **options) == outputs
@@ -0,0 +1,138 @@
+from original_posting.build import CACHE_DIRNAME
+from original_posting.incremental import IncrementalState
+from tests.utils import build, copy_fixture, read_outputs, run_op, write_files
+import pathlib
+import pytest
+import shutil
+
+
+def edit(path: pathlib.Path, old: str, new: str):
+    text = path.read_text(encoding="utf-8")
+    assert old in text
+    path.write_text(text.replace(old, new), encoding="utf-8")
+
+
+def fresh_build(project: pathlib.Path, **options) -> dict[str, bytes]:
+    shutil.rmtree(project / CACHE_DIRNAME, ignore_errors=True)
+    shutil.rmtree(project / "out", ignore_errors=True)
+    return build(project, **options)
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        dict(cache=True),
+        dict(compile=True),
+        dict(incremental=True),
+        dict(jobs=3),
+        dict(incremental=True, jobs=3),
+        dict(incremental=True, compile=True, jobs=2),
+    ],
+)
+def test_modes_match_a_plain_build(tmp_path, options):
+    project = copy_fixture("site", tmp_path)
+    expected = build(project)
+    assert fresh_build(project, **options) == expected
+    # again, from what the first build kept
+    assert build(project, **options) == expected
+
+
+@pytest.mark.parametrize(
+    "file, old, new",
+    [
+        ("posts/b.op", "Post B", "Post B, edited"),
+        # read by the other documents through the shared Python scope
+        ("index.op", 'site_name = "Demo"', 'site_name = "Edited"'),
+        ("parts/c.op", "@py|1 + 2|", "@py|3 + 4|"),
+    ],
+)
+def test_edit_then_rebuild_matches_a_fresh_build(tmp_path, file, old, new):
+    project = copy_fixture("site", tmp_path)
+    build(project, incremental=True)
+    edit(project / file, old, new)
+    outputs = build(project, incremental=True)
+    assert outputs == fresh_build(project)
+
+
+def test_defining_docs_are_kept_apart(tmp_path):
+    project = copy_fixture("site", tmp_path)
+    build(project, incremental=True)
+    state = IncrementalState(project / CACHE_DIRNAME)
+    try:
+        # index.op binds names in the Python scope
+        assert str(project / "index.op") in state.defining_docs
+        assert str(project / "posts" / "b.op") not in state.defining_docs
+        assert (state.storage_changed, state.runtime_changed) == (False, False)
+    finally:
+        state.close()
+
+
+SCOPE_PAGES = {
+    "index.op": "@include|a.op|\n@include|m.op|\n@include|r.op|\n",
+    "a.op": "@begin py\nD = {}\n@end py\n",
+    "m.op": '@begin py\nD["k"] = "v1"\n@end py\n',
+    "n.op": '@begin py\nD["n"] = 1\n@end py\n',
+    "r.op": 'val @py|D.get("k")| @py|D.get("n")|\n',
+}
+
+
+def test_changes_in_place_are_tracked(tmp_path):
+    project = write_files(tmp_path, SCOPE_PAGES)
+    assert build(project, incremental=True)["r.html"] == b"val v1 None\n"
+    edit(project / "m.op", "v1", "v2")
+    assert build(project, incremental=True)["r.html"] == b"val v2 None\n"
+    # and m.op is rendered again, as it defines D["k"]
+    assert build(project, incremental=True)["r.html"] == b"val v2 None\n"
+
+
+def test_included_defining_docs_are_tracked(tmp_path):
+    project = write_files(tmp_path, SCOPE_PAGES)
+    build(project, incremental=True)
+    edit(project / "index.op", "@include|r.op|", "@include|n.op|\n@include|r.op|")
+    assert build(project, incremental=True)["r.html"] == b"val v1 1\n"
+    edit(project / "index.op", "@include|m.op|\n", "")
+    outputs = build(project, incremental=True)
+    assert outputs["r.html"] == b"val None 1\n"
+    assert outputs.pop("m.html") == b""  # left from before
+    assert outputs == fresh_build(project, incremental=True)
+
+
+def test_removed_defining_docs_are_forgotten(tmp_path, monkeypatch):
+    project = write_files(tmp_path, SCOPE_PAGES)
+    build(project, incremental=True)
+    write_files(project, {"index.op": "@include|r.op|\n", "r.op": "val @py|1 + 1|\n"})
+    (project / "a.op").unlink()
+    (project / "m.op").unlink()
+    assert build(project, incremental=True)["r.html"] == b"val 2\n"
+    state = IncrementalState(project / CACHE_DIRNAME)
+    try:
+        assert state.defining_docs == {}
+        assert (state.storage_changed, state.runtime_changed) == (False, False)
+    finally:
+        state.close()
+
+    from original_posting.build import Build
+
+    rendered = []
+    render = Build._render
+    monkeypatch.setattr(Build, "_render", lambda self, doc: rendered.append(doc) or render(self, doc))
+    build(project, incremental=True)
+    assert [doc.project_based_path for doc in rendered] == []
+
+
+def test_runtime_changes_are_tracked(tmp_path):
+    # in new processes, as the documents change `Runtime`
+    project = copy_fixture("runtime", tmp_path)
+    run_op(project, "index.op", "--force", "--incremental")
+    assert (project / "out" / "a.html").read_text() == "A says <b>hello</b>\n"
+
+    edit(project / "index.op", '"<b>"', '"<i>"')
+    edit(project / "index.op", '"</b>"', '"</i>"')
+    run_op(project, "index.op", "--force", "--incremental")
+    outputs = read_outputs(project / "out")
+    assert outputs["a.html"] == b"A says <i>hello</i>\n"
+
+    shutil.rmtree(project / CACHE_DIRNAME)
+    shutil.rmtree(project / "out")
+    run_op(project, "index.op", "--force")
+    assert read_outputs(project / "out") == outputs
@@ -0,0 +1,97 @@
+from original_posting.build import CACHE_DIRNAME
+from original_posting.metadata import METADATA_FILENAME, MetadataStore, query
+from original_posting.ptag_dsl import string_to_pattern
+from tests.utils import build, run_op, write_files
+import subprocess
+import pytest
+
+FILES = {
+    "index.op": "@ptag-filter-index|post(_)|\n@include|a.op|\n@include|b.op|\n@include|c.op|\n",
+    "a.op": '@ptag-set|post("rust")|\n@ptag-set|lang(en)|\n<h1>A</h1>\n',
+    "b.op": '@ptag-set|post("go")|\n<h1>B</h1>\n',
+    "c.op": "@ptag-set|draft(1)|\n<h1>C</h1>\n",
+}
+
+
+def store_path(project):
+    return project / CACHE_DIRNAME / METADATA_FILENAME
+
+
+def queried(project, pattern: str) -> list[str]:
+    return [each.path for each in query(store_path(project), pattern)]
+
+
+def test_plain_builds_keep_no_store(tmp_path):
+    project = write_files(tmp_path, FILES)
+    build(project)
+    assert not (project / CACHE_DIRNAME).exists()
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        run_op(project, "query", "post(_)")
+    assert "does not exist" in e.value.stderr
+    # the options making a store
+    assert "--cache, --compile, --incremental or --search_index" in e.value.stderr
+
+
+@pytest.mark.parametrize("option", ["cache", "compile", "incremental", "search_index"])
+def test_builds_using_the_cache_keep_the_store(tmp_path, option):
+    project = write_files(tmp_path, FILES)
+    build(project, **{option: True})
+    assert queried(project, "post(_)") == ["a.op", "b.op"]
+
+
+def test_op_query(tmp_path):
+    project = write_files(tmp_path, FILES)
+    run_op(project, "index.op", "--out", "out", "--force", "--incremental")
+    lines = run_op(project, "query", 'post("rust")').stdout.splitlines()
+    assert lines == [f"a.op\tA\t{project / 'out' / 'a.html'}"]
+    other = tmp_path.parent
+    lines = run_op(other, "query", "post(~x) and P[x != 'rust']", "--project_path", str(project))
+    assert [line.split("\t")[:2] for line in lines.stdout.splitlines()] == [["b.op", "B"]]
+
+
+def test_queries_load_only_the_candidates(tmp_path):
+    project = write_files(tmp_path, FILES)
+    build(project, incremental=True)
+    store = MetadataStore(store_path(project), readonly=True)
+    try:
+        paths = lambda source: [each.path for each in store.candidates(string_to_pattern(source))]
+        assert paths('post("go")') == ["b.op"]
+        assert paths("post(_) or draft(_)") == ["a.op", "b.op", "c.op"]
+        assert paths("lang(_) and post(_)") == ["a.op"]
+        # predicates see every document
+        assert paths("P[_ is not None]") == ["a.op", "b.op", "c.op", "index.op"]
+    finally:
+        store.close()
+    assert queried(project, "draft(True)") == ["c.op"]
+    assert queried(project, "lang(en) and P[True]") == ["a.op"]
+
+
+def test_unchanged_outputs_are_not_rewritten(tmp_path):
+    project = write_files(tmp_path, FILES)
+    build(project, incremental=True)
+    out = project / "out"
+    before = {name: (out / name).stat().st_mtime_ns for name in ["index.html", "a.html", "b.html"]}
+    # the tags of c change, not its output, nor the documents listed
+    write_files(project, {"c.op": "@ptag-set|draft(2)|\n<h1>C</h1>\n"})
+    build(project, incremental=True)
+    assert {name: (out / name).stat().st_mtime_ns for name in before} == before
+    assert queried(project, "draft(2)") == ["c.op"]
+
+    write_files(project, {"c.op": '@ptag-set|post("c")|\n<h1>C</h1>\n'})
+    build(project, incremental=True)
+    assert b"c.html" in (out / "index.html").read_bytes()
+    assert (out / "a.html").stat().st_mtime_ns == before["a.html"]
+
+    # an output changed on disk is written again
+    (out / "a.html").write_text("edited")
+    build(project, incremental=True)
+    assert b"<h1>A</h1>" in (out / "a.html").read_bytes()
+
+
+def test_removed_documents_are_forgotten(tmp_path):
+    project = write_files(tmp_path, FILES)
+    build(project, incremental=True)
+    (project / "b.op").unlink()
+    write_files(project, {"index.op": FILES["index.op"].replace("@include|b.op|\n", "")})
+    build(project, incremental=True)
+    assert queried(project, "post(_)") == ["a.op"]
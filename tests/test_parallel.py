@@ -0,0 +1,14 @@
+from tests.utils import copy_fixture, read_outputs, run_op
+import pytest
+
+
+@pytest.mark.parametrize("jobs", ["2", "3"])
+def test_runtime_changes_match_a_serial_build(tmp_path, jobs):
+    # index.op changes `Runtime.operators`, used by the documents it includes
+    project = copy_fixture("runtime", tmp_path)
+    run_op(project, "index.op", "--force")
+    expected = read_outputs(project / "out")
+    assert expected["a.html"] == b"A says <b>hello</b>\n"
+
+    run_op(project, "index.op", "--force", "--jobs", jobs)
+    assert read_outputs(project / "out") == expected
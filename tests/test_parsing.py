@@ -0,0 +1,102 @@
+from original_posting.parsing import new_context_from_existing, process, process_nest
+from original_posting.types import Context, OPDocument, Scope
+import pathlib
+import pytest
+
+
+def make_doc(tmp_path: pathlib.Path) -> OPDocument:
+    return OPDocument(
+        "t.op", tmp_path, tmp_path / "t.op", tmp_path, tmp_path / "t.html", {}
+    )
+
+
+def render(tmp_path: pathlib.Path, source: str) -> str:
+    return process("t.op", source, {}, make_doc(tmp_path))
+
+
+def test_text_runs_operators_and_inline_commands(tmp_path):
+    source = "Mail a@b.c, \\@py|1| and @(x) @[a \\] b] @{c} @py|1 + 2| @py||'|'|| end\\@"
+    assert render(tmp_path, source) == "Mail a@b.c, py|1| and x a \\] b c 3 | end"
+
+
+def test_long_text_without_commands_is_kept(tmp_path):
+    source = "".join(f"line {i} mentions a@{i} and @ alone\n" for i in range(5000))
+    assert render(tmp_path, source) == source
+
+
+@pytest.mark.parametrize(
+    "source, lineno, offset",
+    [
+        ("a\nb @py||1 + 2|\n", 2, 5),
+        ("line\n@begin\nx\n", 2, 12),
+        ("x\n\n  @(a\nb)", 3, 6),
+        ("ok\n@nope|x|\n", 2, 4),
+        ("a\nb\n@py|1/0|\n", 3, 5),
+    ],
+)
+def test_syntax_error_positions(tmp_path, source, lineno, offset):
+    with pytest.raises(SyntaxError) as info:
+        render(tmp_path, source)
+    assert (info.value.filename, info.value.lineno, info.value.offset) == ("t.op", lineno, offset)
+
+
+@pytest.mark.parametrize(
+    "source, expected",
+    [
+        ("a\n@begin comment\n" + "x @py|1/0| y\n" * 3 + "@end comment\nb\n", "a\nb\n"),
+        (
+            "a\n@begin plain\n@foo|x| \\@end plain\n@end other\n@end plain\nb @py|1|\n",
+            "a\n@foo|x| \\@end plain\n@end other\nb 1\n",
+        ),
+        ("a\n@begin plain\nnever closed @py|1|\n", "a\n"),
+        ("@begin plain\n\\@end plain\n@end plain\n", "\\@end plain\n"),
+    ],
+)
+def test_block_ends(tmp_path, source, expected):
+    assert render(tmp_path, source) == expected
+
+
+def test_large_skipped_block(tmp_path):
+    body = "skipped @py|1/0| @(x) text\n" * 40000
+    source = "before\n@begin comment\n" + body + "@end comment\nafter @py|1 + 1|\n"
+    assert render(tmp_path, source) == "before\nafter 2\n"
+
+
+@pytest.mark.parametrize(
+    "source, lineno",
+    [
+        # errors at an '@end' line are reported on that line; before the
+        # line table, they were reported on the line after it
+        ("a\n@begin plain\nq\n@end\n@end plain\n", 4),
+        ("a\n@begin py\nraise ValueError\n@end py\n", 4),
+        ("a\n@begin md\nx\n\ny @py|1/0| z\n@end md\n", 6),
+        ("a\n@begin md\nx\n@begin py\n1/0\n@end py\n@end md\n", 7),
+    ],
+)
+def test_syntax_error_lines_at_block_ends(tmp_path, source, lineno):
+    with pytest.raises(SyntaxError) as info:
+        render(tmp_path, source)
+    assert info.value.lineno == lineno
+    assert info.value.text and info.value.text.startswith("@end")
+
+
+def test_contexts_made_the_old_way(tmp_path):
+    source = "a\n@begin plain\nx @py|1| y\n@end plain\n"
+    ctx = Context(
+        source,
+        len(source),
+        pos=0,
+        line=0,
+        col=0,
+        cur_scope=None,
+        os="unknown",
+        linesep="\n",
+        file="t.op",
+        storage={},
+        target_doc=make_doc(tmp_path),
+    )
+    start = source.index("x")
+    ctx.cur_scope = Scope("plain", None, start, [], 2, 0)  # type: ignore
+    nested = new_context_from_existing(ctx, start, len(source), 2, 0)
+    assert (nested.line, nested.col) == (2, 0)
+    assert process_nest(ctx, start, source.index("@end")) == "x 1 y\n"
@@ -0,0 +1,297 @@
+from original_posting.ptag_dsl import (
+    PTagPatternBuilder,
+    Term,
+    _admits,
+    _anchors,
+    compile_pattern,
+    match_any_tag,
+    match_batch,
+    parse_expr,
+    string_to_pattern,
+    tag_keys,
+)
+from tests.utils import build, write_files
+from collections import ChainMap
+import random
+import types
+import pytest
+
+NAMES = ["a", "b", "post", "draft"]
+
+
+def random_tag(rand: random.Random, depth: int = 0) -> object:
+    k = rand.random()
+    if k < 0.25 or depth > 2:
+        return rand.choice(NAMES)
+    if k < 0.35:
+        return rand.choice([0, 1, 2, True, 1.0])
+    if k < 0.55:
+        args = [random_tag(rand, depth + 1) for _ in range(rand.randint(0, 2))]
+        return Term(rand.choice(NAMES), args)
+    if k < 0.75:
+        args = [random_tag(rand, depth + 1) for _ in range(rand.randint(0, 2))]
+        return {"__func__": rand.choice(NAMES), "__args__": args}
+    return [random_tag(rand, depth + 1) for _ in range(rand.randint(0, 2))]
+
+
+def random_pattern(rand: random.Random, depth: int = 0) -> str:
+    """A pattern without predicates."""
+    k = rand.random() * (0.35 if depth > 2 else 1)
+    if k < 0.15:
+        return rand.choice(NAMES)
+    if k < 0.22:
+        return rand.choice(["0", "1", "2", "True", "1.0"])
+    if k < 0.28:
+        return "_"
+    if k < 0.35:
+        return "~" + rand.choice(["x", "y"])
+    if k < 0.55:
+        func = rand.choice(NAMES + ["(~f)", "_"])
+        args = ", ".join(random_pattern(rand, depth + 1) for _ in range(rand.randint(0, 2)))
+        return f"{func}({args})"
+    if k < 0.65:
+        return "[%s]" % ", ".join(random_pattern(rand, depth + 1) for _ in range(rand.randint(0, 2)))
+    if k < 0.8:
+        return f"({random_pattern(rand, depth + 1)} or {random_pattern(rand, depth + 1)})"
+    if k < 0.95:
+        return f"({random_pattern(rand, depth + 1)} and {random_pattern(rand, depth + 1)})"
+    return f"(not {random_pattern(rand, depth + 1)})"
+
+
+PREDICATES = [
+    "P[x == 1]",
+    "P[len(_) > 1]",
+    "P[isinstance(_, str)]",
+    "P[x]",
+    "P[k(_)]",
+    "P[any(y == 1 for y in [_])]",
+    "P[_ == x, x != 2]",
+    "P[(lambda q: q)(y)]",
+    "P[undefined_name]",
+]
+
+
+def random_any_pattern(rand: random.Random, depth: int = 0) -> str:
+    """A pattern with predicates, dict patterns and star lists too."""
+    k = rand.random() * (0.4 if depth > 3 else 1)
+    if k < 0.1:
+        return rand.choice(NAMES)
+    if k < 0.15:
+        return rand.choice(["0", "1", "True"])
+    if k < 0.2:
+        return "_"
+    if k < 0.3:
+        return "~" + rand.choice(["x", "y", "args"])
+    if k < 0.4:
+        return rand.choice(PREDICATES)
+    if k < 0.55:
+        func = rand.choice(NAMES + ["(~x)", "_"])
+        args = ", ".join(random_any_pattern(rand, depth + 1) for _ in range(rand.randint(0, 2)))
+        return f"{func}({args})"
+    if k < 0.65:
+        elts = [random_any_pattern(rand, depth + 1) for _ in range(rand.randint(0, 3))]
+        if rand.random() < 0.5:
+            elts.insert(rand.randint(0, len(elts)), "*" + random_any_pattern(rand, depth + 1))
+        return "[%s]" % ", ".join(elts)
+    if k < 0.7:
+        a, b = random_any_pattern(rand, depth + 1), random_any_pattern(rand, depth + 1)
+        return f"{{a: {a}, 'b': {b}}}"
+    if k < 0.8:
+        return f"({random_any_pattern(rand, depth + 1)} or {random_any_pattern(rand, depth + 1)})"
+    if k < 0.93:
+        return f"({random_any_pattern(rand, depth + 1)} and {random_any_pattern(rand, depth + 1)})"
+    return f"(not {random_any_pattern(rand, depth + 1)})"
+
+
+def random_any_tag(rand: random.Random) -> object:
+    if rand.random() < 0.15:
+        return {"a": random_tag(rand, 1), "b": random_tag(rand, 1)} if rand.random() < 0.7 else {"a": 1}
+    return random_tag(rand)
+
+
+def outcome(p, tag, scope):
+    try:
+        return bool(p(tag, scope))
+    except Exception as e:
+        return type(e)
+
+
+def test_tag_keys():
+    assert tag_keys("draft") == [("lit", "draft")]
+    assert tag_keys(Term("post", ("rust", [1]))) == [
+        ("arity", 2),
+        ("func", "post", 2),
+        ("arg", "post", 2, 0, "rust"),
+    ]
+    assert tag_keys({"__func__": "post", "__args__": ["rust"]}) == tag_keys(Term("post", ("rust",)))
+    assert tag_keys({"__func__": "post"}) == []
+    assert tag_keys([1]) == []
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matched_tags_have_an_anchor_key(seed):
+    """Pruning the documents by the keys of a pattern never drops a match."""
+    rand = random.Random(seed)
+    tags = [random_tag(rand) for _ in range(300)]
+    for _ in range(100):
+        p = string_to_pattern(random_pattern(rand))
+        anchors = _anchors(p.requirement) if p.pure else None
+        if anchors is None:
+            continue
+        for tag in tags:
+            if p(tag, {}):
+                assert anchors & set(tag_keys(tag)), (p.source, tag)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matched_documents_are_admitted(seed):
+    """The intersections of the keys of a pattern never drop a match either."""
+    rand = random.Random(seed)
+    docs = [[random_tag(rand) for _ in range(rand.randint(0, 3))] for _ in range(100)]
+    for _ in range(100):
+        p = string_to_pattern(random_pattern(rand))
+        for tags in docs:
+            if match_any_tag(p, tags):
+                assert _admits(p.requirement, {key for tag in tags for key in tag_keys(tag)}), (p.source, tags)
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_compiled_patterns_match_the_closures(seed):
+    """Same results, exceptions and captures, sharing the scope across the tags."""
+    rand = random.Random(seed)
+    for _ in range(100):
+        source = random_any_pattern(rand)
+        try:
+            closure = PTagPatternBuilder().visit(parse_expr(source))
+        except (ValueError, SyntaxError, TypeError):
+            continue
+        compiled = compile_pattern(parse_expr(source))
+        user = {"k": lambda v: v == "a", "y": "a"}
+        closure_scope, compiled_scope = ChainMap({}, dict(user)), ChainMap({}, dict(user))
+        for _ in range(15):
+            tag = random_any_tag(rand)
+            expected = outcome(closure, tag, closure_scope)
+            assert outcome(compiled, tag, compiled_scope) == expected, (source, tag)
+            assert compiled_scope.maps[0] == closure_scope.maps[0], (source, tag)
+
+
+def test_tuple_predicates_compile_anywhere():
+    p = string_to_pattern("post(~x) and P[x > 1, x < 5]")
+    assert [p(Term("post", (n,)), {}) for n in (1, 3, 5)] == [False, True, False]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_match_batch_matches_each_query(seed):
+    rand = random.Random(seed)
+    docs = [
+        types.SimpleNamespace(tags=[random_tag(rand) for _ in range(rand.randint(0, 3))])
+        for _ in range(50)
+    ]
+    patterns = [string_to_pattern(random_pattern(rand)) for _ in range(20)]
+    patterns.append(string_to_pattern("post(~x) and P[x == 'a']"))
+    expected = [
+        [doc for doc in docs if match_any_tag(p, doc.tags, ChainMap({}, {}))] for p in patterns
+    ]
+    assert match_batch([(p, ChainMap({}, {})) for p in patterns], docs) == expected
+
+
+def test_match_batch_intersects_the_keys_of_and():
+    docs = [
+        types.SimpleNamespace(name=name, tags=tags)
+        for name, tags in [
+            ("a", [Term("post", ("rust",)), Term("lang", ("en",))]),
+            ("b", [Term("post", ("go",))]),
+            ("c", [Term("lang", ("fr",))]),
+            ("d", ["draft"]),
+        ]
+    ]
+    tried = []
+
+    def counted(source):
+        p = string_to_pattern(source)
+
+        def apply(o, scope):
+            tried.append((source, o))
+            return p(o, scope)
+
+        apply.requirement, apply.pure = p.requirement, p.pure
+        return apply
+
+    # one tag is never both, but only a has the keys of both sides
+    queries = [(counted(source), ChainMap({}, {})) for source in ["post(_) and lang(_)", "post(_) or draft"]]
+    results = match_batch(queries, docs)
+    assert [[doc.name for doc in result] for result in results] == [[], ["a", "b", "d"]]
+    assert {o for (source, o) in tried if source == "post(_) and lang(_)"} == set(docs[0].tags)
+
+
+def test_terms_are_interned_by_value_and_type():
+    assert Term("a", ("x", 1)) is Term("a", ["x", 1])
+    assert Term("a", (Term("b", (1,)),)) is Term("a", (Term("b", (1,)),))
+    distinct = [
+        Term("a", (Term("b", (1,)),)),
+        Term("a", (Term("b", (True,)),)),
+        Term("a", (Term("b", (1.0,)),)),
+        Term("a", ((1, 2),)),
+        Term("a", ((1.0, 2),)),
+        Term("a", ((True, 2),)),
+    ]
+    assert len(set(map(id, distinct))) == len(distinct)
+    assert [repr(each.args[0]) for each in distinct[3:]] == ["(1, 2)", "(1.0, 2)", "(True, 2)"]
+    # unhashable arguments make a new term each time
+    assert Term("a", ([1],)) is not Term("a", ([1],))
+    assert Term("a", ([1],)) == Term("a", ([1],))
+
+
+def test_terms_are_read_only_mappings():
+    tag = Term("post", ("rust", Term("lang", ("en",))))
+    assert not isinstance(tag, dict)
+    assert dict(tag) == {"__func__": "post", "__args__": ["rust", Term("lang", ("en",))]}
+    assert tag.as_dict() == {"__func__": "post", "__args__": ["rust", {"__func__": "lang", "__args__": ["en"]}]}
+    assert tag == tag.as_dict()
+    assert not string_to_pattern("{__func__: post}")(tag, {})
+    assert string_to_pattern("{__func__: post}")(tag.as_dict(), {})
+    with pytest.raises(AttributeError):
+        tag.func = "draft"
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_terms_match_as_their_dict_form(seed):
+    rand = random.Random(seed)
+    tags = [random_tag(rand) for _ in range(200)]
+    as_dicts = [tag.as_dict() if isinstance(tag, Term) else tag for tag in tags]
+    for _ in range(50):
+        source = random_pattern(rand)
+        p = string_to_pattern(source)
+        for tag, as_dict in zip(tags, as_dicts):
+            expected, scope = ChainMap({}, {}), ChainMap({}, {})
+            assert p(tag, scope) == p(as_dict, expected), (source, tag)
+            assert scope.keys() == expected.keys(), (source, tag)
+
+
+INDEX = """\
+@begin ptag-filter-index
+post(_)
+not post(rust)
+@end ptag-filter-index
+@ptag-filter-index|post("rust")|
+@ptag-filter-index|lang(en) or lang(fr)|
+"""
+
+
+def test_filter_index_lists_the_matching_documents(tmp_path):
+    tags = {
+        "a.op": 'post("rust")\ndraft("rust")\nlang(en)',
+        "b.op": 'post("go")\ndraft("rust")',
+        "c.op": 'post("rust")\nlang(fr)',
+        "d.op": "lang(de)",
+    }
+    files = {
+        name: f"@begin ptag-set\n{tag}\n@end ptag-set\n<h1>{name}</h1>\n"
+        for name, tag in tags.items()
+    }
+    includes = "".join(f"@include|{name}|\n" for name in tags)
+    project = write_files(tmp_path, {**files, "index.op": INDEX + includes})
+    code = build(project)["index.html"].decode("utf-8")
+    lists = [part.split("</ul>")[0] for part in code.split("<ul")[1:]]
+    listed = [[name for name in tags if f">{name}<" in each] for each in lists]
+    assert listed == [["b.op"], ["a.op", "c.op"], ["a.op", "c.op"]]
@@ -0,0 +1,179 @@
+from original_posting import registry
+from original_posting.registry import CommandRegistry, CommandScript
+from original_posting.types import Runtime
+import json
+import os
+import pathlib
+import pytest
+
+
+@pytest.fixture
+def scripts(tmp_path, monkeypatch) -> pathlib.Path:
+    directory = tmp_path / "scripts"
+    directory.mkdir()
+    (directory / "foo.py").write_text("", encoding="utf-8")
+    monkeypatch.setattr(Runtime, "search_path", [str(tmp_path / "missing"), str(directory)])
+    return directory
+
+
+def touch_dir(directory: pathlib.Path):
+    # the mtime of a directory may not change within the resolution of the clock
+    stat = os.stat(directory)
+    os.utime(directory, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def count_scans(monkeypatch) -> list[str]:
+    scanned: list[str] = []
+    scan = registry._scan
+
+    def counting_scan(directory, mtime_ns):
+        scanned.append(directory)
+        return scan(directory, mtime_ns)
+
+    monkeypatch.setattr(registry, "_scan", counting_scan)
+    return scanned
+
+
+def test_commands_and_files_are_found(scripts):
+    commands = CommandRegistry()
+    script = commands.find_command("foo")
+    assert script and script.path == str(scripts / "foo.py")
+    assert commands.find_file("foo.py") == script
+    assert commands.find_file("bar.py") is None
+
+
+def test_misses_are_cached_until_a_directory_changes(scripts, monkeypatch):
+    monkeypatch.setattr(registry, "_load_entry_points", lambda: {})
+    scanned = count_scans(monkeypatch)
+    commands = CommandRegistry()
+    for _ in range(100):
+        assert commands.find_command("bar") is None
+    assert scanned == [str(scripts)]
+
+    (scripts / "bar.py").write_text("", encoding="utf-8")
+    touch_dir(scripts)
+    assert commands.find_command("bar") is None  # until the next build refreshes
+    commands.refresh()
+    script = commands.find_command("bar")
+    assert script and script.path == str(scripts / "bar.py")
+    assert scanned == [str(scripts)] * 2
+
+
+def test_rescan_finds_edited_scripts(scripts):
+    commands = CommandRegistry()
+    old = commands.find_command("foo")
+    path = scripts / "foo.py"
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert commands.find_command("foo") == old
+    commands.refresh(rescan=True)
+    new = commands.find_command("foo")
+    assert new and old and new.mtime_ns != old.mtime_ns
+
+
+def test_manifest_takes_precedence(scripts):
+    (scripts / "lib").mkdir()
+    (scripts / "lib" / "foo_v2.py").write_text("", encoding="utf-8")
+    manifest = {"foo": "lib/foo_v2.py", "baz": "lib/foo_v2.py"}
+    (scripts / registry.MANIFEST_NAME).write_text(json.dumps(manifest), encoding="utf-8")
+    commands = CommandRegistry()
+    for name in ["foo", "baz"]:
+        script = commands.find_command(name)
+        assert script and script.path == str(scripts / "lib" / "foo_v2.py")
+
+
+def test_entry_points_come_after_search_directories(scripts, monkeypatch):
+    entry_points = {
+        "foo": CommandScript("my_package.foo", 0),
+        "qux": CommandScript("my_package.qux", 0),
+    }
+    monkeypatch.setattr(registry, "_load_entry_points", lambda: entry_points)
+    commands = CommandRegistry()
+    foo = commands.find_command("foo")
+    assert foo and foo.path == str(scripts / "foo.py")
+    assert commands.find_command("qux") == entry_points["qux"]
+
+
+def test_search_path_changes_are_followed(scripts, tmp_path, monkeypatch):
+    other = tmp_path / "other"
+    other.mkdir()
+    (other / "foo.py").write_text("", encoding="utf-8")
+    commands = CommandRegistry()
+    assert commands.find_command("foo").path == str(scripts / "foo.py")  # type: ignore
+    monkeypatch.setattr(Runtime, "search_path", [str(other), str(scripts)])
+    assert commands.find_command("foo").path == str(other / "foo.py")  # type: ignore
+
+
+SHOUT = """\
+from original_posting import CommandEntry, Context
+
+
+class ShoutCommand(CommandEntry):
+    def __init__(self, ctx: Context):
+        self.ctx = ctx
+
+    def proc(self, args: list[str], _start: int, _stop: int) -> str:
+        return self.ctx.source[_start:_stop].upper() + {suffix!r}
+"""
+
+
+def test_documents_use_the_scripts_of_the_search_path(scripts, tmp_path):
+    from original_posting.parsing import process
+    from original_posting.registry import commands
+    from original_posting.types import OPDocument
+
+    (scripts / "shout.py").write_text(SHOUT.format(suffix="!"), encoding="utf-8")
+    touch_dir(scripts)
+    doc = OPDocument("t.op", tmp_path, tmp_path / "t.op", tmp_path, tmp_path / "t.html", {})
+    assert process("t.op", "@shout|hey| @nope", {}, doc) == "HEY! @nope"
+
+    path = scripts / "shout.py"
+    path.write_text(SHOUT.format(suffix="?"), encoding="utf-8")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    commands.refresh(rescan=True)
+    assert process("t.op", "@shout|hey|", {}, doc) == "HEY?"
+
+
+def test_dangling_links_are_skipped(scripts):
+    (scripts / "gone.py").symlink_to(scripts / "nowhere.py")
+    commands = CommandRegistry()
+    assert commands.find_command("gone") is None
+    assert commands.find_command("foo")
+
+
+@pytest.mark.parametrize("manifest", ["{not json", '["toc.py"]', '{"toc": 1}'])
+def test_malformed_manifests_are_skipped(scripts, monkeypatch, manifest):
+    monkeypatch.setattr(registry, "_load_entry_points", lambda: {})
+    (scripts / registry.MANIFEST_NAME).write_text(manifest, encoding="utf-8")
+    commands = CommandRegistry()
+    with pytest.warns(UserWarning, match="skipped"):
+        assert commands.find_command("foo")
+    assert commands.find_command("toc") is None
+
+
+def test_manifest_entries_of_missing_files_are_skipped(scripts, monkeypatch):
+    monkeypatch.setattr(registry, "_load_entry_points", lambda: {})
+    (scripts / "lib").mkdir()
+    (scripts / "lib" / "bar_v2.py").write_text("", encoding="utf-8")
+    manifest = {"bar": "lib/bar_v2.py", "baz": "lib/missing.py"}
+    (scripts / registry.MANIFEST_NAME).write_text(json.dumps(manifest), encoding="utf-8")
+    commands = CommandRegistry()
+    with pytest.warns(UserWarning, match="'baz'"):
+        script = commands.find_command("bar")
+    assert script and script.path == str(scripts / "lib" / "bar_v2.py")
+    assert commands.find_command("baz") is None
+
+
+def test_builds_skip_the_bad_scripts(tmp_path, monkeypatch):
+    from tests.utils import build, write_files
+
+    extra = tmp_path / "extra"
+    extra.mkdir()
+    (extra / "gone.py").symlink_to(extra / "nowhere.py")
+    (extra / registry.MANIFEST_NAME).write_text("{not json", encoding="utf-8")
+    monkeypatch.setattr(Runtime, "search_path", [str(extra), *Runtime.search_path])
+    project = write_files(tmp_path / "project", {"index.op": "@begin md\n# Title\n@end md\n"})
+    with pytest.warns(UserWarning):
+        outputs = build(project)
+    assert b"<h1>Title</h1>" in outputs["index.html"]
@@ -0,0 +1,127 @@
+from original_posting import search
+from original_posting.search import shard_of, terms
+from tests.utils import build, read_outputs, write_files
+import json
+import pytest
+
+PAGES = {
+    "index.op": "<h1>Home</h1>\n<p>Welcome to the blog</p>\n@include|a.op|\n@include|b.op|\n@include|c.op|\n",
+    "a.op": "<h1>Rust notes</h1>\n<p>Ownership &amp; borrowing in Rust.</p>\n<script>var hidden = 1;</script>\n",
+    "b.op": "<h1>Go notes</h1>\n<p>Goroutines and channels, 并发.</p>\n<!-- secret -->\n",
+    "c.op": "<h1>Misc</h1>\n<p>Notes about the blog, and OP.</p>\n",
+}
+
+
+@pytest.fixture(autouse=True)
+def small_shards(monkeypatch):
+    monkeypatch.setattr(search, "DOCS_PER_SHARD", 2)
+
+
+def dumped(capsys) -> set[str]:
+    """The names of the search files written since the last call, as printed by the build."""
+    return {
+        line.rsplit("/", 1)[1].rstrip(".")
+        for line in capsys.readouterr().out.splitlines()
+        if line.startswith("Dumped ") and "/search/" in line
+    }
+
+
+def lookup(files: dict[str, bytes], term: str) -> list[tuple[str, str]]:
+    """The titles and hrefs of the documents having `term`, as a page searching would."""
+    index = json.loads(files["search/index.json"])
+    shard = shard_of(term.casefold())
+    if shard not in index["terms"]:
+        return []
+    postings = json.loads(files[f"search/terms-{shard}.json"])
+    found = []
+    for doc_id in postings.get(term.casefold(), []):
+        docs = json.loads(files[f"search/docs-{doc_id // index['docs_per_shard']}.json"])
+        found.append(tuple(docs[str(doc_id)]))
+    return found
+
+
+def test_terms():
+    assert terms("<p>Hello, <b>World</b>! hello_2 &amp; <script>x</script> 中文</p>") == {
+        "hello",
+        "world",
+        "hello_2",
+        "中",
+        "文",
+    }
+    assert shard_of("op") == "6f-70" == shard_of("op-cache")
+    assert shard_of("中") == "4e2d"
+
+
+def test_shards(tmp_path):
+    outputs = build(write_files(tmp_path, PAGES), search_index=True)
+    index = json.loads(outputs["search/index.json"])
+    assert (index["format"], index["prefix"], index["docs_per_shard"]) == (1, 2, 2)
+    assert index["docs"] == [0, 1, 2]
+    assert sorted(f"search/terms-{shard}.json" for shard in index["terms"]) == sorted(
+        name for name in outputs if name.startswith("search/terms-")
+    )
+    assert lookup(outputs, "rust") == [("Rust notes", "a.html")]
+    assert lookup(outputs, "Notes") == [("Rust notes", "a.html"), ("Go notes", "b.html"), ("Misc", "c.html")]
+    assert lookup(outputs, "blog") == [("Home", "index.html"), ("Misc", "c.html")]
+    assert lookup(outputs, "并") == [("Go notes", "b.html")]
+    assert lookup(outputs, "hidden") == lookup(outputs, "secret") == lookup(outputs, "nothing") == []
+
+    # every term of every page, and no other, is found
+    pages = {name: terms(code.decode("utf-8")) for name, code in outputs.items() if name.endswith(".html")}
+    for name in index["terms"]:
+        for term, doc_ids in json.loads(outputs[f"search/terms-{name}.json"]).items():
+            assert shard_of(term) == name
+            assert sorted(href for (_, href) in lookup(outputs, term)) == sorted(
+                page for page, page_terms in pages.items() if term in page_terms
+            )
+    assert all(lookup(outputs, term) for page_terms in pages.values() for term in page_terms)
+
+
+def test_edits_rewrite_the_shards_touched(tmp_path, capsys):
+    project = write_files(tmp_path, PAGES)
+    build(project, incremental=True, search_index=True)
+    assert "index.json" in dumped(capsys)
+
+    edited = {"c.op": PAGES["c.op"].replace("OP", "Python")}
+    write_files(project, edited)
+    outputs = build(project, incremental=True, search_index=True)
+    # the shards of "op" and "python", and the list of shards
+    assert dumped(capsys) == {f"terms-{shard_of('op')}.json", f"terms-{shard_of('python')}.json", "index.json"}
+    assert lookup(outputs, "python") == [("Misc", "c.html")]
+    assert lookup(outputs, "op") == []
+
+    # an emptied shard is left for the pages loading it still
+    assert outputs.pop(f"search/terms-{shard_of('op')}.json") == b"{}"
+    fresh = build(write_files(tmp_path / "fresh", {**PAGES, **edited}), search_index=True)
+    assert outputs == fresh
+
+
+def test_a_new_title_rewrites_its_documents_shard(tmp_path, capsys):
+    project = write_files(tmp_path, PAGES)
+    build(project, incremental=True, search_index=True)
+    dumped(capsys)
+    write_files(project, {"b.op": PAGES["b.op"].replace("Go notes", "Notes on Go")})
+    outputs = build(project, incremental=True, search_index=True)
+    # the ids start from 1: b is the document 3, in the shard 1 with a; "on" is a new term
+    assert dumped(capsys) == {"docs-1.json", f"terms-{shard_of('on')}.json", "index.json"}
+    assert lookup(outputs, "go") == [("Notes on Go", "b.html")]
+
+
+def test_removed_documents_leave_the_index(tmp_path):
+    project = write_files(tmp_path, PAGES)
+    build(project, incremental=True, search_index=True)
+    (project / "b.op").unlink()
+    write_files(project, {"index.op": PAGES["index.op"].replace("@include|b.op|\n", "")})
+    build(project, incremental=True, search_index=True)
+    outputs = read_outputs(project / "out")
+    assert lookup(outputs, "goroutines") == []
+    assert lookup(outputs, "notes") == [("Rust notes", "a.html"), ("Misc", "c.html")]
+    assert json.loads(outputs["search/docs-1.json"]) == {"2": ["Rust notes", "a.html"]}
+
+
+def test_unchanged_builds_write_nothing(tmp_path, capsys):
+    project = write_files(tmp_path, PAGES)
+    first = build(project, search_index=True)
+    dumped(capsys)
+    assert build(project, search_index=True) == first
+    assert dumped(capsys) == set()
@@ -0,0 +1,126 @@
+from http.server import HTTPServer
+from original_posting.serve import BadRequest, Daemon, LRUCache, _Handler
+from tests.utils import build, copy_fixture, read_outputs
+import json
+import shutil
+import threading
+import urllib.error
+import urllib.request
+import pytest
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    project = copy_fixture("site", tmp_path)
+    monkeypatch.chdir(project)  # '@include-dir' is relative to it
+    return project
+
+
+@pytest.mark.parametrize("compile", [False, True])
+def test_build_and_render_match_op(project, compile):
+    expected = build(project)
+    shutil.rmtree(project / "out")
+    daemon = Daemon(compile)
+    request = {"entry": str(project / "index.op"), "force": True}
+    result = daemon.build(request)
+    assert read_outputs(project / "out") == expected
+    assert len(result["outputs"]) == len(expected) - 1  # and the image copied
+    assert result["rendered"] == len(result["outputs"])
+    # from memory and from the incremental records
+    assert daemon.build(request)["rendered"] < result["rendered"]
+    assert read_outputs(project / "out") == expected
+
+    # with the Python scope left by the build
+    rendered = daemon.render({"file": str(project / "posts" / "a.op")})
+    assert rendered["title"] == "Post A"
+    assert "Hello from <strong>A</strong>. Demo" in rendered["html"]
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache["a"] = 1
+    cache["b"] = 2
+    assert cache.get("a") == 1
+    cache["c"] = 3
+    assert list(cache) == ["a", "c"]
+
+
+def test_http_api(project):
+    server = HTTPServer(("127.0.0.1", 0), _Handler)
+    server.op_daemon = Daemon()  # type: ignore
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def post(path: str, body: object, **headers: str):
+        headers = {"Content-Type": "application/json", **headers}
+        request = urllib.request.Request(url + path, json.dumps(body).encode("utf-8"), headers)
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.load(response)
+        except urllib.error.HTTPError as e:
+            return e.code, json.load(e)
+
+    try:
+        status, body = post("/build", {"entry": str(project / "index.op"), "force": True})
+        assert status == 200 and body["rendered"]
+        assert (project / "out" / "index.html").exists()
+        status, body = post("/render", {"file": str(project / "parts" / "c.op")})
+        assert status == 200 and body["title"] == "Part C"
+        assert post("/render", {})[0] == 400
+        assert post("/render", [])[0] == 400
+        assert post("/nope", {})[0] == 404
+        status, body = post("/render", {"file": str(project / "missing.op")})
+        assert status == 500 and "missing.op" in body["error"]
+        with urllib.request.urlopen(url + "/status") as response:
+            assert json.load(response)["documents"] > 0
+
+        # what a web page visited may send
+        build = {"entry": str(project / "index.op"), "force": True}
+        assert post("/build", build, **{"Content-Type": "text/plain"})[0] == 415
+        assert post("/build", build, Host="evil.example:80")[0] == 403
+        assert post("/build", build, Origin="http://evil.example")[0] == 403
+        assert post("/build", build, Origin=f"http://localhost:{server.server_address[1]}")[0] == 200
+        request = urllib.request.Request(url + "/status", headers={"Host": "evil.example"})
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(request)
+        assert e.value.code == 403
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize(
+    "request_, error",
+    [
+        ({"entry": "index.op"}, "project_path"),
+        ({"entry": "index.op", "project_path": "relative"}, "project_path"),
+        ({"entry": "/etc/passwd", "project_path": "{project}"}, "'entry' must be inside"),
+        ({"entry": "index.op", "project_path": "{project}", "out": "../elsewhere"}, "'out' must be inside"),
+        ({"entry": "index.op", "project_path": "{project}", "out": "/tmp"}, "'out' must be inside"),
+        ({"entry": "index.op", "project_path": "{project}", "suffix": "/../../x.html"}, "suffix"),
+        ({"file": "posts/a.op"}, "project_path"),
+        ({"file": "../a.op", "project_path": "{project}"}, "'file' must be inside"),
+    ],
+)
+def test_paths_outside_the_project_are_refused(project, request_, error):
+    daemon = Daemon()
+    request_ = {k: v.format(project=project) if isinstance(v, str) else v for k, v in request_.items()}
+    with pytest.raises(BadRequest, match=error):
+        if "entry" in request_:
+            daemon.build(request_)
+        else:
+            daemon.render(request_)
+    assert not (project / "out").exists()
+
+
+def test_relative_paths_are_resolved_against_the_project(project, tmp_path, monkeypatch):
+    daemon = Daemon()
+    result = daemon.build({"entry": "index.op", "project_path": str(project), "out": "site/out"})
+    assert str(project / "site" / "out" / "index.html") in result["outputs"]
+    # not against the working directory of the daemon
+    (tmp_path / "posts").mkdir()
+    (tmp_path / "posts" / "a.op").write_text("<h1>Elsewhere</h1>\n", encoding="utf-8")
+    monkeypatch.chdir(tmp_path)
+    rendered = daemon.render({"file": "posts/a.op", "project_path": str(project)})
+    assert rendered["title"] == "Post A"
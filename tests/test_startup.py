@@ -0,0 +1,30 @@
+from tests.utils import ROOT, run_op, write_files
+import subprocess
+import sys
+
+HEAVY = ["bs4", "pygments", "mistletoe", "latex2mathml", "yaml", "diskcache"]
+
+
+def test_build_stack_imports_no_command_library():
+    script = (
+        "import sys\n"
+        "import original_posting.cli, original_posting.build, original_posting.parsing\n"
+        f"print(' '.join(m for m in {HEAVY!r} if m in sys.modules))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == ""
+
+
+def test_startup_report(tmp_path):
+    project = write_files(tmp_path, {"a.op": "@begin md\n# A\n\n*hi*\n@end md\n"})
+    run_op(project, "a.op", "--force")
+    plain = (project / "out" / "a.html").read_bytes()
+    result = run_op(project, "a.op", "--force", "--startup_report")
+    assert (project / "out" / "a.html").read_bytes() == plain
+    rows = [line.split() for line in result.stderr.splitlines()]
+    assert rows[0] == ["ms", "kind", "name"]
+    assert ["command", "md"] in [row[1:] for row in rows]
+    assert ["module", "mistletoe"] in [row[1:] for row in rows]
+    assert rows[-1][1:] == ["total", "build"]
@@ -0,0 +1,60 @@
+from original_posting.build import Build, BuildOptions
+from tests.utils import build, copy_fixture, write_files
+import re
+
+INDEX = """\
+@begin py
+def fmt(doc):
+    return "* " + (doc.title or doc.project_based_path)
+@end py
+@begin set-index-format
+fmt
+@end set-index-format
+@ptag-filter-index|post(~x)|
+@include|a.op|
+@include|b.op|
+@include|c.op|
+"""
+
+PAGES = {
+    "index.op": INDEX,
+    "a.op": "@ptag-set|post(1)|\n@begin md\n# Post *A* &amp; more\n\ntext\n\n# Second\n@end md\n",
+    "b.op": "@ptag-set|post(2)|\n@begin md\nno heading\n@end md\n",
+    "c.op": '@ptag-set|post(3)|\n<h1 class="t">Raw <b>C</b></h1>\n',
+}
+
+
+def listed(code: bytes) -> list[str]:
+    return re.findall(r'<a href="[^"]*">([^<]*)</a>', code.decode("utf-8"))
+
+
+def test_index_formatters_see_the_titles(tmp_path):
+    project = write_files(tmp_path, PAGES)
+    outputs = build(project)
+    assert listed(outputs["index.html"]) == ["* Post A &amp; more", "* b.op", "* Raw C"]
+
+
+def test_titles_are_known_without_parsing_pages(tmp_path, monkeypatch):
+    project = write_files(tmp_path, PAGES)
+    monkeypatch.chdir(project)
+    opts = BuildOptions(force=True, suffix=".html", outdir="out")
+    build = Build(project, [str(project / "index.op")], opts)
+    build.build_all()
+    titles = {path: doc.title for path, doc in build.built_docs.items()}
+    assert titles == {"index.op": "", "a.op": "Post A & more", "b.op": "", "c.op": "Raw C"}
+    # only the index, for its list
+    assert {path for path, (parses, _) in build.dom_counts.items() if parses} == {"index.op"}
+
+
+def test_site_titles(tmp_path):
+    project = copy_fixture("site", tmp_path)
+    index = build(project)["index.html"]
+    # parts/d.op has no heading of its own, but includes the source of posts/b.op
+    assert listed(index)[4:10] == [
+        "* Post A",
+        "* Post B",
+        "* Part C",
+        "* Post B",
+        "* Post A",
+        "* Part C",
+    ]
@@ -0,0 +1,104 @@
+from original_posting.types import DEFAULT_SCRIPT_PATH_INTERNAL, OPDocument
+from original_posting.utils import load_from_source, make_valid_identifier
+from tests.utils import build, write_files
+import bs4
+import itertools
+import pathlib
+import random
+import pytest
+
+toc = load_from_source(str(pathlib.Path(DEFAULT_SCRIPT_PATH_INTERNAL) / "toc.py"))
+
+
+def reference_toc(depth, max_depth, nodes, doc, gensym) -> bs4.Tag:
+    """The walk of the headings before `HeadingIndex`, with the same names."""
+    tag_name = f"h{depth}"
+    ul = doc.new_tag("ul")
+
+    def add_sub(n: bs4.Tag):
+        title = n.text
+        address = gensym(make_valid_identifier(title))
+        n.insert(0, doc.new_tag("div", id=address))
+        li = doc.new_tag("li")
+        a = doc.new_tag("a", href="#" + address)
+        a.append(title)
+        li.append(a)
+        if depth <= max_depth:
+            parent = n.parent
+            assert parent
+            i = parent.index(n) + 1
+            next_level_nodes = []
+            while i < len(parent.contents):
+                sibling = parent.contents[i]
+                if isinstance(sibling, bs4.Tag):
+                    if sibling.name == tag_name:
+                        break
+                    next_level_nodes.append(sibling)
+                i += 1
+            li.append(reference_toc(depth + 1, max_depth, next_level_nodes, doc, gensym))
+        ul.append(li)
+
+    for node in nodes:
+        if not isinstance(node, bs4.Tag):
+            continue
+        if node.name == tag_name:
+            add_sub(node)
+        for n in node.find_all(tag_name):
+            add_sub(n)
+    return ul
+
+
+def random_page(rand: random.Random, size: int) -> str:
+    def block(level: int) -> str:
+        r = rand.random()
+        if r < 0.5:
+            n = rand.randint(1, 5)
+            # a few titles repeat, with the same names before the numbering
+            return f"<h{n}>T{rand.randint(0, 4)}</h{n}>"
+        if r < 0.75 or level > 3:
+            return f"<p>text {rand.randint(0, 9)}</p>"
+        inner = "".join(block(level + 1) for _ in range(rand.randint(0, 4)))
+        return f"<section>{inner}</section>"
+
+    return "\n".join(block(0) for _ in range(size))
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_toc_matches_the_reference(tmp_path, seed):
+    rand = random.Random(seed)
+    page = random_page(rand, rand.randint(1, 30))
+    max_depth = rand.randint(1, 4)
+
+    expected_soup = bs4.BeautifulSoup(page, "html.parser")
+    counter = itertools.count()
+    expected = reference_toc(
+        1, max_depth, [expected_soup], expected_soup, lambda name: f"{name}_{next(counter)}"
+    )
+
+    soup = bs4.BeautifulSoup(page, "html.parser")
+    doc = OPDocument("t.op", tmp_path, tmp_path / "t.op", tmp_path, tmp_path / "t.html", {})
+    index = toc.HeadingIndex(soup, max_depth + 1)
+    actual = toc.generate_toc(1, max_depth, 0, index.end[id(soup)], index, soup, doc)
+
+    assert str(actual) == str(expected)
+    assert str(soup) == str(expected_soup)
+
+
+def test_toc_command(tmp_path):
+    source = "@toc|--depth 2|\n@begin md\n# A\n## B\n### C\n#### D\n## E\n# F\n@end md\n"
+    code = build(write_files(tmp_path, {"index.op": source}))["index.html"].decode("utf-8")
+    soup = bs4.BeautifulSoup(code, "html.parser")
+
+    def tree(ul: bs4.Tag) -> list:
+        return [
+            (li.a.text, [tree(sub) for sub in li.find_all("ul", recursive=False)])
+            for li in ul.find_all("li", recursive=False)
+        ]
+
+    assert tree(soup.find("div", {"class": "toc"}).ul) == [  # type: ignore
+        ("A", [[("B", [[("C", [])]]), ("E", [[]])]]),
+        ("F", [[]]),
+    ]
+    for a in soup.find("div", {"class": "toc"}).find_all("a"):  # type: ignore
+        assert soup.find("div", id=a["href"][1:])
+    assert soup.title and soup.title.text == "A"
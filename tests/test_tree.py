@@ -0,0 +1,106 @@
+from original_posting.parsing import (
+    BlockNode,
+    InlineNode,
+    OperatorNode,
+    SourceTree,
+    TextNode,
+    _end_scope,
+    _handle_operator,
+    _new_scope,
+    _new_scope_inline,
+    new_context,
+    parse,
+    process,
+    process_iter,
+)
+from original_posting.types import OPDocument, Scope
+import io
+import pathlib
+import pytest
+
+SOURCE = """\
+Title @py|1 + 1| and @(op)
+@begin plain
+kept @py|2|
+@end plain
+@begin comment
+dropped
+@end comment
+tail \\@py|3|
+"""
+
+EXPECTED = "Title 2 and op\nkept @py|2|\ntail py|3|\n"
+
+
+def make_doc(tmp_path: pathlib.Path) -> OPDocument:
+    return OPDocument(
+        "t.op", tmp_path, tmp_path / "t.op", tmp_path, tmp_path / "t.html", {}
+    )
+
+
+def test_parse_makes_nodes_without_running_commands(tmp_path):
+    ctx = new_context("t.op", SOURCE, {}, make_doc(tmp_path))
+    nodes = parse(ctx, 0, len(SOURCE))
+    assert [type(node) for node in nodes] == [
+        TextNode,
+        InlineNode,
+        TextNode,
+        OperatorNode,
+        TextNode,
+        BlockNode,
+        BlockNode,
+        TextNode,  # the escaping backslash is dropped between two runs
+        TextNode,
+    ]
+    plain = nodes[5]
+    assert isinstance(plain, BlockNode)
+    assert plain.name == "plain"
+    assert SOURCE[plain.start : plain.end] == "kept @py|2|\n"
+
+
+def test_tree_is_reused_after_a_round_trip(tmp_path):
+    tree = SourceTree()
+    assert process("t.op", SOURCE, {}, make_doc(tmp_path), tree=tree) == EXPECTED
+    digest = tree.source_digest(SOURCE)
+    restored = SourceTree.loads(tree.dumps(digest), digest)
+    assert restored.spans == tree.spans
+    assert process("t.op", SOURCE, {}, make_doc(tmp_path), tree=restored) == EXPECTED
+    assert not restored.dirty
+
+
+def test_tree_of_another_source_is_dropped(tmp_path):
+    tree = SourceTree()
+    process("t.op", SOURCE, {}, make_doc(tmp_path), tree=tree)
+    assert SourceTree.loads(tree.dumps("old"), "new").spans == {}
+
+
+def test_process_iter_loop(tmp_path):
+    ctx = new_context("t.op", SOURCE, {}, make_doc(tmp_path))
+    buf = io.StringIO()
+    with pytest.deprecated_call():
+        while process_iter(buf, ctx):
+            pass
+    assert buf.getvalue() == EXPECTED
+
+
+def test_scope_helpers(tmp_path):
+    source = "@begin plain\nbody\n@end plain\n@(x)@py|1|"
+    ctx = new_context("t.op", source, {}, make_doc(tmp_path))
+    buf = io.StringIO()
+    _new_scope(ctx, 0)
+    assert ctx.cur_scope and ctx.cur_scope.name == "plain"
+    assert (ctx.cur_scope.start_line, ctx.cur_scope.start_col) == (1, 0)
+    end = source.index("@end")
+    assert _end_scope(buf, ctx, end)
+    ctx.cur_scope = None
+    at = source.index("@(")
+    assert not _new_scope_inline(buf, ctx, at)
+    assert _handle_operator(buf, ctx, at)
+    assert not _handle_operator(buf, ctx, ctx.pos)
+    assert _new_scope_inline(buf, ctx, ctx.pos)
+    assert buf.getvalue() == "body\nx1"
+
+
+def test_scope_takes_positions_positionally():
+    scope = Scope("raw-include", None, 0, [], 3, 4)  # type: ignore
+    assert (scope.start_line, scope.start_col) == (3, 4)
@@ -0,0 +1,67 @@
+from original_posting import watch
+from tests.utils import ROOT, copy_fixture
+import os
+import pathlib
+import subprocess
+import sys
+import threading
+import time
+import pytest
+
+
+def wait_for(predicate, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+@pytest.mark.parametrize("make", [watch.PollingWatcher, watch.InotifyWatcher])
+def test_watcher_reports_changed_files(tmp_path, monkeypatch, make):
+    if make is watch.InotifyWatcher:
+        pytest.importorskip("inotify_simple")
+    monkeypatch.setattr(watch, "POLL_INTERVAL", 0.01)
+    (tmp_path / "out").mkdir()
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "a.op").write_text("a")
+    watcher = make([str(tmp_path)], frozenset([str(tmp_path / "out")]))
+    (tmp_path / "out" / "a.html").write_text("ignored")
+    (tmp_path / "sub" / "b.op").write_text("b")
+    assert watcher.wait() == {str(tmp_path / "sub" / "b.op")}
+
+
+def test_watch_rebuilds_on_changes(tmp_path):
+    project = copy_fixture("site", tmp_path)
+    env = dict(os.environ, PYTHONPATH=str(ROOT), PYTHONUNBUFFERED="1")
+    process = subprocess.Popen(
+        [sys.executable, "-c", "from original_posting.cli import main; main()"]
+        + ["index.op", "--force", "--watch"],
+        cwd=project,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    output: list[str] = []
+    reader = threading.Thread(target=lambda: output.extend(process.stdout), daemon=True)  # type: ignore
+    reader.start()
+
+    def built(n: int):
+        def check():
+            assert process.poll() is None, "op --watch exited:\n" + "".join(output)
+            return sum(line.startswith("Built in") for line in output) >= n
+
+        return check
+
+    try:
+        wait_for(built(1))
+        index_html: pathlib.Path = project / "out" / "index.html"
+        assert b"Index of Demo" in index_html.read_bytes()
+        time.sleep(0.1)  # a change within the same mtime tick could go unseen
+        index = project / "index.op"
+        index.write_text(index.read_text().replace("Index of", "Contents of"))
+        wait_for(built(2))
+        assert b"Contents of Demo" in index_html.read_bytes()
+    finally:
+        process.kill()
+        process.wait()
@@ -0,0 +1,68 @@
+"""
+Helpers building projects in the tests, from the projects under
+`tests/fixtures` or from files given inline.
+"""
+from __future__ import annotations
+from original_posting.build import Build, BuildOptions
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+
+ROOT = pathlib.Path(__file__).parent.parent
+FIXTURES = ROOT / "tests" / "fixtures"
+
+
+def copy_fixture(name: str, dest: pathlib.Path) -> pathlib.Path:
+    project = dest / name
+    shutil.copytree(FIXTURES / name, project)
+    return project
+
+
+def write_files(project: pathlib.Path, files: dict[str, str]) -> pathlib.Path:
+    for name, text in files.items():
+        path = project / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding="utf-8")
+    return project
+
+
+def read_outputs(outdir: pathlib.Path) -> dict[str, bytes]:
+    """The files under `outdir`, by path relative to it."""
+    return {
+        path.relative_to(outdir).as_posix(): path.read_bytes()
+        for path in sorted(outdir.rglob("*"))
+        if path.is_file()
+    }
+
+
+def build(
+    project: pathlib.Path, entry: str = "index.op", out: str = "out", **options
+) -> dict[str, bytes]:
+    """
+    Build `entry` in this process, from `project` as the working directory
+    like `op`, and return the outputs.
+    """
+    opts = BuildOptions(force=True, suffix=".html", outdir=out, **options)
+    cwd = os.getcwd()
+    os.chdir(project)
+    try:
+        Build(project, [str(project / entry)], opts).build_all()
+    finally:
+        os.chdir(cwd)
+    return read_outputs(project / out)
+
+
+def run_op(project: pathlib.Path, *args: str) -> subprocess.CompletedProcess:
+    """Run `op` with `args` in a new process, in `project`."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")]))
+    return subprocess.run(
+        [sys.executable, "-c", "from original_posting.cli import main; main()", *args],
+        cwd=project,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )